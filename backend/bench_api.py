@@ -0,0 +1,340 @@
+"""
+Load test: drive a realistic traffic mix against the API at a target rate
+
+Requests are sent open-loop at --rps (each request is timed from its
+scheduled start, so server slowdowns show up as latency instead of a lower
+send rate). The default mix covers catalog browsing, car detail, login and
+token refresh, and chat as a guest, as a signed-in user, with selected cars
+and in car-specific mode.
+
+By default the app runs in-process (httpx ASGITransport) against a fresh
+SQLite database seeded from db_data.csv, with the fake LLM and embedding
+backends so no models are needed. Pass --base-url to load test a running
+server instead.
+
+Usage:
+    python bench_api.py [--rps 20] [--duration 30] [--llm-profile gpu] [--json results.json]
+    python bench_api.py --base-url http://localhost:8000 --rps 5
+    python bench_api.py --mix "POST /api/chatbot/stream (guest)=10" --mix "GET /api/cars=0"
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter, defaultdict
+
+import httpx
+
+DEFAULT_MIX = {
+    "GET /api/cars": 25,
+    "GET /api/cars/{car_id}": 20,
+    "GET /api/cars/comparison": 5,
+    "POST /auth/login": 5,
+    "POST /auth/refresh": 5,
+    "POST /api/chatbot (guest)": 12,
+    "POST /api/chatbot (auth)": 10,
+    "POST /api/chatbot (auth, selected cars)": 8,
+    "POST /api/chatbot/car/{car_id}": 5,
+    "POST /api/chatbot/stream (guest)": 5,
+}
+
+CHAT_MESSAGES = [
+    "What is the price of the X5?",
+    "Show me SUVs under $60,000",
+    "Which BMW is best for a family of five?",
+    "Compare the 3 Series and the 5 Series",
+    "Tell me about electric BMWs with good range",
+    "horsepower of the 2015 M3",
+    "Is the X3 a good first luxury car?",
+    "What safety features does the i4 have?",
+]
+
+PASSWORD = "BenchPass123!"
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+class BenchContext:
+    """Data the scenarios draw from: car IDs and signed-in bench users"""
+    def __init__(self, rng):
+        self.rng = rng
+        self.car_ids = []
+        self.users = []  # {"email", "access_token", "refresh_token"}
+
+    def car_id(self):
+        return self.rng.choice(self.car_ids)
+
+    def user(self):
+        return self.rng.choice(self.users)
+
+    def message(self):
+        return self.rng.choice(CHAT_MESSAGES)
+
+
+def auth(user):
+    return {"Authorization": f"Bearer {user['access_token']}"}
+
+
+async def chat_stream(client, payload, headers=None):
+    """Consume a streaming chat response; NDJSON error events count as failures"""
+    async with client.stream("POST", "/api/chatbot/stream", json=payload, headers=headers) as response:
+        last = ""
+        async for line in response.aiter_lines():
+            if line:
+                last = line
+        if response.status_code < 400 and last and json.loads(last).get("type") == "error":
+            return httpx.Response(500, request=response.request)
+        return response
+
+
+SCENARIOS = {
+    "GET /api/cars": lambda c, ctx: c.get("/api/cars"),
+    "GET /api/cars/{car_id}": lambda c, ctx: c.get(f"/api/cars/{ctx.car_id()}"),
+    "GET /api/cars/comparison": lambda c, ctx: c.get("/api/cars/comparison"),
+    "POST /auth/login": lambda c, ctx: c.post("/auth/login", json={"email": ctx.user()["email"], "password": PASSWORD}),
+    "POST /auth/refresh": lambda c, ctx: c.post("/auth/refresh", json={"refresh_token": ctx.user()["refresh_token"]}),
+    "POST /api/chatbot (guest)": lambda c, ctx: c.post("/api/chatbot", json={"message": ctx.message()}),
+    "POST /api/chatbot (auth)": lambda c, ctx: c.post(
+        "/api/chatbot", json={"message": ctx.message()}, headers=auth(ctx.user())
+    ),
+    "POST /api/chatbot (auth, selected cars)": lambda c, ctx: c.post(
+        "/api/chatbot",
+        json={"message": ctx.message(), "selected_cars": [str(ctx.car_id()), str(ctx.car_id())]},
+        headers=auth(ctx.user())
+    ),
+    "POST /api/chatbot/car/{car_id}": lambda c, ctx: c.post(
+        f"/api/chatbot/car/{ctx.car_id()}", json={"message": ctx.message()}, headers=auth(ctx.user())
+    ),
+    "POST /api/chatbot/stream (guest)": lambda c, ctx: chat_stream(c, {"message": ctx.message()}),
+}
+
+
+def seed_database(db_url):
+    """Create the schema and load the car catalog into a fresh database"""
+    from sqlmodel import Session, SQLModel, create_engine
+    from import_car_data_from_csv import create_car_from_row
+
+    engine = create_engine(db_url)
+    SQLModel.metadata.create_all(engine)
+    with open("db_data.csv", "r", encoding="utf-8") as f, Session(engine) as session:
+        for row in csv.DictReader(f):
+            if row.get("model_name"):
+                session.add(create_car_from_row(row))
+        session.commit()
+    engine.dispose()
+
+
+async def setup(client, ctx, users):
+    """Wait for chat to be ready, then collect car IDs and sign in bench users"""
+    deadline = time.monotonic() + 300
+    while not (await client.get("/health")).json().get("retriever_ready"):
+        if time.monotonic() > deadline:
+            raise RuntimeError("Retriever did not become ready within 5 minutes")
+        await asyncio.sleep(0.5)
+
+    cars = (await client.get("/api/cars")).json()["cars"]
+    ctx.car_ids = [car["id"] for car in cars]
+
+    run_id = uuid.uuid4().hex[:8]
+    # Email and phone number must be unique per user
+    phone_prefix = str(int(run_id, 16) % 10**5).zfill(5)
+    for i in range(users):
+        email = f"bench{i}_{run_id}@example.com"
+        response = await client.post("/auth/register", json={
+            "name": f"Bench User {i}", "email": email, "number": f"{phone_prefix}{i:05d}", "password": PASSWORD,
+            "door_no": "1", "street": "Bench Street", "city": "Munich", "state": "Bavaria", "zipcode": "80331"
+        })
+        if response.status_code != 201:
+            raise RuntimeError(f"Registering bench user failed ({response.status_code}): {response.text}")
+        body = response.json()
+        ctx.users.append({"email": email, "access_token": body["access_token"], "refresh_token": body["refresh_token"]})
+
+
+async def run_load(client, ctx, mix, rps, duration, max_in_flight):
+    """
+    Open-loop load: one request every 1/rps seconds for duration seconds;
+    requests that would exceed max_in_flight are dropped and counted
+    """
+    names = [name for name, weight in mix.items() if weight > 0]
+    weights = [mix[name] for name in names]
+    samples = defaultdict(list)  # name -> [(latency ms, status)]
+    dropped = Counter()
+    in_flight = 0
+
+    async def one(name, scheduled):
+        nonlocal in_flight
+        try:
+            response = await SCENARIOS[name](client, ctx)
+            outcome = response.status_code
+        except Exception as e:
+            outcome = type(e).__name__
+        finally:
+            in_flight -= 1
+        samples[name].append(((time.perf_counter() - scheduled) * 1000, outcome))
+
+    loop_start = time.perf_counter()
+    tasks = []
+    for i in range(int(rps * duration)):
+        scheduled = loop_start + i / rps
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        name = ctx.rng.choices(names, weights)[0]
+        if in_flight >= max_in_flight:
+            dropped[name] += 1
+            continue
+        in_flight += 1
+        tasks.append(asyncio.create_task(one(name, scheduled)))
+    await asyncio.gather(*tasks)
+    return samples, dropped, time.perf_counter() - loop_start
+
+
+def summarize(samples, dropped, elapsed):
+    def stats(entries, dropped_count):
+        latencies = [latency for latency, _ in entries]
+        errors = sum(1 for _, outcome in entries if not (isinstance(outcome, int) and outcome < 400))
+        total = len(entries) + dropped_count
+        result = {
+            "requests": len(entries),
+            "dropped": dropped_count,
+            "errors": errors,
+            "error_rate": round((errors + dropped_count) / total, 4) if total else 0.0,
+            "throughput_rps": round(len(entries) / elapsed, 2),
+            "statuses": dict(Counter(str(outcome) for _, outcome in entries)),
+        }
+        if latencies:
+            result.update({
+                "p50_ms": round(percentile(latencies, 50), 1),
+                "p95_ms": round(percentile(latencies, 95), 1),
+                "p99_ms": round(percentile(latencies, 99), 1),
+                "mean_ms": round(statistics.mean(latencies), 1),
+                "max_ms": round(max(latencies), 1),
+            })
+        return result
+
+    endpoints = {name: stats(samples.get(name, []), dropped.get(name, 0)) for name in sorted(set(samples) | set(dropped))}
+    overall = stats([entry for entries in samples.values() for entry in entries], sum(dropped.values()))
+    return endpoints, overall
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def parse_mix(overrides):
+    mix = dict(DEFAULT_MIX)
+    for override in overrides or []:
+        name, _, weight = override.rpartition("=")
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario {name!r}; choose from: {', '.join(SCENARIOS)}")
+        mix[name] = float(weight)
+    return mix
+
+
+async def main_async(args):
+    rng = random.Random(args.seed)
+    ctx = BenchContext(rng)
+    mix = parse_mix(args.mix)
+    timeout = httpx.Timeout(args.timeout)
+
+    if args.base_url:
+        client = httpx.AsyncClient(base_url=args.base_url, timeout=timeout)
+        lifespan = None
+    else:
+        import main as app_module
+
+        app = app_module.app
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=timeout)
+        lifespan = app.router.lifespan_context(app)
+
+    async with client:
+        if lifespan is not None:
+            await lifespan.__aenter__()
+        try:
+            await setup(client, ctx, args.users)
+            samples, dropped, elapsed = await run_load(client, ctx, mix, args.rps, args.duration, args.max_in_flight)
+        finally:
+            if lifespan is not None:
+                await lifespan.__aexit__(None, None, None)
+
+    endpoints, overall = summarize(samples, dropped, elapsed)
+    return {
+        "revision": git_revision(),
+        "mode": "http" if args.base_url else "in-process",
+        "config": {
+            "rps": args.rps,
+            "duration_s": args.duration,
+            "max_in_flight": args.max_in_flight,
+            "users": args.users,
+            "seed": args.seed,
+            "llm_backend": None if args.base_url else os.environ.get("LLM_BACKEND"),
+            "llm_profile": None if args.base_url else os.environ.get("FAKE_LLM_PROFILE"),
+            "mix": mix,
+        },
+        "elapsed_s": round(elapsed, 2),
+        "overall": overall,
+        "endpoints": endpoints,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default=None, help="Load test a running server instead of the in-process app")
+    parser.add_argument("--rps", type=float, default=20)
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of load")
+    parser.add_argument("--max-in-flight", type=int, default=200, help="Drop requests beyond this many outstanding")
+    parser.add_argument("--users", type=int, default=5, help="Bench users to register for authenticated traffic")
+    parser.add_argument("--mix", action="append", help='Override a scenario weight, e.g. "GET /api/cars=0"')
+    parser.add_argument("--llm-profile", default="gpu", help="Fake LLM profile for in-process runs (instant|gpu|cpu)")
+    parser.add_argument("--db-url", default=None, help="Database for in-process runs (default: fresh temp SQLite)")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", dest="json_path", default=None, help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    if not args.base_url:
+        # Configure the in-process app before it is imported
+        os.environ.setdefault("LLM_BACKEND", "fake")
+        os.environ.setdefault("EMBEDDINGS_BACKEND", "fake")
+        os.environ["FAKE_LLM_PROFILE"] = args.llm_profile
+        if args.db_url is None:
+            args.db_url = f"sqlite:///{tempfile.mkdtemp(prefix='bench_api_')}/bench.db"
+            seed_database(args.db_url)
+        os.environ["DB_URL"] = args.db_url
+
+    results = asyncio.run(main_async(args))
+
+    print(f"API load test: {args.rps} rps for {args.duration}s ({results['mode']}, revision {results['revision']})")
+    print(f"{'endpoint':<42}{'reqs':>6}{'err%':>7}{'rps':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for name, r in list(results["endpoints"].items()) + [("overall", results["overall"])]:
+        print(
+            f"{name:<42}{r['requests']:>6}{r['error_rate'] * 100:>7.1f}{r['throughput_rps']:>7}"
+            f"{r.get('p50_ms', '-'):>9}{r.get('p95_ms', '-'):>9}{r.get('p99_ms', '-'):>9}"
+        )
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
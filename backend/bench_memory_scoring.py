@@ -0,0 +1,118 @@
+"""
+Micro-benchmark: scoring chat memory candidates
+
+Times scoring --candidates memory entries (plain rows) against one message,
+in memory (no database), two ways:
+
+- loop: calculate_relevance_score per entry, as get_relevant_context did
+  before, re-classifying the current message's intent and car models and
+  intersecting keyword/model sets for every entry
+- vectorized: score_candidates over keyword/model bitmasks (popcounts) and
+  NumPy arrays of intent matches, entry ages and importance
+
+Usage:
+    python bench_memory_scoring.py [--candidates 100,1000,10000] [--repeat 20] [--json results.json]
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from chat_memory_controller import (
+    CAR_MODEL_VOCABULARY, KEYWORD_VOCABULARY, ChatMemoryController, keyword_mask, model_mask, score_candidates
+)
+
+# Plain rows, like the column query in get_relevant_context returns
+Candidate = namedtuple("Candidate", "keywords car_models_mentioned keyword_mask model_mask intent importance_score created_at")
+
+QUERY = "Compare the price of the 2015 X5 and the 3 series"
+
+
+def make_entries(count, rng):
+    now = datetime.utcnow()
+    entries = []
+    for _ in range(count):
+        keywords = rng.sample(KEYWORD_VOCABULARY, rng.randint(0, 5))
+        models = rng.sample(CAR_MODEL_VOCABULARY, rng.randint(0, 3))
+        entries.append(Candidate(
+            keywords=json.dumps(keywords), car_models_mentioned=json.dumps(models),
+            keyword_mask=keyword_mask(keywords), model_mask=model_mask(models),
+            intent=rng.choice(["comparison", "pricing", "specifications", "recommendation", "general"]),
+            importance_score=rng.choice([0.5, 0.7, 0.8, 1.0]),
+            created_at=now - timedelta(minutes=rng.randint(0, 30 * 24 * 60))
+        ))
+    return entries
+
+
+def score_loop(controller, entries):
+    keywords = controller.extract_keywords(QUERY)
+    return [controller.calculate_relevance_score(entry, keywords, QUERY) for entry in entries]
+
+
+def score_vectorized(controller, entries):
+    keywords = controller.extract_keywords(QUERY)
+    now = datetime.utcnow()
+    return score_candidates(
+        np.array([entry.keyword_mask for entry in entries], dtype=np.int64),
+        np.array([entry.model_mask for entry in entries], dtype=np.int64),
+        np.array([entry.intent for entry in entries], dtype=object) == controller.classify_intent(QUERY),
+        np.array([(now - entry.created_at).days for entry in entries], dtype=np.int64),
+        np.array([entry.importance_score for entry in entries], dtype=np.float64),
+        keyword_mask(keywords), model_mask(controller.extract_car_models(QUERY))
+    )
+
+
+def time_fn(fn, repeat):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return {"p50_ms": round(latencies[len(latencies) // 2], 3), "mean_ms": round(statistics.mean(latencies), 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--candidates", default="100,1000,10000", help="Comma-separated candidate counts")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed runs per count and variant")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", dest="json_path", default=None, help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    controller = ChatMemoryController()
+    rng = random.Random(args.seed)
+    results = {"numpy": np.__version__, "popcount": "bitwise_count" if hasattr(np, "bitwise_count") else "byte table", "sizes": []}
+    for count in [int(n) for n in args.candidates.split(",")]:
+        entries = make_entries(count, rng)
+        loop = time_fn(lambda: score_loop(controller, entries), args.repeat)
+        vectorized = time_fn(lambda: score_vectorized(controller, entries), args.repeat)
+        results["sizes"].append({
+            "candidates": count,
+            "loop": loop,
+            "vectorized": vectorized,
+            "speedup": round(loop["mean_ms"] / vectorized["mean_ms"], 1) if vectorized["mean_ms"] else None,
+            "same_scores": bool(np.allclose(score_loop(controller, entries), score_vectorized(controller, entries))),
+        })
+
+    print(f"Candidate scoring (numpy {results['numpy']}, popcount: {results['popcount']}, {args.repeat} runs)")
+    print(f"{'candidates':>10}  {'loop p50 ms':>12}{'mean ms':>10}  {'vectorized p50 ms':>18}{'mean ms':>10}  {'speedup':>8}{'same':>6}")
+    for size in results["sizes"]:
+        loop, vectorized = size["loop"], size["vectorized"]
+        print(
+            f"{size['candidates']:>10}  {loop['p50_ms']:>12}{loop['mean_ms']:>10}"
+            f"  {vectorized['p50_ms']:>18}{vectorized['mean_ms']:>10}  {size['speedup']:>7}x{str(size['same_scores']):>6}"
+        )
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmark: Ollama prefill time per conversation turn, v1 vs v2 prompt layout
+
+v1 templates put the retrieved data above the instructions, so every turn
+invalidates Ollama's prompt cache almost from the start. v2 templates keep
+the static instructions first, so only the tail after them is re-evaluated
+on later turns. Both layouts replay the same conversation; Ollama's
+prompt_eval_count / prompt_eval_duration are reported per turn.
+
+Needs a running Ollama with the chat model pulled; exits without error if
+none is reachable.
+
+Usage:
+    python bench_prefill.py [--base-url http://localhost:11434] [--json results.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+
+import httpx
+
+from llama import OLLAMA_KEEP_ALIVE, OLLAMA_MODEL, OLLAMA_NUM_CTX, _build_memory_chain
+from prompts import prompt_registry
+from vector import load_car_documents
+
+QUESTIONS = [
+    ("What is the price of the X5?", "X5"),
+    ("How much horsepower does it have?", "X5"),
+    ("What about the X3?", "X3"),
+    ("Which of those is more fuel efficient?", "X3"),
+    ("Do you have an electric SUV like the iX?", "iX"),
+]
+CANNED_RESPONSE = "The **BMW {model}** is a great choice. Would you like to know more or schedule a test drive?"
+
+
+def build_turns(documents):
+    """Prompt inputs for each turn of one conversation (same for both layouts)"""
+    turns = []
+    history = []
+    for question, model_name in QUESTIONS:
+        data = [d for d in documents if d.metadata["model_name"] == model_name][:3]
+        _, inputs = _build_memory_chain(data, question, list(history), None, "Alex")
+        turns.append(inputs)
+        history.append({"message": question, "response": CANNED_RESPONSE.format(model=model_name), "timestamp": f"turn {len(history) + 1}"})
+    return turns
+
+
+def run_conversation(client, base_url, version, turns, num_predict):
+    prompt = prompt_registry.get("memory", version).prompt
+    results = []
+    for inputs in turns:
+        response = client.post(f"{base_url}/api/generate", json={
+            "model": OLLAMA_MODEL,
+            "prompt": prompt.invoke(inputs).to_string(),
+            "stream": False,
+            "keep_alive": OLLAMA_KEEP_ALIVE,
+            "options": {"num_ctx": OLLAMA_NUM_CTX, "num_predict": num_predict},
+        })
+        response.raise_for_status()
+        body = response.json()
+        results.append({
+            "prompt_eval_count": body.get("prompt_eval_count"),
+            "prompt_eval_ms": round(body.get("prompt_eval_duration", 0) / 1e6, 1),
+        })
+    later = [turn["prompt_eval_ms"] for turn in results[1:]]
+    return {"turns": results, "later_turns_mean_ms": round(statistics.mean(later), 1) if later else None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default=os.getenv("OLLAMA_HOST", "http://localhost:11434"))
+    parser.add_argument("--num-predict", type=int, default=16, help="Tokens to generate per turn (kept small)")
+    parser.add_argument("--json", dest="json_path", default=None, help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    base_url = args.base_url.rstrip("/")
+    if not base_url.startswith("http"):
+        base_url = f"http://{base_url}"
+
+    with httpx.Client(timeout=300) as client:
+        try:
+            client.get(f"{base_url}/api/tags", timeout=2).raise_for_status()
+        except httpx.HTTPError as e:
+            print(f"Ollama not reachable at {base_url} ({e}); skipping prefill benchmark")
+            return 0
+
+        turns = build_turns(load_car_documents())
+        results = {
+            "model": OLLAMA_MODEL,
+            "v1": run_conversation(client, base_url, "v1", turns, args.num_predict),
+            "v2": run_conversation(client, base_url, "v2", turns, args.num_predict),
+        }
+
+    print(f"Prefill per turn ({OLLAMA_MODEL}, {len(turns)} turns)")
+    print(f"{'turn':<6}{'v1 tokens':>11}{'v1 ms':>9}{'v2 tokens':>11}{'v2 ms':>9}")
+    for i, (v1, v2) in enumerate(zip(results["v1"]["turns"], results["v2"]["turns"]), start=1):
+        print(f"{i:<6}{v1['prompt_eval_count']:>11}{v1['prompt_eval_ms']:>9}{v2['prompt_eval_count']:>11}{v2['prompt_eval_ms']:>9}")
+    print(f"Mean prefill on turns 2+: v1 {results['v1']['later_turns_mean_ms']} ms, v2 {results['v2']['later_turns_mean_ms']} ms")
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
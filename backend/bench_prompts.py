@@ -0,0 +1,79 @@
+"""
+Benchmark: per-request prompt compilation vs the precompiled prompt registry
+
+Measures only the prompt work done before the LLM is called: building the
+ChatPromptTemplate and chain, then substituting the variables.
+
+Usage:
+    python bench_prompts.py [--iterations 2000] [--json results.json]
+"""
+import argparse
+import json
+import statistics
+import time
+
+from langchain_core.language_models.fake import FakeListLLM
+from langchain_core.prompts import ChatPromptTemplate
+
+from prompts import MEMORY_TEMPLATE, prompt_registry
+
+INPUTS = {
+    "data": "Model Name: X5\nModel Year: 2019\nTrim / Variant: xDrive40i\nBase MSRP (USD): $62000",
+    "customer_name": "Customer",
+    "conversation_history": "No previous conversation history",
+    "selected_cars_info": "No cars specifically selected for this conversation",
+    "questions_asked": "What is the price of the X5?",
+}
+
+
+def time_calls(fn, n):
+    latencies = []
+    for _ in range(n):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1_000_000)
+    latencies.sort()
+    return {
+        "p50_us": round(latencies[len(latencies) // 2], 1),
+        "mean_us": round(statistics.mean(latencies), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--json", dest="json_path", default=None, help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    model = FakeListLLM(responses=["ok"])
+
+    def per_request():
+        # What llama.py used to do on every chat turn
+        chain = ChatPromptTemplate.from_template(MEMORY_TEMPLATE) | model
+        chain.first.invoke(INPUTS)
+
+    def precompiled():
+        chain = prompt_registry.get("memory").chain(model)
+        chain.first.invoke(INPUTS)
+
+    results = {
+        "iterations": args.iterations,
+        "per_request": time_calls(per_request, args.iterations),
+        "precompiled": time_calls(precompiled, args.iterations),
+    }
+    results["saved_us_per_call"] = round(results["per_request"]["mean_us"] - results["precompiled"]["mean_us"], 1)
+
+    print(f"Prompt build + substitution ({args.iterations} iterations)")
+    print(f"{'variant':<14}{'p50 us':>10}{'mean us':>10}")
+    for variant in ("per_request", "precompiled"):
+        r = results[variant]
+        print(f"{variant:<14}{r['p50_us']:>10}{r['mean_us']:>10}")
+    print(f"Saved per call: {results['saved_us_per_call']} us")
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmark: Chroma retriever vs in-process NumPy exact-kNN retriever
+
+Uses deterministic fake embeddings (1024 dims, same as mxbai-embed-large) so
+the numbers measure retriever overhead only, not Ollama.
+
+Usage:
+    python bench_retriever.py [--queries 500] [--json results.json]
+"""
+import argparse
+import json
+import statistics
+import tempfile
+import time
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from numpy_retriever import NumpyRetriever, NumpyVectorIndex
+from vector import load_car_documents, sync_vector_store
+
+QUERIES = [
+    "what is the price of x5",
+    "compare 3 series and 5 series horsepower",
+    "electric bmw with the longest range",
+    "cheapest convertible",
+    "2023 m3 competition acceleration",
+]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def time_queries(retriever, n):
+    latencies = []
+    for i in range(n):
+        query = QUERIES[i % len(QUERIES)]
+        start = time.perf_counter()
+        retriever.invoke(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return {
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "mean_ms": round(statistics.mean(latencies), 3),
+    }
+
+
+def bench_chroma(documents, embeddings, directory, n):
+    from langchain_chroma import Chroma
+
+    store = Chroma(collection_name="bench_cars", persist_directory=directory, embedding_function=embeddings)
+    sync_vector_store(store, documents)
+    del store
+
+    # Startup: open the persisted collection and answer the first query
+    start = time.perf_counter()
+    store = Chroma(collection_name="bench_cars", persist_directory=directory, embedding_function=embeddings)
+    retriever = store.as_retriever(search_kwargs={"k": 3})
+    retriever.invoke(QUERIES[0])
+    startup_ms = (time.perf_counter() - start) * 1000
+
+    return {"startup_ms": round(startup_ms, 3), **time_queries(retriever, n)}
+
+
+def bench_numpy(documents, embeddings, directory, n):
+    NumpyVectorIndex(directory).load().sync(documents, embeddings)
+
+    # Startup: memory-map the persisted matrix and answer the first query
+    start = time.perf_counter()
+    index = NumpyVectorIndex(directory).load()
+    retriever = NumpyRetriever(index=index, embeddings=embeddings, k=3)
+    retriever.invoke(QUERIES[0])
+    startup_ms = (time.perf_counter() - start) * 1000
+
+    return {"startup_ms": round(startup_ms, 3), **time_queries(retriever, n)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--json", dest="json_path", default=None, help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    documents = load_car_documents()
+    embeddings = DeterministicFakeEmbedding(size=1024)
+
+    with tempfile.TemporaryDirectory() as chroma_dir, tempfile.TemporaryDirectory() as numpy_dir:
+        results = {
+            "documents": len(documents),
+            "queries": args.queries,
+            "chroma": bench_chroma(documents, embeddings, chroma_dir, args.queries),
+            "numpy": bench_numpy(documents, embeddings, numpy_dir, args.queries),
+        }
+
+    print(f"Retriever benchmark ({results['documents']} documents, {args.queries} queries)")
+    print(f"{'backend':<10}{'startup ms':>12}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}")
+    for backend in ("chroma", "numpy"):
+        r = results[backend]
+        print(f"{backend:<10}{r['startup_ms']:>12}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['mean_ms']:>10}")
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
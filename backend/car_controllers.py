@@ -2,17 +2,10 @@
 Car controllers for handling car-related operations
 """
 from typing import List, Optional
-from sqlmodel import Session, select, create_engine
+from sqlmodel import Session, select
+from controllers import engine  # One pool for the app (and its /metrics instrumentation)
 from models import Car
 from schemas import CarResponse
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
-
-# Use the same database configuration as controllers
-DATABASE_URL = os.getenv("DB_URL", "sqlite:///./autocare.db")
-engine = create_engine(DATABASE_URL, echo=False)
 
 
 def get_all_cars_controller() -> List[Car]:
@@ -132,6 +125,63 @@ def search_cars_controller(
         return cars
 
 
+def query_cars_controller(
+    model_names: Optional[List[str]] = None,
+    trim_variants: Optional[List[str]] = None,
+    min_year: Optional[int] = None,
+    max_year: Optional[int] = None,
+    min_price: Optional[int] = None,
+    max_price: Optional[int] = None,
+    min_horsepower: Optional[int] = None,
+    max_horsepower: Optional[int] = None,
+    body_types: Optional[List[str]] = None,
+    engine_types: Optional[List[str]] = None,
+    order_by: Optional[str] = None,
+    descending: bool = False,
+    limit: int = 10
+) -> List[Car]:
+    """Exact-match car query used by the structured chat router (uses the indexed columns)"""
+    with Session(engine) as session:
+        statement = select(Car)
+        
+        if model_names:
+            statement = statement.where(Car.model_name.in_(model_names))
+        if trim_variants:
+            statement = statement.where(Car.trim_variant.in_(trim_variants))
+        if min_year:
+            statement = statement.where(Car.model_year >= min_year)
+        if max_year:
+            statement = statement.where(Car.model_year <= max_year)
+        if min_price:
+            statement = statement.where(Car.base_msrp_usd >= min_price)
+        if max_price:
+            statement = statement.where(Car.base_msrp_usd <= max_price)
+        if min_horsepower:
+            statement = statement.where(Car.horsepower_hp >= min_horsepower)
+        if max_horsepower:
+            statement = statement.where(Car.horsepower_hp <= max_horsepower)
+        if body_types:
+            statement = statement.where(Car.body_type.in_(body_types))
+        if engine_types:
+            statement = statement.where(Car.engine_type.in_(engine_types))
+        
+        if order_by:
+            column = getattr(Car, order_by)
+            statement = statement.order_by(column.desc() if descending else column)
+        else:
+            statement = statement.order_by(Car.model_name, Car.model_year.desc())
+        
+        cars = session.exec(statement.limit(limit)).all()
+        return cars
+
+
+def get_model_trims_controller() -> List[tuple]:
+    """Get distinct (model_name, trim_variant) pairs"""
+    with Session(engine) as session:
+        statement = select(Car.model_name, Car.trim_variant).distinct()
+        return [(model, trim) for model, trim in session.exec(statement).all()]
+
+
 def get_unique_models_controller() -> List[str]:
     """Get list of unique car models"""
     with Session(engine) as session:
@@ -1,14 +1,139 @@
+from sqlalchemy import bindparam, case, func, insert, union, update
 from sqlmodel import Session, select, text
 from datetime import datetime, timedelta
 from typing import List, Optional, Dict, Any
 import json
+import os
 import uuid
 import re
 from collections import Counter
+from functools import lru_cache
 
-from controllers import engine
-from models import User, ChatConversation, ChatMessage, ChatMemoryEntry
+import numpy as np
+from dotenv import load_dotenv
+
+from controllers import engine as default_engine
+from models import User, ChatConversation, ChatMessage, ChatMemoryEntry, ChatMemoryTerm, ChatMemoryModel
 from schemas import ConversationSummary, ChatHistoryResponse, MessageWithContext, ConversationDetailResponse
+from memory_cache import CachedMemory, UserMemoryCache, memory_cache, to_microseconds
+from timing import timed
+
+load_dotenv()
+
+# Anonymous chat is stored under this user id. A guest's memory is scoped to their
+# session: only its last GUEST_MEMORY_MAX_ENTRIES entries within the TTL are used
+GUEST_USER_ID = 0
+GUEST_MEMORY_TTL_MINUTES = int(os.getenv("GUEST_MEMORY_TTL_MINUTES", "120"))
+GUEST_MEMORY_MAX_ENTRIES = int(os.getenv("GUEST_MEMORY_MAX_ENTRIES", "20"))
+
+
+@lru_cache(maxsize=4096)
+def _load_terms(value: str) -> tuple:
+    """Parse a stored JSON list of keywords/models (few distinct values, so memoized)"""
+    return tuple(json.loads(value))
+
+# Fixed vocabularies of extract_keywords / extract_car_models; an entry's keywords and
+# models are also stored as bitmasks over them (bit i = vocabulary[i]), so overlap is a popcount
+BMW_TERMS = ['bmw', '3 series', '5 series', 'x5', 'x3', 'm3', 'm5', 'z4', '7 series']
+CAR_TERMS = ['car', 'vehicle', 'engine', 'horsepower', 'transmission', 'fuel', 'price', 'compare', 'specs']
+YEAR_TERMS = [str(year) for year in range(2000, 2031)]
+KEYWORD_VOCABULARY = BMW_TERMS + CAR_TERMS + YEAR_TERMS
+CAR_MODEL_VOCABULARY = ['3 series', '5 series', 'x5', 'x3', 'x1', 'x7', 'm3', 'm5', 'z4', 'i3', 'i8', '7 series']
+_KEYWORD_BITS = {term: 1 << i for i, term in enumerate(KEYWORD_VOCABULARY)}
+_MODEL_BITS = {model: 1 << i for i, model in enumerate(CAR_MODEL_VOCABULARY)}
+
+
+def keyword_mask(keywords) -> int:
+    return sum(_KEYWORD_BITS.get(term, 0) for term in set(keywords))
+
+
+def model_mask(car_models) -> int:
+    return sum(_MODEL_BITS.get(model, 0) for model in set(car_models))
+
+
+if hasattr(np, "bitwise_count"):
+    _popcount = np.bitwise_count
+else:
+    # NumPy < 2.0: count the set bits of each byte
+    _BYTE_BITS = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount(values: np.ndarray) -> np.ndarray:
+        as_bytes = values.astype(np.uint64).view(np.uint8).reshape(-1, 8)
+        return _BYTE_BITS[as_bytes].sum(axis=1, dtype=np.int64)
+
+
+def score_candidates(
+    keyword_masks: np.ndarray,
+    model_masks: np.ndarray,
+    intent_matches: np.ndarray,
+    days_old: np.ndarray,
+    importance: np.ndarray,
+    current_keyword_mask: int,
+    current_model_mask: int
+) -> np.ndarray:
+    """
+    _relevance_score for many entries at once (masks as int64 arrays, entry
+    ages as whole days); returns the scores in the same order
+    """
+    keyword_total = _popcount(keyword_masks)
+    keyword_matches = _popcount(keyword_masks & np.int64(current_keyword_mask))
+    model_total = _popcount(model_masks)
+    model_matches = _popcount(model_masks & np.int64(current_model_mask))
+    
+    scores = np.zeros(len(keyword_masks))
+    scores += np.divide(keyword_matches, keyword_total, out=np.zeros(len(scores)), where=keyword_total > 0) * 0.5
+    scores += np.where(intent_matches, 0.3, 0.0)
+    if current_model_mask:
+        scores += np.divide(model_matches, model_total, out=np.zeros(len(scores)), where=model_total > 0) * 0.4
+    scores += np.maximum(0, (30 - days_old) / 30 * 0.2)
+    return scores * importance
+
+
+# Besides entries sharing a keyword or car model with the message, this many of the
+# user's most recent entries, and of the most recent with the message's intent, are
+# always scored (they can qualify on intent and recency alone)
+RECENT_CANDIDATES = 50
+
+_DAY_US = 24 * 60 * 60 * 1_000_000
+
+# A summary entry (memory_compaction) is returned as its content instead of its message
+_summary_text = case((ChatMemoryEntry.is_summary.is_(True), ChatMemoryEntry.content))
+
+
+def _relevance_score(
+    keyword_matches: int,
+    keyword_total: int,
+    intent_matches: bool,
+    model_matches: int,
+    model_total: int,
+    has_current_models: bool,
+    created_at: datetime,
+    importance: float,
+    now: datetime
+) -> float:
+    """
+    Relevance of a memory entry from its keyword/model overlap with the current message
+    """
+    score = 0.0
+    
+    # Keyword overlap
+    if keyword_total:
+        score += keyword_matches / keyword_total * 0.5
+    
+    # Intent matching
+    if intent_matches:
+        score += 0.3
+    
+    # Car model matching
+    if has_current_models and model_total:
+        score += model_matches / model_total * 0.4
+    
+    # Recency bonus (more recent = slightly higher score)
+    days_old = (now - created_at).days
+    score += max(0, (30 - days_old) / 30 * 0.2)
+    
+    # Apply importance multiplier
+    return score * importance
 
 
 class ChatMemoryController:
@@ -16,25 +141,39 @@ class ChatMemoryController:
     Handles chat memory storage, retrieval, and RAG functionality
     """
     
-    def __init__(self):
+    def __init__(self, engine=None, cache: Optional[UserMemoryCache] = None):
+        self.engine = engine or default_engine
+        self.cache = cache  # Hot per-user memory cache (memory_cache.py), write-through
         self.session_timeout_hours = 24  # New session if inactive for 24 hours
     
     def get_or_create_conversation(self, user_id: int, session_id: Optional[str] = None) -> ChatConversation:
         """
         Get existing conversation or create new one
         """
-        with Session(engine) as session:
-            if session_id:
-                # Try to find existing conversation
-                statement = select(ChatConversation).where(
-                    ChatConversation.user_id == user_id,
-                    ChatConversation.session_id == session_id
-                )
-                conversation = session.exec(statement).first()
-                if conversation:
-                    return conversation
-            
-            # Check for recent active conversation (within timeout)
+        with Session(self.engine) as session:
+            conversation = self._get_or_create_conversation(session, user_id, session_id)
+            if conversation in session.new:
+                session.commit()
+                session.refresh(conversation)
+            return conversation
+    
+    def _get_or_create_conversation(self, session: Session, user_id: int, session_id: Optional[str] = None) -> ChatConversation:
+        """
+        get_or_create_conversation within the caller's session (a new conversation is only added, not committed)
+        """
+        if session_id:
+            # Try to find existing conversation
+            statement = select(ChatConversation).where(
+                ChatConversation.user_id == user_id,
+                ChatConversation.session_id == session_id
+            )
+            conversation = session.exec(statement).first()
+            if conversation:
+                return conversation
+        
+        # Check for recent active conversation (within timeout)
+        # (not for guests: their recent conversations belong to other people)
+        if user_id != GUEST_USER_ID:
             cutoff_time = datetime.utcnow() - timedelta(hours=self.session_timeout_hours)
             statement = select(ChatConversation).where(
                 ChatConversation.user_id == user_id,
@@ -44,19 +183,18 @@ class ChatMemoryController:
             recent_conversation = session.exec(statement).first()
             if recent_conversation:
                 return recent_conversation
-            
-            # Create new conversation
-            new_session_id = session_id or str(uuid.uuid4())
-            conversation = ChatConversation(
-                user_id=user_id,
-                session_id=new_session_id,
-                title=None  # Will be generated later
-            )
-            session.add(conversation)
-            session.commit()
-            session.refresh(conversation)
-            return conversation
+        
+        # Create new conversation
+        new_session_id = session_id or str(uuid.uuid4())
+        conversation = ChatConversation(
+            user_id=user_id,
+            session_id=new_session_id,
+            title=None  # Will be generated later
+        )
+        session.add(conversation)
+        return conversation
     
+    @timed("memory_store")
     def store_message(
         self,
         user_id: int,
@@ -68,14 +206,15 @@ class ChatMemoryController:
     ) -> ChatMessage:
         """
         Store a chat message and create memory entries
+        (the whole turn is written in one transaction)
         """
-        with Session(engine) as session:
+        with Session(self.engine) as session:
             # Get or create conversation
-            conversation = self.get_or_create_conversation(user_id, session_id)
+            conversation = self._get_or_create_conversation(session, user_id, session_id)
             
-            # Store user message
+            # Store user message (flushed with a new conversation, for their ids)
             message = ChatMessage(
-                conversation_id=conversation.id,
+                conversation=conversation,
                 user_id=user_id,
                 message=user_message,
                 response=bot_response,
@@ -84,78 +223,328 @@ class ChatMemoryController:
                 context_used=context_used
             )
             session.add(message)
-            session.commit()
-            session.refresh(message)
+            session.flush()
             
             # Update conversation timestamp and title if needed
             conversation.updated_at = datetime.utcnow()
             if not conversation.title:
                 conversation.title = self.generate_conversation_title(user_message)
-            session.add(conversation)
-            session.commit()
             
             # Create memory entry for RAG
-            self.create_memory_entry(session, message, user_message, bot_response)
+            memory_entry = self.create_memory_entry(session, message, user_message, bot_response)
+            
+            # Read before commit expires the instances (no refresh round-trip)
+            conversation_id = conversation.id
+            cached = CachedMemory(
+                message.id, memory_entry.keyword_mask, memory_entry.model_mask, memory_entry.intent,
+                memory_entry.importance_score, to_microseconds(memory_entry.created_at),
+                memory_entry.car_models_mentioned, user_message, bot_response, message.created_at
+            )
+            session.commit()
+            if self.cache is not None and user_id != GUEST_USER_ID:
+                self.cache.add(user_id, [cached])
             
             # Return conversation ID to avoid session issues
-            return conversation.id
+            return conversation_id
     
+    def store_messages(self, turns: List[Dict[str, Any]]) -> int:
+        """
+        Store many chat turns in one transaction, inserting messages, memory entries
+        and index rows with one executemany each (used by the write-behind queue).
+        Each turn has store_message's arguments plus created_at; returns the number stored
+        """
+        if not turns:
+            return 0
+        with Session(self.engine) as session:
+            # Conversations, resolved once per (user, session id) in the batch
+            conversations = {}
+            for turn in turns:
+                key = (turn["user_id"], turn.get("session_id"))
+                if key not in conversations:
+                    conversations[key] = self._get_or_create_conversation(session, *key)
+                conversation = conversations[key]
+                conversation.updated_at = max(conversation.updated_at, turn["created_at"])
+                if not conversation.title:
+                    conversation.title = self.generate_conversation_title(turn["user_message"])
+            session.flush()
+            
+            message_ids = session.execute(
+                insert(ChatMessage).returning(ChatMessage.id, sort_by_parameter_order=True),
+                [
+                    {
+                        "conversation_id": conversations[(turn["user_id"], turn.get("session_id"))].id,
+                        "user_id": turn["user_id"],
+                        "message": turn["user_message"],
+                        "response": turn.get("bot_response"),
+                        "sender": "user",
+                        "selected_cars": json.dumps(turn["selected_cars"]) if turn.get("selected_cars") else None,
+                        "context_used": turn.get("context_used"),
+                        "created_at": turn["created_at"]
+                    }
+                    for turn in turns
+                ]
+            ).scalars().all()
+            
+            entry_rows, terms = [], []
+            for turn, message_id in zip(turns, message_ids):
+                fields, keywords, car_models = self.memory_entry_fields(turn["user_message"], turn.get("bot_response"))
+                entry_rows.append({
+                    "user_id": turn["user_id"],
+                    "conversation_id": conversations[(turn["user_id"], turn.get("session_id"))].id,
+                    "message_id": message_id,
+                    "created_at": turn["created_at"],
+                    **fields
+                })
+                terms.append((turn["user_id"], turn["created_at"], keywords, car_models))
+            entry_ids = session.execute(
+                insert(ChatMemoryEntry).returning(ChatMemoryEntry.id, sort_by_parameter_order=True), entry_rows
+            ).scalars().all()
+            self.index_memory_entries(session, [
+                (entry_id, user_id, created_at, keywords, car_models)
+                for entry_id, (user_id, created_at, keywords, car_models) in zip(entry_ids, terms)
+            ])
+            
+            session.commit()
+        
+        if self.cache is not None:
+            cached = {}
+            for turn, row in zip(turns, entry_rows):
+                if turn["user_id"] == GUEST_USER_ID:
+                    continue
+                cached.setdefault(turn["user_id"], []).append(CachedMemory(
+                    row["message_id"], row["keyword_mask"], row["model_mask"], row["intent"], row["importance_score"],
+                    to_microseconds(turn["created_at"]), row["car_models_mentioned"],
+                    turn["user_message"], turn.get("bot_response"), turn["created_at"]
+                ))
+            for user_id, entries in cached.items():
+                self.cache.add(user_id, entries)
+        return len(turns)
+    
+    @timed("memory_context")
     def get_relevant_context(
         self,
         user_id: int,
         current_message: str,
-        limit: int = 5
+        limit: int = 5,
+        session_id: Optional[str] = None
     ) -> List[Dict[str, Any]]:
         """
         Retrieve relevant context using simple keyword matching and recency
+        (from the hot memory cache when the user is in it; for guests, only
+        from their own session)
         """
-        with Session(engine) as session:
-            # Extract keywords from current message
-            keywords = self.extract_keywords(current_message)
-            
+        # Extract keywords, intent and models from current message (once, not per entry)
+        keywords = self.extract_keywords(current_message)
+        current_intent = self.classify_intent(current_message)
+        current_models = self.extract_car_models(current_message)
+        now = datetime.utcnow()
+        
+        if user_id == GUEST_USER_ID:
+            if not session_id:
+                return []
+            entries = self._guest_memory(session_id, now)
+            return self._context_from_cache(entries, keywords, current_intent, current_models, now, limit)
+        
+        if self.cache is not None:
+            entries = self._cached_memory(user_id, now)
+            if entries is not None:
+                return self._context_from_cache(entries, keywords, current_intent, current_models, now, limit)
+        
+        with Session(self.engine) as session:
             # Get recent conversations for context
-            recent_cutoff = datetime.utcnow() - timedelta(days=30)  # Last 30 days
+            recent_cutoff = now - timedelta(days=30)  # Last 30 days
             
-            # Build query for relevant messages
-            query = select(ChatMemoryEntry).where(
+            # Candidates: entries sharing a keyword or car model (via the inverted
+            # index tables) plus the most recent entries, overall and with the same intent
+            recent = select(ChatMemoryEntry.id).where(
                 ChatMemoryEntry.user_id == user_id,
                 ChatMemoryEntry.created_at > recent_cutoff
-            )
+            ).order_by(ChatMemoryEntry.created_at.desc()).limit(RECENT_CANDIDATES).subquery()
+            recent_same_intent = select(ChatMemoryEntry.id).where(
+                ChatMemoryEntry.user_id == user_id,
+                ChatMemoryEntry.intent == current_intent,
+                ChatMemoryEntry.created_at > recent_cutoff
+            ).order_by(ChatMemoryEntry.created_at.desc()).limit(RECENT_CANDIDATES).subquery()
+            candidates = union(
+                select(ChatMemoryTerm.entry_id).where(
+                    ChatMemoryTerm.user_id == user_id,
+                    ChatMemoryTerm.term.in_(keywords),
+                    ChatMemoryTerm.created_at > recent_cutoff
+                ),
+                select(ChatMemoryModel.entry_id).where(
+                    ChatMemoryModel.user_id == user_id,
+                    ChatMemoryModel.model.in_(current_models),
+                    ChatMemoryModel.created_at > recent_cutoff
+                ),
+                select(recent.c.id),
+                select(recent_same_intent.c.id)
+            ).cte("candidates")
             
-            memory_entries = session.exec(query).all()
+            query = select(
+                ChatMemoryEntry.message_id,
+                ChatMemoryEntry.intent,
+                ChatMemoryEntry.car_models_mentioned,
+                ChatMemoryEntry.importance_score,
+                ChatMemoryEntry.created_at,
+                ChatMemoryEntry.keyword_mask,
+                ChatMemoryEntry.model_mask,
+                _summary_text.label("summary")
+            ).where(
+                ChatMemoryEntry.id.in_(select(candidates.c.entry_id)),
+                ChatMemoryEntry.user_id == user_id,
+                ChatMemoryEntry.created_at > recent_cutoff
+            )
+            rows = session.exec(query).all()
+            if not rows:
+                return []
             
-            # Score entries based on keyword overlap and importance
-            scored_entries = []
-            for entry in memory_entries:
-                score = self.calculate_relevance_score(entry, keywords, current_message)
-                if score > 0.1:  # Minimum relevance threshold
-                    scored_entries.append((entry, score))
+            # Score all candidates together: keyword/model overlap as popcounts of the masks
+            scores = score_candidates(
+                np.array([row.keyword_mask or 0 for row in rows], dtype=np.int64),
+                np.array([row.model_mask or 0 for row in rows], dtype=np.int64),
+                np.array([row.intent for row in rows], dtype=object) == current_intent,
+                np.array([(now - row.created_at).days for row in rows], dtype=np.int64),
+                np.array([row.importance_score for row in rows], dtype=np.float64),
+                keyword_mask(keywords), model_mask(current_models)
+            )
+            scored_entries = [
+                (rows[i], float(scores[i])) for i in np.flatnonzero(scores > 0.1)  # Minimum relevance threshold
+            ]
             
-            # Sort by score and return top results
+            # Sort by score and fetch the messages of the top results in one query
             scored_entries.sort(key=lambda x: x[1], reverse=True)
+            scored_entries = scored_entries[:limit]
+            if not scored_entries:
+                return []
             
-            # Get full message details
-            context = []
-            for entry, score in scored_entries[:limit]:
-                message_query = select(ChatMessage).where(ChatMessage.id == entry.message_id)
-                message = session.exec(message_query).first()
-                if message:
-                    context.append({
-                        "message": message.message,
-                        "response": message.response,
-                        "cars_mentioned": json.loads(entry.car_models_mentioned) if entry.car_models_mentioned else [],
-                        "intent": entry.intent,
-                        "relevance_score": score,
-                        "timestamp": message.created_at
-                    })
+            messages = {
+                message.id: message
+                for message in session.exec(select(
+                    ChatMessage.id, ChatMessage.message, ChatMessage.response, ChatMessage.created_at
+                ).where(ChatMessage.id.in_([row.message_id for row, _ in scored_entries]))).all()
+            }
             
-            return context
+            return [
+                {
+                    "message": row.summary or messages[row.message_id].message,
+                    "response": None if row.summary else messages[row.message_id].response,
+                    "cars_mentioned": json.loads(row.car_models_mentioned) if row.car_models_mentioned else [],
+                    "intent": row.intent,
+                    "relevance_score": score,
+                    "timestamp": messages[row.message_id].created_at
+                }
+                for row, score in scored_entries
+                if row.message_id in messages
+            ]
+    
+    def _cached_memory(self, user_id: int, now: datetime) -> Optional[List[CachedMemory]]:
+        """
+        The user's memory window from the cache, loading it on a miss;
+        None for users with too many entries to cache
+        """
+        entries = self.cache.get(user_id)
+        if entries is not None:
+            return entries
+        if self.cache.is_oversized(user_id):
+            return None
+        
+        token = self.cache.begin_load()
+        entries = self._load_memory(
+            ChatMemoryEntry.user_id == user_id,
+            ChatMemoryEntry.created_at > now - timedelta(days=30),
+            order_by=ChatMemoryEntry.created_at,
+            limit=self.cache.max_user_entries + 1
+        )
+        self.cache.put(user_id, entries, token)
+        return entries if len(entries) <= self.cache.max_user_entries else None
+    
+    def _guest_memory(self, session_id: str, now: datetime) -> List[CachedMemory]:
+        """
+        A guest session's most recent memory entries (bounded, so the cost does
+        not grow with total guest traffic)
+        """
+        return self._load_memory(
+            ChatConversation.user_id == GUEST_USER_ID,
+            ChatConversation.session_id == session_id,
+            ChatMemoryEntry.created_at > now - timedelta(minutes=GUEST_MEMORY_TTL_MINUTES),
+            order_by=ChatMemoryEntry.created_at.desc(),
+            limit=GUEST_MEMORY_MAX_ENTRIES
+        )
+    
+    def _load_memory(self, *where, order_by, limit: int) -> List[CachedMemory]:
+        """
+        Memory entries with their messages, as CachedMemory, in one query
+        """
+        with Session(self.engine) as session:
+            rows = session.exec(select(
+                ChatMemoryEntry.message_id,
+                ChatMemoryEntry.keyword_mask,
+                ChatMemoryEntry.model_mask,
+                ChatMemoryEntry.intent,
+                ChatMemoryEntry.importance_score,
+                ChatMemoryEntry.created_at,
+                ChatMemoryEntry.car_models_mentioned,
+                func.coalesce(_summary_text, ChatMessage.message).label("message"),
+                case((ChatMemoryEntry.is_summary.is_(True), None), else_=ChatMessage.response).label("response"),
+                ChatMessage.created_at.label("message_created_at")
+            ).join(
+                ChatMessage, ChatMessage.id == ChatMemoryEntry.message_id
+            ).join(
+                ChatConversation, ChatConversation.id == ChatMemoryEntry.conversation_id
+            ).where(*where).order_by(order_by).limit(limit)).all()
+        return [
+            CachedMemory(
+                row.message_id, row.keyword_mask or 0, row.model_mask or 0, row.intent, row.importance_score,
+                to_microseconds(row.created_at), row.car_models_mentioned,
+                row.message, row.response, row.message_created_at
+            )
+            for row in rows
+        ]
+    
+    def _context_from_cache(
+        self,
+        entries: List[CachedMemory],
+        keywords: List[str],
+        current_intent: str,
+        current_models: List[str],
+        now: datetime,
+        limit: int
+    ) -> List[Dict[str, Any]]:
+        """
+        get_relevant_context over loaded entries: every entry in the window is scored
+        """
+        cutoff = to_microseconds(now - timedelta(days=30))
+        entries = [entry for entry in entries if entry.created_at > cutoff]
+        if not entries:
+            return []
+        
+        now_us = to_microseconds(now)
+        scores = score_candidates(
+            np.array([entry.keyword_mask for entry in entries], dtype=np.int64),
+            np.array([entry.model_mask for entry in entries], dtype=np.int64),
+            np.array([entry.intent for entry in entries], dtype=object) == current_intent,
+            (now_us - np.array([entry.created_at for entry in entries], dtype=np.int64)) // _DAY_US,
+            np.array([entry.importance_score for entry in entries], dtype=np.float64),
+            keyword_mask(keywords), model_mask(current_models)
+        )
+        top = sorted(np.flatnonzero(scores > 0.1), key=lambda i: scores[i], reverse=True)[:limit]
+        return [
+            {
+                "message": entries[i].message,
+                "response": entries[i].response,
+                "cars_mentioned": json.loads(entries[i].car_models_mentioned) if entries[i].car_models_mentioned else [],
+                "intent": entries[i].intent,
+                "relevance_score": float(scores[i]),
+                "timestamp": entries[i].message_created_at
+            }
+            for i in top
+        ]
     
     def get_conversation_history(self, user_id: int, limit: int = 20) -> ChatHistoryResponse:
         """
         Get user's conversation history
         """
-        with Session(engine) as session:
+        with Session(self.engine) as session:
             # Get conversations with message count
             conversations_query = text("""
                 SELECT c.id, c.session_id, c.title, c.updated_at, c.created_at,
@@ -195,7 +584,7 @@ class ChatMemoryController:
         """
         Get detailed conversation with all messages
         """
-        with Session(engine) as session:
+        with Session(self.engine) as session:
             # Get conversation
             conv_query = select(ChatConversation).where(
                 ChatConversation.id == conversation_id,
@@ -246,7 +635,26 @@ class ChatMemoryController:
         bot_response: Optional[str]
     ):
         """
-        Create preprocessed memory entry for RAG
+        Create preprocessed memory entry for RAG (committed by the caller); returns it
+        """
+        fields, keywords, car_models = self.memory_entry_fields(user_message, bot_response)
+        memory_entry = ChatMemoryEntry(
+            user_id=message.user_id,
+            conversation_id=message.conversation_id,
+            message_id=message.id,
+            **fields
+        )
+        
+        session.add(memory_entry)
+        session.flush()
+        self.index_memory_entries(session, [
+            (memory_entry.id, memory_entry.user_id, memory_entry.created_at, keywords, car_models)
+        ])
+        return memory_entry
+    
+    def memory_entry_fields(self, user_message: str, bot_response: Optional[str]) -> tuple:
+        """
+        Preprocessed ChatMemoryEntry column values for a turn, plus its keywords and car models
         """
         # Extract relevant information
         keywords = self.extract_keywords(user_message)
@@ -261,19 +669,91 @@ class ChatMemoryController:
         # Calculate importance score
         importance = self.calculate_importance(user_message, bot_response, car_models)
         
-        memory_entry = ChatMemoryEntry(
-            user_id=message.user_id,
-            conversation_id=message.conversation_id,
-            message_id=message.id,
-            content=content,
-            keywords=json.dumps(keywords),
-            intent=intent,
-            car_models_mentioned=json.dumps(car_models),
-            importance_score=importance
-        )
-        
-        session.add(memory_entry)
-        session.commit()
+        fields = {
+            "content": content,
+            "keywords": json.dumps(keywords),
+            "intent": intent,
+            "car_models_mentioned": json.dumps(car_models),
+            "keyword_mask": keyword_mask(keywords),
+            "model_mask": model_mask(car_models),
+            "importance_score": importance
+        }
+        return fields, keywords, car_models
+    
+    def index_memory_entries(self, session: Session, entries: List[tuple]):
+        """
+        Add (entry_id, user_id, created_at, keywords, car_models) tuples to the keyword/model index tables
+        """
+        term_rows = [
+            {"entry_id": entry_id, "user_id": user_id, "created_at": created_at, "term": term}
+            for entry_id, user_id, created_at, keywords, _ in entries for term in set(keywords)
+        ]
+        model_rows = [
+            {"entry_id": entry_id, "user_id": user_id, "created_at": created_at, "model": model}
+            for entry_id, user_id, created_at, _, car_models in entries for model in set(car_models)
+        ]
+        if term_rows:
+            session.execute(insert(ChatMemoryTerm), term_rows)
+        if model_rows:
+            session.execute(insert(ChatMemoryModel), model_rows)
+    
+    def backfill_memory_index(self, batch_size: int = 5000) -> int:
+        """
+        Index memory entries stored before the keyword/model index tables existed
+        (entries newer than the last indexed one); returns the number of entries indexed
+        """
+        indexed = 0
+        with Session(self.engine) as session:
+            last_indexed = max(
+                session.exec(select(func.max(ChatMemoryTerm.entry_id))).one() or 0,
+                session.exec(select(func.max(ChatMemoryModel.entry_id))).one() or 0
+            )
+            while True:
+                rows = session.exec(select(
+                    ChatMemoryEntry.id,
+                    ChatMemoryEntry.user_id,
+                    ChatMemoryEntry.created_at,
+                    ChatMemoryEntry.keywords,
+                    ChatMemoryEntry.car_models_mentioned
+                ).where(ChatMemoryEntry.id > last_indexed).order_by(ChatMemoryEntry.id).limit(batch_size)).all()
+                if not rows:
+                    break
+                self.index_memory_entries(session, [
+                    (row.id, row.user_id, row.created_at, json.loads(row.keywords or "[]"), json.loads(row.car_models_mentioned or "[]"))
+                    for row in rows
+                ])
+                session.commit()
+                indexed += len(rows)
+                last_indexed = rows[-1].id
+        return indexed
+    
+    def backfill_memory_masks(self, batch_size: int = 5000) -> int:
+        """
+        Set keyword/model bitmasks on memory entries stored before the mask columns
+        existed; returns the number of entries updated
+        """
+        updated = 0
+        with Session(self.engine) as session:
+            while True:
+                rows = session.exec(select(
+                    ChatMemoryEntry.id, ChatMemoryEntry.keywords, ChatMemoryEntry.car_models_mentioned
+                ).where(ChatMemoryEntry.keyword_mask.is_(None)).order_by(ChatMemoryEntry.id).limit(batch_size)).all()
+                if not rows:
+                    break
+                session.execute(
+                    update(ChatMemoryEntry.__table__).where(ChatMemoryEntry.__table__.c.id == bindparam("entry_id")),
+                    [
+                        {
+                            "entry_id": row.id,
+                            "keyword_mask": keyword_mask(json.loads(row.keywords or "[]")),
+                            "model_mask": model_mask(json.loads(row.car_models_mentioned or "[]"))
+                        }
+                        for row in rows
+                    ]
+                )
+                session.commit()
+                updated += len(rows)
+        return updated
     
     def extract_keywords(self, text: str) -> List[str]:
         """
@@ -282,12 +762,9 @@ class ChatMemoryController:
         # Simple keyword extraction
         text = text.lower()
         
-        # BMW-specific terms
-        bmw_terms = ['bmw', '3 series', '5 series', 'x5', 'x3', 'm3', 'm5', 'z4', '7 series']
-        car_terms = ['car', 'vehicle', 'engine', 'horsepower', 'transmission', 'fuel', 'price', 'compare', 'specs']
-        
+        # BMW-specific and general car terms
         keywords = []
-        for term in bmw_terms + car_terms:
+        for term in BMW_TERMS + CAR_TERMS:
             if term in text:
                 keywords.append(term)
         
@@ -322,9 +799,7 @@ class ChatMemoryController:
         models = []
         
         # Common BMW models
-        bmw_models = ['3 series', '5 series', 'x5', 'x3', 'x1', 'x7', 'm3', 'm5', 'z4', 'i3', 'i8', '7 series']
-        
-        for model in bmw_models:
+        for model in CAR_MODEL_VOCABULARY:
             if model in text:
                 models.append(model)
         
@@ -350,43 +825,32 @@ class ChatMemoryController:
         
         return min(score, 1.0)
     
-    def calculate_relevance_score(self, entry: ChatMemoryEntry, current_keywords: List[str], current_message: str) -> float:
+    def calculate_relevance_score(
+        self,
+        entry: ChatMemoryEntry,
+        current_keywords: List[str],
+        current_message: str,
+        current_intent: Optional[str] = None,
+        current_models: Optional[List[str]] = None
+    ) -> float:
         """
         Calculate relevance score for memory entry
+        (entry may be any row with the entry's scoring fields; pass the current
+        message's intent and models when scoring many entries for one message)
         """
-        score = 0.0
+        entry_keywords = _load_terms(entry.keywords) if entry.keywords else ()
+        if current_intent is None:
+            current_intent = self.classify_intent(current_message)
+        if current_models is None:
+            current_models = self.extract_car_models(current_message)
+        entry_models = _load_terms(entry.car_models_mentioned) if entry.car_models_mentioned else ()
         
-        # Keyword overlap
-        if entry.keywords:
-            entry_keywords = json.loads(entry.keywords)
-            common_keywords = set(current_keywords) & set(entry_keywords)
-            if entry_keywords:
-                keyword_score = len(common_keywords) / len(entry_keywords)
-                score += keyword_score * 0.5
-        
-        # Intent matching
-        current_intent = self.classify_intent(current_message)
-        if entry.intent == current_intent:
-            score += 0.3
-        
-        # Car model matching
-        current_models = self.extract_car_models(current_message)
-        if entry.car_models_mentioned and current_models:
-            entry_models = json.loads(entry.car_models_mentioned)
-            common_models = set(current_models) & set(entry_models)
-            if entry_models:
-                model_score = len(common_models) / len(entry_models)
-                score += model_score * 0.4
-        
-        # Recency bonus (more recent = slightly higher score)
-        days_old = (datetime.utcnow() - entry.created_at).days
-        recency_score = max(0, (30 - days_old) / 30 * 0.2)
-        score += recency_score
-        
-        # Apply importance multiplier
-        score *= entry.importance_score
-        
-        return score
+        return _relevance_score(
+            len(set(current_keywords) & set(entry_keywords)), len(entry_keywords),
+            entry.intent == current_intent,
+            len(set(current_models) & set(entry_models)), len(entry_models), bool(current_models),
+            entry.created_at, entry.importance_score, datetime.utcnow()
+        )
     
     def generate_conversation_title(self, first_message: str) -> str:
         """
@@ -413,4 +877,4 @@ class ChatMemoryController:
 
 
 # Global instance
-chat_memory = ChatMemoryController()
\ No newline at end of file
+chat_memory = ChatMemoryController(cache=memory_cache)
\ No newline at end of file
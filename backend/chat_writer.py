@@ -0,0 +1,261 @@
+"""
+Write-behind persistence for chat turns
+
+With CHAT_WRITE_BEHIND enabled, chat endpoints hand each finished turn to an
+in-memory queue and respond immediately instead of waiting for
+chat_memory.store_message. A background thread stores queued turns in batches
+(ChatMemoryController.store_messages: one transaction, one executemany per
+table) once CHAT_WRITE_BATCH_SIZE turns are waiting or the oldest has waited
+CHAT_WRITE_FLUSH_MS, and drains the queue on shutdown.
+
+Turns reach the database up to CHAT_WRITE_FLUSH_MS later, so a follow-up
+message sent within that window may not see the previous turn as memory
+context. When the queue holds CHAT_WRITE_MAX_QUEUE turns, new turns are
+written synchronously instead.
+
+CHAT_WRITE_JOURNAL_PATH adds crash safety: every queued turn is appended to
+a local JSON-lines journal first, a checkpoint line recording how many
+journaled turns are stored is appended after each batch, the journal is
+truncated whenever every turn in it has been stored, and turns past the last
+checkpoint are replayed at startup. Delivery is at-least-once: a crash
+between a batch commit and its checkpoint stores that batch twice. Appends are flushed to the OS, not fsynced,
+so the journal survives a process crash but not a power loss.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CHAT_WRITE_BEHIND = os.getenv("CHAT_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+CHAT_WRITE_BATCH_SIZE = int(os.getenv("CHAT_WRITE_BATCH_SIZE", "100"))
+CHAT_WRITE_FLUSH_MS = float(os.getenv("CHAT_WRITE_FLUSH_MS", "200"))
+CHAT_WRITE_MAX_QUEUE = int(os.getenv("CHAT_WRITE_MAX_QUEUE", "10000"))
+CHAT_WRITE_JOURNAL_PATH = os.getenv("CHAT_WRITE_JOURNAL_PATH", "")
+
+
+class ChatWriter:
+    """
+    Queue of chat turns stored in batches by a background thread
+    """
+    def __init__(
+        self,
+        memory=None,
+        batch_size: int = CHAT_WRITE_BATCH_SIZE,
+        flush_ms: float = CHAT_WRITE_FLUSH_MS,
+        max_queue: int = CHAT_WRITE_MAX_QUEUE,
+        journal_path: Optional[str] = CHAT_WRITE_JOURNAL_PATH or None
+    ):
+        self._memory = memory
+        self.batch_size = batch_size
+        self.flush_ms = flush_ms
+        self.max_queue = max_queue
+        self.journal_path = journal_path
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+        self.sync_writes = 0
+        self._queue = deque()
+        self._in_flight = []
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread = None
+        self._journal = None
+        # Guards the journal file and its counters; never taken inside _cond
+        self._journal_lock = threading.Lock()
+        self._journal_turns = 0
+        self._journal_stored = 0
+
+    @property
+    def memory(self):
+        if self._memory is None:
+            from chat_memory_controller import chat_memory
+            self._memory = chat_memory
+        return self._memory
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> int:
+        """
+        Replay the journal (if any) and start the writer thread; returns the number of turns replayed
+        """
+        if self.running:
+            return 0
+        replayed = []
+        if self.journal_path:
+            turns, stored = [], 0
+            if os.path.exists(self.journal_path):
+                with open(self.journal_path) as f:
+                    for line in f:
+                        if not line.strip():
+                            continue
+                        entry = json.loads(line)
+                        if "checkpoint" in entry:
+                            stored = entry["checkpoint"]
+                        else:
+                            turns.append(_load_turn(entry))
+            replayed = turns[stored:]
+            self._journal = open(self.journal_path, "a")
+            self._journal_turns, self._journal_stored = len(turns), stored
+        if replayed:
+            logger.info("Replaying %d chat turns from %s", len(replayed), self.journal_path)
+
+        with self._cond:
+            self._queue.extendleft(reversed(replayed))
+            self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="chat-writer", daemon=True)
+        self._thread.start()
+        return len(replayed)
+
+    def stop(self, timeout: float = 30):
+        """
+        Store everything still queued and stop the writer thread
+        """
+        if not self.running:
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._thread.join(timeout)
+        with self._journal_lock:
+            if self._journal:
+                self._journal.close()
+                self._journal = None
+
+    def submit(self, user_id: int, user_message: str, bot_response: Optional[str] = None,
+               selected_cars=None, session_id: Optional[str] = None, context_used: Optional[str] = None):
+        """
+        Queue a chat turn (store_message's arguments); written synchronously
+        when the writer is not running or the queue is full
+        """
+        turn = {
+            "user_id": user_id,
+            "user_message": user_message,
+            "bot_response": bot_response,
+            "selected_cars": selected_cars,
+            "session_id": session_id,
+            "context_used": context_used,
+            "created_at": datetime.utcnow()
+        }
+        # Holding the journal lock keeps journal lines in queue order
+        with self._journal_lock:
+            with self._cond:
+                queued = self.running and not self._stopping and len(self._queue) < self.max_queue
+                if queued:
+                    self._queue.append(turn)
+                    self._cond.notify()
+                else:
+                    self.sync_writes += 1
+            if queued:
+                if self._journal:
+                    self._journal.write(_dump_turn(turn) + "\n")
+                    self._journal.flush()
+                    self._journal_turns += 1
+                return
+        self.memory.store_message(
+            user_id=user_id,
+            user_message=user_message,
+            bot_response=bot_response,
+            selected_cars=selected_cars,
+            session_id=session_id,
+            context_used=context_used
+        )
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queue or self._stopping)
+                if not self._queue:
+                    return
+                # Wait for a full batch, or until the oldest queued turn is flush_ms old
+                deadline = time.monotonic() + self.flush_ms / 1000
+                while len(self._queue) < self.batch_size and not self._stopping:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                self._in_flight = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            self._write(self._in_flight)
+            self._checkpoint_journal(len(self._in_flight))
+            with self._cond:
+                self._in_flight = []
+
+    def _write(self, turns):
+        try:
+            self.memory.store_messages(turns)
+            self.batches += 1
+            self.written += len(turns)
+            return
+        except Exception:
+            logger.exception("Failed to store a batch of %d chat turns, retrying one at a time", len(turns))
+        # One bad turn should not lose the rest of the batch
+        for turn in turns:
+            try:
+                self.memory.store_messages([turn])
+                self.written += 1
+            except Exception:
+                self.failed += 1
+                logger.exception("Dropping chat turn for user %s", turn["user_id"])
+
+    def _checkpoint_journal(self, stored: int):
+        # Batches are taken from the front of the queue, so the stored turns are
+        # always the oldest journal lines; record how many, or start over once
+        # nothing in the journal is left to write
+        with self._journal_lock:
+            if not self._journal:
+                return
+            self._journal_stored += stored
+            if self._journal_stored >= self._journal_turns:
+                self._journal.truncate(0)
+                self._journal_turns = self._journal_stored = 0
+            else:
+                self._journal.write(json.dumps({"checkpoint": self._journal_stored}) + "\n")
+                self._journal.flush()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "enabled": self.running,
+                "queue_depth": len(self._queue) + len(self._in_flight),
+                "written": self.written,
+                "batches": self.batches,
+                "failed": self.failed,
+                "sync_writes": self.sync_writes,
+                "journal": self.journal_path,
+            }
+
+
+def _dump_turn(turn: dict) -> str:
+    return json.dumps({**turn, "created_at": turn["created_at"].isoformat()})
+
+
+def _load_turn(turn: dict) -> dict:
+    turn["created_at"] = datetime.fromisoformat(turn["created_at"])
+    return turn
+
+
+# Global instance
+chat_writer = ChatWriter()
+
+
+def start_chat_writer():
+    """
+    Start the write-behind queue when CHAT_WRITE_BEHIND is enabled
+    (with it disabled, a leftover journal is still replayed once)
+    """
+    if CHAT_WRITE_BEHIND:
+        chat_writer.start()
+    elif chat_writer.journal_path and os.path.exists(chat_writer.journal_path):
+        chat_writer.start()
+        chat_writer.stop()
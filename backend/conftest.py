@@ -0,0 +1,46 @@
+"""
+Shared helpers for the chat memory tests
+
+Plain functions rather than pytest fixtures, so the test modules can import
+them and still run on their own (python test_memory_context.py).
+"""
+import tempfile
+from typing import List, Tuple
+
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, SQLModel, create_engine, func, select
+
+from chat_memory_controller import GUEST_USER_ID, ChatMemoryController
+from models import User
+
+
+def make_memory_engine(users: int = 1, guest: bool = False, on_disk: bool = False) -> Tuple[Engine, List[int]]:
+    """
+    Fresh database with the given number of test users (and the guest user);
+    on_disk when other threads need to see the same database, which sqlite://
+    gives each connection separately
+    """
+    engine = create_engine(f"sqlite:///{tempfile.mkdtemp()}/memory.db" if on_disk else "sqlite://")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        if guest:
+            session.add(User(id=GUEST_USER_ID, name="Guest", email="guest@example.com", number="5550000000", password="x"))
+        rows = [
+            User(name=f"Test {i}", email=f"memory{i}@example.com", number=f"555100{i:04d}", password="x")
+            for i in range(users)
+        ]
+        session.add_all(rows)
+        session.commit()
+        user_ids = [user.id for user in rows]
+    return engine, user_ids
+
+
+def make_memory(cache=None, guest: bool = False, on_disk: bool = False) -> Tuple[ChatMemoryController, Engine, int]:
+    """ChatMemoryController over a fresh database with one test user"""
+    engine, (user_id,) = make_memory_engine(guest=guest, on_disk=on_disk)
+    return ChatMemoryController(engine=engine, cache=cache), engine, user_id
+
+
+def count(engine: Engine, model, *where) -> int:
+    with Session(engine) as session:
+        return session.exec(select(func.count()).select_from(model).where(*where)).one()
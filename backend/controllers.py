@@ -99,6 +99,8 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
                 detail="User not found",
                 headers={"WWW-Authenticate": "Bearer"},
             )
+        # Load the address while the session is open; chat endpoints read it after it closes
+        user.address
         return user
 
 def register_user_controller(
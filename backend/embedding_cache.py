@@ -0,0 +1,215 @@
+"""
+Persistent LRU cache for query embeddings
+
+Every chat turn embeds the user's question before retrieval. Identical or
+trivially different questions ("What is the price of X5?" / "what is the
+price of x5") map to the same normalized key, so repeated queries skip the
+Ollama embedding round-trip entirely. Entries live in a small SQLite file and
+survive restarts; the least recently used entries are evicted once the cache
+grows past its size limit.
+
+Hits do not write: the new LRU positions are kept in memory and written in
+one transaction once EMBEDDING_CACHE_TOUCH_BATCH have piled up or
+EMBEDDING_CACHE_TOUCH_SECONDS have passed (and before evicting). The async
+path runs the SQLite calls in a worker thread, off the event loop.
+"""
+import asyncio
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from dotenv import load_dotenv
+
+load_dotenv()
+
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "./embedding_cache.db")
+EMBEDDING_CACHE_MAX_MB = float(os.getenv("EMBEDDING_CACHE_MAX_MB", "64"))
+EMBEDDING_CACHE_TOUCH_BATCH = int(os.getenv("EMBEDDING_CACHE_TOUCH_BATCH", "256"))
+EMBEDDING_CACHE_TOUCH_SECONDS = float(os.getenv("EMBEDDING_CACHE_TOUCH_SECONDS", "30"))
+
+
+def normalize_query(text: str) -> str:
+    """
+    Normalize query text for cache lookups: case, whitespace and trailing punctuation
+    """
+    text = re.sub(r"\s+", " ", text.strip().lower())
+    return text.rstrip("?!. ")
+
+
+class QueryEmbeddingCache:
+    """
+    SQLite-backed LRU map of (model, normalized query) -> float32 vector
+    """
+    def __init__(
+        self,
+        path: str = EMBEDDING_CACHE_PATH,
+        max_bytes: int = int(EMBEDDING_CACHE_MAX_MB * 1024 * 1024),
+        touch_batch: int = EMBEDDING_CACHE_TOUCH_BATCH,
+        touch_seconds: float = EMBEDDING_CACHE_TOUCH_SECONDS
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.touch_batch = touch_batch
+        self.touch_seconds = touch_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._touched = {}  # key -> last_used not yet written
+        self._touched_since = time.monotonic()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # A lost write only costs a re-embed: no fsync per commit
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS query_embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_query_embeddings_last_used ON query_embeddings (last_used)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM query_embeddings").fetchone()[0]
+
+    def get(self, key: str) -> Optional[List[float]]:
+        """
+        Look up a vector, refreshing its LRU position on a hit (written in batches)
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT vector FROM query_embeddings WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if not self._touched:
+                self._touched_since = time.monotonic()
+            self._touched[key] = time.time()
+            if len(self._touched) >= self.touch_batch or time.monotonic() - self._touched_since >= self.touch_seconds:
+                self._write_touches()
+                self._conn.commit()
+        return np.frombuffer(row[0], dtype=np.float32).tolist()
+
+    def flush(self):
+        """Write pending LRU positions"""
+        with self._lock:
+            self._write_touches()
+            self._conn.commit()
+
+    def _write_touches(self):
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE query_embeddings SET last_used = ? WHERE key = ?",
+                [(last_used, key) for key, last_used in self._touched.items()]
+            )
+            self._touched.clear()
+
+    def put(self, key: str, vector: List[float]):
+        """
+        Store a vector and evict least recently used entries beyond max_bytes
+        """
+        blob = np.asarray(vector, dtype=np.float32).tobytes()
+        size = len(blob) + len(key)
+        with self._lock:
+            previous = self._conn.execute("SELECT size FROM query_embeddings WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO query_embeddings (key, vector, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, blob, size, time.time())
+            )
+            self._total_bytes += size - (previous[0] if previous else 0)
+            self._touched.pop(key, None)
+            if self._total_bytes > self.max_bytes:
+                self._write_touches()  # Evict by up-to-date LRU order
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes:
+            oldest = self._conn.execute(
+                "SELECT key, size FROM query_embeddings ORDER BY last_used LIMIT 64"
+            ).fetchall()
+            if not oldest:
+                break
+            for key, size in oldest:
+                if self._total_bytes <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM query_embeddings WHERE key = ?", (key,))
+                self._total_bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM query_embeddings")
+            self._conn.commit()
+            self._touched.clear()
+            self._total_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that serves embed_query from a QueryEmbeddingCache
+    (document embedding is passed straight through)
+    """
+    def __init__(self, base: Embeddings, cache: QueryEmbeddingCache, namespace: str = ""):
+        self.base = base
+        self.cache = cache
+        self.namespace = namespace
+
+    def _key(self, text: str) -> str:
+        return f"{self.namespace}:{normalize_query(text)}"
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.base.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.base.aembed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = self.base.embed_query(text)
+            self.cache.put(key, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        # SQLite I/O in a worker thread, not on the event loop
+        key = self._key(text)
+        vector = await asyncio.to_thread(self.cache.get, key)
+        if vector is None:
+            vector = await self.base.aembed_query(text)
+            await asyncio.to_thread(self.cache.put, key, vector)
+        return vector
+
+
+_query_cache = None
+
+
+def get_query_embedding_cache(create: bool = True) -> Optional[QueryEmbeddingCache]:
+    """
+    Shared cache instance (None when disabled via EMBEDDING_CACHE_ENABLED)
+    """
+    global _query_cache
+    if not EMBEDDING_CACHE_ENABLED:
+        return None
+    if _query_cache is None and create:
+        _query_cache = QueryEmbeddingCache()
+    return _query_cache
@@ -0,0 +1,172 @@
+"""
+Deterministic stand-ins for OllamaLLM and OllamaEmbeddings
+
+Lets the API, database and memory layers be load tested on a machine with no
+models. Outputs depend only on the input text, and latency follows a
+configurable profile (time to first token, then a steady token rate) so the
+event loop, LLM limiter and streaming behave as they would against Ollama.
+
+Select with LLM_BACKEND=fake and/or EMBEDDINGS_BACKEND=fake.
+"""
+import asyncio
+import hashlib
+import os
+import random
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "ollama").lower()
+EMBEDDINGS_BACKEND = os.getenv("EMBEDDINGS_BACKEND", "ollama").lower()
+
+# (first token ms, tokens per second) - roughly llama3.2 3B on the named hardware
+LLM_PROFILES = {
+    "instant": (0, 0),
+    "gpu": (150, 60),
+    "cpu": (800, 12),
+}
+
+VOCABULARY = (
+    "BMW", "**X5**", "**3 Series**", "**i4**", "luxury", "performance", "comfort", "horsepower",
+    "torque", "efficient", "spacious", "interior", "technology", "driving", "dynamics", "the",
+    "a", "with", "and", "offers", "features", "excellent", "range", "price", "test", "drive",
+    "model", "engine", "safety", "premium", "*smooth*", "handling", "-", "##", "\n",
+)
+
+
+def _seed(text: str) -> int:
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+
+
+class FakeLLM(LLM):
+    """
+    LLM that returns a deterministic pseudo-response for each prompt,
+    paced like a real model (first token latency + tokens per second)
+    """
+    first_token_ms: float = 0
+    tokens_per_second: float = 0
+    response_tokens: int = 120
+
+    @classmethod
+    def from_env(cls) -> "FakeLLM":
+        profile = os.getenv("FAKE_LLM_PROFILE", "gpu").lower()
+        first_token_ms, tokens_per_second = LLM_PROFILES.get(profile, LLM_PROFILES["gpu"])
+        return cls(
+            first_token_ms=float(os.getenv("FAKE_LLM_FIRST_TOKEN_MS") or first_token_ms),
+            tokens_per_second=float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND") or tokens_per_second),
+            response_tokens=int(os.getenv("FAKE_LLM_RESPONSE_TOKENS") or 120)
+        )
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def tokens(self, prompt: str) -> List[str]:
+        """The response for a prompt, as the list of tokens that will be streamed"""
+        rng = random.Random(_seed(prompt))
+        words = [rng.choice(VOCABULARY) for _ in range(self.response_tokens)]
+        return [word if word == "\n" else word + " " for word in words]
+
+    def _delays(self):
+        """Seconds to wait before each token"""
+        yield self.first_token_ms / 1000
+        interval = 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0
+        while True:
+            yield interval
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        tokens = self.tokens(prompt)
+        delays = self._delays()
+        time.sleep(sum(next(delays) for _ in tokens))
+        return "".join(tokens)
+
+    async def _acall(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        tokens = self.tokens(prompt)
+        delays = self._delays()
+        await asyncio.sleep(sum(next(delays) for _ in tokens))
+        return "".join(tokens)
+
+    def _stream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[GenerationChunk]:
+        for token, delay in zip(self.tokens(prompt), self._delays()):
+            if delay:
+                time.sleep(delay)
+            if run_manager:
+                run_manager.on_llm_new_token(token)
+            yield GenerationChunk(text=token)
+
+    async def _astream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[GenerationChunk]:
+        for token, delay in zip(self.tokens(prompt), self._delays()):
+            if delay:
+                await asyncio.sleep(delay)
+            if run_manager:
+                await run_manager.on_llm_new_token(token)
+            yield GenerationChunk(text=token)
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Unit-length pseudo-random vectors seeded by the text, with a fixed
+    latency per call (1024 dims by default, same as mxbai-embed-large)
+    """
+    def __init__(self, size: int = 1024, latency_ms: float = 0):
+        self.size = size
+        self.latency_ms = latency_ms
+
+    @classmethod
+    def from_env(cls) -> "FakeEmbeddings":
+        return cls(
+            size=int(os.getenv("FAKE_EMBEDDING_DIM", "1024")),
+            latency_ms=float(os.getenv("FAKE_EMBEDDING_LATENCY_MS", "20"))
+        )
+
+    def _vector(self, text: str) -> List[float]:
+        vector = np.random.default_rng(_seed(text)).standard_normal(self.size).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency_ms / 1000)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(self.latency_ms / 1000)
+        return self._vector(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(self.latency_ms / 1000)
+        return [self._vector(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        await asyncio.sleep(self.latency_ms / 1000)
+        return self._vector(text)
@@ -1,107 +1,97 @@
+import os
+import time
+from dotenv import load_dotenv
 from langchain_ollama import OllamaLLM
-from langchain_core.prompts import ChatPromptTemplate
-from vector import retriever
+from starlette.concurrency import run_in_threadpool
+import vector
+from llm_limiter import llm_limiter
+from response_cache import get_response_cache
+from prompt_budget import pack_prompt
+from prompts import prompt_registry
+from timing import record, timed
 
 
-model = OllamaLLM(model="llama3.2")
+load_dotenv()
 
-template = """
-You are a friendly and knowledgeable car sales manager of BMW company and your name is Grace assisting customers with their car-related questions.
-Use the following car dataset to provide accurate, detailed, and helpful information:
-{data}
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.2")
+# Keep the model (and its prompt cache) loaded between sparse requests
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+# Context window; must fit PROMPT_MAX_TOKENS plus the generated answer
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "4096"))
+# Maximum tokens to generate (-1 = until the model stops)
+OLLAMA_NUM_PREDICT = int(os.getenv("OLLAMA_NUM_PREDICT", "1024"))
 
-Respond to the customer questions below in a warm, conversational tone using **Markdown formatting** to make your response clear and well-structured:
 
-**Formatting Guidelines:**
-- Use **bold** for important features, model names, and key specifications
-- Use *italic* for emphasis and descriptive language
-- Create bullet points with - for lists of features or specifications  
-- Use ## for section headings when organizing information
-- Use tables when comparing multiple models or specifications
-- Use > for important tips or recommendations
-- Format prices, numbers, and technical specs clearly
+def create_llm():
+    """
+    LLM used for all chat generation: the fake backend with LLM_BACKEND=fake,
+    a load-balanced pool when OLLAMA_BASE_URLS is set, otherwise the default
+    Ollama endpoint
+    """
+    from fake_backends import LLM_BACKEND, FakeLLM
+    from ollama_pool import OLLAMA_BASE_URLS, OllamaPoolLLM
+
+    if LLM_BACKEND == "fake":
+        return FakeLLM.from_env()
+
+    settings = dict(
+        model=OLLAMA_MODEL,
+        keep_alive=OLLAMA_KEEP_ALIVE,
+        num_ctx=OLLAMA_NUM_CTX,
+        num_predict=OLLAMA_NUM_PREDICT
+    )
+    if OLLAMA_BASE_URLS:
+        return OllamaPoolLLM(base_urls=OLLAMA_BASE_URLS, **settings)
+    return OllamaLLM(**settings)
+
+
+model = create_llm()
 
-Customer Question: {questions_asked}
 
-Make your answers clear, concise, and incorporate relevant specs, features, and comparisons when applicable.
-If appropriate, ask the customer if they want to know more details, see similar models, or schedule a test drive.
-Keep the conversation engaging and encourage further interaction.
-Always aim to provide value and assist the customer in making informed decisions about their car purchase.
-"""
+def start_llm_health_checks():
+    """Start background health checks when generation goes through an endpoint pool"""
+    if hasattr(model, "start_health_checks"):
+        model.start_health_checks()
 
-prompt = ChatPromptTemplate.from_template(template)
-chain = prompt | model
+
+def get_llm_endpoint_stats():
+    """Per-endpoint load and health for an endpoint pool (None for a single endpoint)"""
+    return model.stats() if hasattr(model, "stats") else None
 
 
 def get_response(user_input):
-    data = retriever.invoke(user_input)
+    data = vector.get_retriever().invoke(user_input)
+    chain = prompt_registry.get("general").chain(model)
     response = chain.invoke({"data":data, "questions_asked": user_input})
     return response
 
 
-def get_response_with_memory(user_input, conversation_context=None, selected_cars=None, user_name="Customer"):
+def _render_memory_entry(ctx, response):
+    cars_mentioned = ", ".join(ctx.get('cars_mentioned', [])) if ctx.get('cars_mentioned') else "None"
+    return (
+        f"Previous interaction ({ctx.get('timestamp', 'Recent')}):\n"
+        f"Customer: {ctx.get('message', '')}\n"
+        f"Your response: {response}\n"
+        f"Cars discussed: {cars_mentioned}\n"
+        f"Intent: {ctx.get('intent', 'general')}"
+    )
+
+
+def _render_car_specific_entry(ctx, response):
+    return (
+        f"Previous interaction ({ctx.get('timestamp', 'Recent')}):\n"
+        f"Customer: {ctx.get('message', '')}\n"
+        f"Your response: {response}"
+    )
+
+
+@timed("prompt")
+def _build_memory_chain(data, user_input, conversation_context=None, selected_cars=None, user_name="Customer"):
     """
-    Enhanced response function that uses conversation history for context-aware responses
+    Build the memory-aware chain and its inputs from already retrieved car data
+    (shared by the sync, async and streaming variants)
     """
-    # Get base car data from vector store
-    data = retriever.invoke(user_input)
-    
-    # Build enhanced template with memory context
-    memory_template = """
-You are Grace, a friendly and knowledgeable BMW sales manager. You maintain conversation continuity and remember previous interactions with customers.
-
-Current car dataset:
-{data}
-
-Customer name: {customer_name}
-
-Previous conversation context (if any):
-{conversation_history}
-
-Selected cars for this conversation:
-{selected_cars_info}
-
-Current customer question:
-{questions_asked}
-
-**Response Instructions:**
-1. Use **Markdown formatting** to create clear, professional responses:
-   - Use **bold** for BMW model names, important features, and key specifications
-   - Use *italic* for emphasis and descriptive language
-   - Create bullet points with - for feature lists and specifications
-   - Use ## for section headings when organizing information
-   - Use tables when comparing models or specifications
-   - Use > for important tips, recommendations, or notes
-   - Format prices as **$XX,XXX** and technical specs clearly
-
-2. Reference previous conversations naturally when relevant (e.g., "As we discussed earlier...", "Building on what you mentioned...")
-3. If the customer previously showed interest in specific models, acknowledge that
-4. Use the customer's name appropriately in the conversation
-5. Provide detailed, accurate information from the car dataset
-6. If appropriate, reference or compare with previously discussed models
-7. Keep your response conversational, warm, and helpful
-8. Ask follow-up questions to continue the conversation
-9. Always aim to assist the customer in making informed decisions
-
-Remember: You're having an ongoing conversation, not starting fresh each time.
-"""
-    
-    # Format conversation context
-    context_str = ""
-    if conversation_context:
-        context_entries = []
-        for ctx in conversation_context:
-            cars_mentioned = ", ".join(ctx.get('cars_mentioned', [])) if ctx.get('cars_mentioned') else "None"
-            context_entries.append(
-                f"Previous interaction ({ctx.get('timestamp', 'Recent')}):\n"
-                f"Customer: {ctx.get('message', '')}\n"
-                f"Your response: {ctx.get('response', '')}\n"
-                f"Cars discussed: {cars_mentioned}\n"
-                f"Intent: {ctx.get('intent', 'general')}"
-            )
-        context_str = "\n\n".join(context_entries[-3:])  # Use last 3 interactions
-    else:
-        context_str = "No previous conversation history"
+    memory_prompt = prompt_registry.get("memory")
     
     # Format selected cars info
     cars_info = ""
@@ -113,96 +103,176 @@ Remember: You're having an ongoing conversation, not starting fresh each time.
     else:
         cars_info = "No cars specifically selected for this conversation"
     
-    # Create memory-enhanced prompt
-    memory_prompt = ChatPromptTemplate.from_template(memory_template)
-    memory_chain = memory_prompt | model
+    # Fit catalog data and the last 3 interactions (with condensed responses) into the token budget
+    data_str, context_str, _ = pack_prompt(
+        instructions=memory_prompt.template,
+        instruction_tokens=memory_prompt.instruction_tokens,
+        fixed_text="\n".join([user_input, user_name, cars_info]),
+        documents=data,
+        history_entries=(conversation_context or [])[-3:],
+        render_entry=_render_memory_entry
+    )
+    if not context_str:
+        context_str = "No previous conversation history"
     
-    # Generate response
-    response = memory_chain.invoke({
-        "data": data,
+    # Precompiled prompt; only the variables are filled in per request
+    memory_chain = memory_prompt.chain(model)
+    
+    return memory_chain, {
+        "data": data_str,
         "customer_name": user_name,
         "conversation_history": context_str,
         "selected_cars_info": cars_info,
         "questions_asked": user_input
-    })
+    }
+
+
+def get_response_with_memory(user_input, conversation_context=None, selected_cars=None, user_name="Customer"):
+    """
+    Enhanced response function that uses conversation history for context-aware responses
+    """
+    # Get base car data from vector store
+    data = vector.get_retriever().invoke(user_input)
+    memory_chain, inputs = _build_memory_chain(data, user_input, conversation_context, selected_cars, user_name)
+    
+    # Generate response
+    response = memory_chain.invoke(inputs)
     
     return response
 
 
-def get_response_with_car_specific_context(user_input, specific_car, conversation_context=None, user_name="Customer"):
+async def _astream_timed(chain, inputs):
     """
-    Specialized response function for car-specific conversations with enhanced context
-    Focuses entirely on the specific car model provided
+    Stream a chain's output, recording time to first token as the prefill
+    stage and the rest of the generation as decode
     """
-    # Get enhanced car data with focus on the specific model
-    data = retriever.invoke(user_input)
-    
-    # Build car-specific template
-    car_specific_template = """
-You are Grace, a specialized BMW expert with deep knowledge about specific BMW models. You are currently in a focused conversation about a particular BMW model.
-
-Current car dataset (general BMW knowledge):
-{data}
-
-Customer name: {customer_name}
-
-FOCUSED BMW MODEL FOR THIS CONVERSATION:
-Model: {specific_car_year} {specific_car_name} {specific_car_variant}
-Body Type: {specific_car_body_type}
-Price: {specific_car_price}
-Engine: {specific_car_engine}
-
-Previous conversation context about this specific model:
-{conversation_history}
-
-Current customer question about this BMW model:
-{questions_asked}
-
-**SPECIALIZED INSTRUCTIONS:**
-1. **Use Rich Markdown Formatting** to showcase your expertise:
-   - Use **bold** for the specific BMW model name: **{specific_car_year} {specific_car_name} {specific_car_variant}**
-   - Create clear sections with ## headings (e.g., ## Key Features, ## Performance, ## Specifications)
-   - Use bullet points (-) for feature lists and benefits
-   - Use tables for technical specifications and comparisons
-   - Use > for expert recommendations and insider tips
-   - Format prices as **{specific_car_price}** and technical data clearly
-   - Use *italic* for descriptive language and benefits
-
-2. You are THE expert specifically on the **{specific_car_year} {specific_car_name} {specific_car_variant}**
-3. Provide incredibly detailed and specific information about THIS model
-4. Reference previous conversations about this specific model when relevant
-5. Compare with other BMW models when appropriate, but always bring the focus back to this specific model
-6. Use technical specifications, features, and benefits specific to this model
-7. Discuss real-world experiences, ownership costs, and practical considerations for this model
-8. If the customer asks about other models, acknowledge but redirect to how this specific model compares
-9. Use the customer's name and maintain a personal, consultative approach
-10. Always relate general BMW knowledge back to this specific model
-11. Encourage test drives, detailed walkthroughs, or more specific questions about this model
-
-Remember: You are THE expert on this specific BMW model and should demonstrate that expertise through well-formatted, comprehensive responses.
-"""
-    
-    # Format conversation context
-    context_str = ""
-    if conversation_context:
-        context_entries = []
-        for ctx in conversation_context:
-            context_entries.append(
-                f"Previous interaction ({ctx.get('timestamp', 'Recent')}):\n"
-                f"Customer: {ctx.get('message', '')}\n"
-                f"Your response: {ctx.get('response', '')}"
-            )
-        context_str = "\n\n".join(context_entries[-5:])  # More context for specialized mode
-    else:
+    start = time.perf_counter()
+    first_token_at = None
+    try:
+        async for chunk in chain.astream(inputs):
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+                record("prefill", (first_token_at - start) * 1000)
+            yield chunk
+    finally:
+        if first_token_at is None:
+            record("prefill", (time.perf_counter() - start) * 1000)
+        else:
+            record("decode", (time.perf_counter() - first_token_at) * 1000)
+
+
+async def _agenerate(chain, inputs):
+    """
+    Generate a full response (streamed internally so prefill and decode can be timed separately)
+    """
+    return "".join([chunk async for chunk in _astream_timed(chain, inputs)])
+
+
+def _document_ids(data):
+    return [document.id or document.metadata.get("content_hash") for document in data]
+
+
+def _cacheable(cache_response, conversation_context):
+    # The answer depends on the conversation so far, which the cache key does not cover
+    return cache_response and not conversation_context
+
+
+async def _alookup_cached_response(user_input, data, selected_cars):
+    """
+    Check the semantic response cache; returns (cached response or None, query vector or None)
+    """
+    cache = get_response_cache()
+    if cache is None:
+        return None, None
+    
+    with timed("cache"):
+        query_vector = await vector.get_embeddings().aembed_query(user_input)
+        car_ids = [car.id for car in selected_cars or []]
+        return cache.lookup(query_vector, _document_ids(data), car_ids, vector.index_version), query_vector
+
+
+def _store_cached_response(query_vector, data, selected_cars, response):
+    if query_vector is None:
+        return
+    car_ids = [car.id for car in selected_cars or []]
+    get_response_cache().store(query_vector, _document_ids(data), car_ids, response, vector.index_version)
+
+
+async def aget_response_with_memory(user_input, conversation_context=None, selected_cars=None, user_name="Customer", cache_response=False):
+    """
+    Async variant of get_response_with_memory - retrieval and generation do not block the event loop
+    Generation waits for a slot in the LLM limiter; with cache_response, semantically
+    equivalent questions without conversation context are answered from the response cache instead
+    """
+    with timed("retrieval"):
+        data = await vector.get_retriever().ainvoke(user_input)
+    
+    query_vector = None
+    if _cacheable(cache_response, conversation_context):
+        cached, query_vector = await _alookup_cached_response(user_input, data, selected_cars)
+        if cached is not None:
+            return cached
+    
+    memory_chain, inputs = _build_memory_chain(data, user_input, conversation_context, selected_cars, user_name)
+    
+    async with llm_limiter.slot():
+        response = await _agenerate(memory_chain, inputs)
+    
+    _store_cached_response(query_vector, data, selected_cars, response)
+    return response
+
+
+async def astream_response_with_memory(user_input, conversation_context=None, selected_cars=None, user_name="Customer", cache_response=False):
+    """
+    Streaming variant of get_response_with_memory - yields text chunks as Ollama generates them
+    """
+    with timed("retrieval"):
+        data = await vector.get_retriever().ainvoke(user_input)
+    
+    query_vector = None
+    if _cacheable(cache_response, conversation_context):
+        cached, query_vector = await _alookup_cached_response(user_input, data, selected_cars)
+        if cached is not None:
+            yield cached
+            return
+    
+    memory_chain, inputs = _build_memory_chain(data, user_input, conversation_context, selected_cars, user_name)
+    
+    parts = []
+    async with llm_limiter.slot():
+        async for chunk in _astream_timed(memory_chain, inputs):
+            if chunk:
+                parts.append(chunk)
+                yield chunk
+    
+    _store_cached_response(query_vector, data, selected_cars, "".join(parts))
+
+
+@timed("prompt")
+def _build_car_specific_chain(data, user_input, specific_car, conversation_context=None, user_name="Customer"):
+    """
+    Build the car-specific chain and its inputs from the car's catalog documents
+    (shared by the sync, async and streaming variants)
+    """
+    car_prompt = prompt_registry.get("car_specific")
+    
+    # Fit catalog data and the last 5 interactions (more context for specialized mode) into the token budget
+    data_str, context_str, _ = pack_prompt(
+        instructions=car_prompt.template,
+        instruction_tokens=car_prompt.instruction_tokens,
+        fixed_text="\n".join([user_input, user_name]),
+        documents=data,
+        history_entries=(conversation_context or [])[-5:],
+        render_entry=_render_car_specific_entry
+    )
+    if not context_str:
         context_str = "This is the start of our focused conversation about this BMW model"
     
-    # Create car-specific prompt
-    car_prompt = ChatPromptTemplate.from_template(car_specific_template)
-    car_chain = car_prompt | model
+    # Precompiled prompt; only the variables are filled in per request
+    car_chain = car_prompt.chain(model)
     
-    # Generate specialized response
-    response = car_chain.invoke({
-        "data": data,
+    return car_chain, {
+        "data": data_str,
         "customer_name": user_name,
         "conversation_history": context_str,
         "questions_asked": user_input,
@@ -212,11 +282,52 @@ Remember: You are THE expert on this specific BMW model and should demonstrate t
         "specific_car_body_type": getattr(specific_car, 'body_type', 'Unknown'),
         "specific_car_price": f"${getattr(specific_car, 'base_msrp_usd', 'TBD'):,}" if hasattr(specific_car, 'base_msrp_usd') and specific_car.base_msrp_usd else "Contact for pricing",
         "specific_car_engine": getattr(specific_car, 'engine_type', 'Premium engine')
-    })
+    }
+
+
+def get_response_with_car_specific_context(user_input, specific_car, conversation_context=None, user_name="Customer"):
+    """
+    Specialized response function for car-specific conversations with enhanced context
+    Focuses entirely on the specific car model provided
+    """
+    # The car is already known: use its catalog document (plus siblings) instead of a similarity search
+    data = vector.get_car_documents(specific_car)
+    car_chain, inputs = _build_car_specific_chain(data, user_input, specific_car, conversation_context, user_name)
+    
+    # Generate specialized response
+    response = car_chain.invoke(inputs)
     
     return response
 
 
+async def aget_response_with_car_specific_context(user_input, specific_car, conversation_context=None, user_name="Customer"):
+    """
+    Async variant of get_response_with_car_specific_context
+    """
+    with timed("retrieval"):
+        # May read the dataset on first use: not on the event loop
+        data = await run_in_threadpool(vector.get_car_documents, specific_car)
+    car_chain, inputs = _build_car_specific_chain(data, user_input, specific_car, conversation_context, user_name)
+    
+    async with llm_limiter.slot():
+        return await _agenerate(car_chain, inputs)
+
+
+async def astream_response_with_car_specific_context(user_input, specific_car, conversation_context=None, user_name="Customer"):
+    """
+    Streaming variant of get_response_with_car_specific_context - yields text chunks as they are generated
+    """
+    with timed("retrieval"):
+        # May read the dataset on first use: not on the event loop
+        data = await run_in_threadpool(vector.get_car_documents, specific_car)
+    car_chain, inputs = _build_car_specific_chain(data, user_input, specific_car, conversation_context, user_name)
+    
+    async with llm_limiter.slot():
+        async for chunk in _astream_timed(car_chain, inputs):
+            if chunk:
+                yield chunk
+
+
 if __name__ == "__main__":
     while True:
         user_input = input("You: ")
@@ -0,0 +1,120 @@
+"""
+Bounded concurrency for LLM (Ollama) calls
+"""
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from fastapi import HTTPException, status
+from dotenv import load_dotenv
+
+from timing import timed
+
+load_dotenv()
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "16"))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "60"))
+LLM_RETRY_AFTER_SECONDS = int(os.getenv("LLM_RETRY_AFTER_SECONDS", "10"))
+
+
+class LLMConcurrencyLimiter:
+    """
+    Limits the number of in-flight LLM generations and the number of requests
+    waiting for a slot. Requests beyond the queue bound are rejected with 503
+    and a Retry-After header instead of piling up on the server.
+    """
+    def __init__(
+        self,
+        max_concurrent: int = LLM_MAX_CONCURRENCY,
+        max_queue: int = LLM_MAX_QUEUE,
+        queue_timeout: Optional[float] = LLM_QUEUE_TIMEOUT_SECONDS,
+        retry_after: int = LLM_RETRY_AFTER_SECONDS
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+
+    def is_saturated(self) -> bool:
+        """
+        True when every slot is busy and the wait queue is full
+        """
+        return self.in_flight >= self.max_concurrent and self.waiting >= self.max_queue
+
+    def check_capacity(self):
+        """
+        Raise 503 if a new request could not even be queued
+        """
+        if self.is_saturated():
+            raise self._overloaded("LLM queue is full. Please try again later.")
+
+    async def acquire(self):
+        """
+        Wait for an LLM slot, raising 503 if the queue is full or the wait times out
+        """
+        self.check_capacity()
+
+        self.waiting += 1
+        try:
+            if self.queue_timeout:
+                await self._acquire_within(self.queue_timeout)
+            else:
+                await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.in_flight += 1
+
+    async def _acquire_within(self, timeout: float):
+        # Not asyncio.wait_for: before Python 3.12 it can drop a permit acquired
+        # just as the timeout fires. The acquire runs as its own task, and a
+        # permit it got after we gave up is handed back
+        acquire = asyncio.ensure_future(self._semaphore.acquire())
+        try:
+            done, _ = await asyncio.wait({acquire}, timeout=timeout)
+        except asyncio.CancelledError:
+            self._abandon(acquire)
+            raise
+        if not done:
+            self._abandon(acquire)
+            raise self._overloaded("Timed out waiting for an available LLM slot. Please try again later.")
+
+    def _abandon(self, acquire: asyncio.Future):
+        # cancel() fails once the task has finished, i.e. it holds a permit
+        if not acquire.cancel() and not acquire.cancelled() and acquire.exception() is None:
+            self._semaphore.release()
+
+    def release(self):
+        """
+        Return an LLM slot
+        """
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Hold an LLM slot for the duration of the block
+        """
+        with timed("llm_queue"):
+            await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def _overloaded(self, detail: str) -> HTTPException:
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=detail,
+            headers={"Retry-After": str(self.retry_after)}
+        )
+
+
+# Global limiter instance shared by all chat endpoints
+llm_limiter = LLMConcurrencyLimiter()
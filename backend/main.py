@@ -1,10 +1,30 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import inspect, text
 from sqlmodel import SQLModel
 from datetime import datetime
 from typing import Optional
-from llama import get_response, get_response_with_memory, get_response_with_car_specific_context  
+import json
+import time
+import uuid
+from llama import (
+    get_response,
+    start_llm_health_checks,
+    get_llm_endpoint_stats,
+    aget_response_with_memory,
+    aget_response_with_car_specific_context,
+    astream_response_with_memory,
+    astream_response_with_car_specific_context
+)
+from llm_limiter import llm_limiter
+from prompt_budget import get_prompt_tokens, warm_tokenizer
+from query_router import route_car_query
+from timing import start_request_timing, timed, get_request_timings, server_timing_header, get_stage_summaries
+from metrics import instrument_engine, request_started, request_finished, render_metrics
+import vector
 from controllers import (
     register_user_controller,
     login_user_controller, 
@@ -42,6 +62,10 @@ from schemas import (
 from models import User
 from pydantic import BaseModel
 from chat_memory_controller import chat_memory
+from chat_writer import chat_writer, start_chat_writer
+from memory_cache import memory_cache
+from embedding_cache import get_query_embedding_cache
+from memory_compaction import memory_compactor, start_memory_compaction
 
 # Security scheme
 security = HTTPBearer(auto_error=False)
@@ -73,6 +97,49 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-stage latency breakdown in a Server-Timing header
+# (streaming responses only include the stages before the first byte)
+@app.middleware("http")
+async def add_server_timing(request: Request, call_next):
+    start = time.perf_counter()
+    timings = start_request_timing()
+    response = await call_next(request)
+    response.headers["Server-Timing"] = server_timing_header(timings, (time.perf_counter() - start) * 1000)
+    return response
+
+# Request counts, latency and in-flight gauges for /metrics
+# (latency of streaming responses is measured until the last chunk is sent)
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    path = request.url.path
+    request_started(path)
+    
+    def finished(status_code: int):
+        # Label by route template so /api/cars/1 and /api/cars/2 share a series
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        request_finished(path, request.method, route, status_code, time.perf_counter() - start)
+    
+    try:
+        response = await call_next(request)
+    except Exception:
+        finished(500)
+        raise
+    
+    body = response.body_iterator
+    
+    async def body_with_metrics():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            finished(response.status_code)
+    
+    response.body_iterator = body_with_metrics()
+    return response
+
+instrument_engine(engine)
+
 class Query(BaseModel):
     user_id: str
     query: str
@@ -82,6 +149,96 @@ class Query(BaseModel):
 def create_db_and_tables():
     # Chat models are now defined in models.py and will be auto-registered
     SQLModel.metadata.create_all(engine)
+    
+    # create_all skips existing tables, so add any columns and indexes declared since they were created
+    add_missing_columns()
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    
+    # Memory entries stored before the keyword/model index tables and mask columns existed
+    chat_memory.backfill_memory_index()
+    chat_memory.backfill_memory_masks()
+
+def add_missing_columns():
+    """
+    ALTER TABLE ... ADD COLUMN for nullable model columns missing from existing tables
+    """
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    with engine.begin() as connection:
+        for table in SQLModel.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing and column.nullable:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    connection.execute(text(
+                        f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.format_column(column)} {column_type}"
+                    ))
+
+# Build the vector store in the background so catalog and auth endpoints serve immediately
+@app.on_event("startup")
+def start_vector_store_initialization():
+    vector.start_background_initialization()
+
+# Before serving: tiktoken fetches its encoding file on first use
+@app.on_event("startup")
+def warm_prompt_tokenizer():
+    warm_tokenizer()
+
+@app.on_event("startup")
+def start_llm_endpoint_health_checks():
+    start_llm_health_checks()
+
+# Write-behind queue for chat turns (CHAT_WRITE_BEHIND); drained on shutdown
+@app.on_event("startup")
+def start_chat_write_behind():
+    start_chat_writer()
+
+@app.on_event("shutdown")
+def stop_chat_write_behind():
+    chat_writer.stop()
+
+@app.on_event("shutdown")
+def flush_query_embedding_cache():
+    cache = get_query_embedding_cache(create=False)
+    if cache is not None:
+        cache.flush()
+
+# Periodic memory retention/summarization job (MEMORY_COMPACTION_ENABLED)
+@app.on_event("startup")
+def start_memory_compaction_job():
+    start_memory_compaction()
+
+@app.on_event("shutdown")
+def stop_memory_compaction_job():
+    memory_compactor.stop()
+
+def chat_session_id(session_id: Optional[str], current_user: Optional[User]) -> Optional[str]:
+    """
+    Guest memory is scoped to the session, so guests without one are issued a
+    new session ID (returned in the response; send it back to continue)
+    """
+    if session_id or current_user:
+        return session_id
+    return str(uuid.uuid4())
+
+def require_retriever_ready():
+    """
+    Raise 503 until the vector store is ready (retrying initialization if it failed)
+    """
+    if vector.is_ready():
+        return
+    
+    vector.start_background_initialization()
+    detail = "Chat is starting up: the car knowledge base is still being indexed. Please try again shortly."
+    if vector.get_init_error() is not None:
+        detail = f"Car knowledge base is unavailable: {str(vector.get_init_error())}"
+    raise HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=detail,
+        headers={"Retry-After": str(llm_limiter.retry_after)}
+    )
 
 @app.get("/")
 def read_root():
@@ -200,7 +357,24 @@ def create_user(user_data: CreateUserRequest):
 
 @app.get("/health")
 def health_check():
-    return {"status": "healthy", "timestamp": "2025-09-16", "version": "2.0.0"}
+    return {
+        "status": "healthy",
+        "timestamp": datetime.utcnow().isoformat(),
+        "version": "2.0.0",
+        "retriever_ready": vector.is_ready(),
+        "llm_endpoints": get_llm_endpoint_stats(),
+        "chat_writer": chat_writer.stats(),
+        "memory_cache": memory_cache.stats() if memory_cache is not None else None,
+        "memory_compaction": memory_compactor.stats(),
+        "stage_timings": get_stage_summaries()
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """
+    Prometheus metrics (text exposition format)
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 @app.get("/api/cars", response_model=CarsListResponse)
 def get_cars():
@@ -294,8 +468,9 @@ def get_car_by_id(car_id: int):
         )
 
 @app.post("/api/chatbot", response_model=ChatbotResponse)
-def chatbot_api(
+async def chatbot_api(
     request: ChatbotRequest,
+    debug: bool = False,
     current_user: Optional[User] = Depends(get_optional_current_user)
 ):
     """
@@ -305,7 +480,13 @@ def chatbot_api(
     try:
         user_message = request.message
         selected_car_ids = request.selected_cars or []
-        session_id = request.session_id
+        session_id = chat_session_id(request.session_id, current_user)
+        
+        # Spec/price lookups are answered straight from the catalog, no LLM needed
+        with timed("route"):
+            catalog_answer = None if selected_car_ids else await run_in_threadpool(route_car_query, user_message)
+        if catalog_answer is None:
+            require_retriever_ready()
         
         # Get selected cars info if any
         selected_cars_info = []
@@ -314,7 +495,8 @@ def chatbot_api(
                 # Convert string IDs to integers
                 car_ids = [int(car_id) for car_id in selected_car_ids]
                 # Get cars from database
-                selected_cars_from_db = get_cars_by_ids_controller(car_ids)
+                with timed("cars"):
+                    selected_cars_from_db = await run_in_threadpool(get_cars_by_ids_controller, car_ids)
                 selected_cars_info = [convert_car_to_response(car) for car in selected_cars_from_db]
             except ValueError:
                 # Handle invalid car IDs gracefully
@@ -330,14 +512,15 @@ def chatbot_api(
             user_id = current_user.id
             
             # Get relevant context from chat history
-            relevant_context = chat_memory.get_relevant_context(
+            relevant_context = await run_in_threadpool(
+                chat_memory.get_relevant_context,
                 user_id=user_id,
                 current_message=user_message,
                 limit=5
             )
             
             # Generate enhanced response with context
-            response_text = generate_enhanced_automotive_response_with_memory(
+            response_text = catalog_answer or await generate_enhanced_automotive_response_with_memory(
                 user_message, 
                 selected_cars_info, 
                 current_user, 
@@ -350,7 +533,8 @@ def chatbot_api(
                 context_used = context_summary
             
             # Store this interaction in memory
-            chat_memory.store_message(
+            await run_in_threadpool(
+                chat_writer.submit,
                 user_id=user_id,
                 user_message=user_message,
                 bot_response=response_text,
@@ -378,10 +562,12 @@ def chatbot_api(
             user_id = 0  # Use special guest user ID
             
             # Get relevant context from chat history for guest
-            relevant_context = chat_memory.get_relevant_context(
+            relevant_context = await run_in_threadpool(
+                chat_memory.get_relevant_context,
                 user_id=user_id,
                 current_message=user_message,
-                limit=3  # Fewer context items for guests
+                limit=3,  # Fewer context items for guests
+                session_id=session_id  # Guests only see their own session's memory
             )
             
             # Create a temporary user object for the response generator
@@ -389,11 +575,13 @@ def chatbot_api(
             temp_user = UserModel(id=0, name="Guest", email="guest@example.com", number="", password="")
             
             # Generate enhanced response with context even for guests
-            response_text = generate_enhanced_automotive_response_with_memory(
+            # (guests without selected cars may be served from the response cache)
+            response_text = catalog_answer or await generate_enhanced_automotive_response_with_memory(
                 user_message, 
                 selected_cars_info, 
                 temp_user, 
-                relevant_context
+                relevant_context,
+                cache_response=not selected_car_ids
             )
             
             # Prepare context summary for response
@@ -402,7 +590,8 @@ def chatbot_api(
                 context_used = context_summary
             
             # Store this interaction in memory for guest user
-            chat_memory.store_message(
+            await run_in_threadpool(
+                chat_writer.submit,
                 user_id=user_id,
                 user_message=user_message,
                 bot_response=response_text,
@@ -419,7 +608,9 @@ def chatbot_api(
             timestamp=datetime.utcnow(),
             selected_cars_info=selected_cars_info if selected_cars_info else None,
             session_id=session_id,
-            context_used=context_used
+            context_used=context_used,
+            prompt_tokens=get_prompt_tokens(),
+            timings=get_request_timings() if debug else None
         )
         
     except HTTPException as e:
@@ -431,9 +622,10 @@ def chatbot_api(
         )
 
 @app.post("/api/chatbot/car/{car_id}", response_model=CarSpecificChatbotResponse)
-def car_specific_chatbot_api(
+async def car_specific_chatbot_api(
     car_id: int,
     request: CarSpecificChatbotRequest,
+    debug: bool = False,
     current_user: Optional[User] = Depends(get_optional_current_user)
 ):
     """
@@ -441,12 +633,14 @@ def car_specific_chatbot_api(
     Enhanced with car-specific context and knowledge
     """
     try:
+        # No retriever needed: the car's catalog document is looked up directly
         user_message = request.message
-        session_id = request.session_id
+        session_id = chat_session_id(request.session_id, current_user)
         
         # Get the specific car details
         try:
-            cars_from_db = get_cars_by_ids_controller([car_id])
+            with timed("cars"):
+                cars_from_db = await run_in_threadpool(get_cars_by_ids_controller, [car_id])
             if not cars_from_db:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
@@ -472,14 +666,15 @@ def car_specific_chatbot_api(
             user_id = current_user.id
             
             # Get relevant context from chat history with car-specific filter
-            relevant_context = chat_memory.get_relevant_context(
+            relevant_context = await run_in_threadpool(
+                chat_memory.get_relevant_context,
                 user_id=user_id,
                 current_message=user_message,
                 limit=5
             )
             
             # Generate specialized car-specific response
-            response_text = generate_car_specific_response_with_memory(
+            response_text = await generate_car_specific_response_with_memory(
                 user_message, 
                 car_info, 
                 current_user, 
@@ -494,7 +689,8 @@ def car_specific_chatbot_api(
             specialized_context = f"Specialized knowledge for {car_response.model_year} {car_response.model_name} {car_response.trim_variant}"
             
             # Store this interaction in memory with car-specific tagging
-            chat_memory.store_message(
+            await run_in_threadpool(
+                chat_writer.submit,
                 user_id=user_id,
                 user_message=user_message,
                 bot_response=response_text,
@@ -522,10 +718,12 @@ def car_specific_chatbot_api(
             user_id = 0  # Use special guest user ID
             
             # Get relevant context from chat history for guest
-            relevant_context = chat_memory.get_relevant_context(
+            relevant_context = await run_in_threadpool(
+                chat_memory.get_relevant_context,
                 user_id=user_id,
                 current_message=user_message,
-                limit=3  # Fewer context items for guests
+                limit=3,  # Fewer context items for guests
+                session_id=session_id  # Guests only see their own session's memory
             )
             
             # Create a temporary user object for the response generator
@@ -533,7 +731,7 @@ def car_specific_chatbot_api(
             temp_user = UserModel(id=0, name="Guest", email="guest@example.com", number="", password="")
             
             # Generate specialized car-specific response
-            response_text = generate_car_specific_response_with_memory(
+            response_text = await generate_car_specific_response_with_memory(
                 user_message, 
                 car_info, 
                 temp_user, 
@@ -548,7 +746,8 @@ def car_specific_chatbot_api(
             specialized_context = f"Specialized knowledge for {car_response.model_year} {car_response.model_name} {car_response.trim_variant}"
             
             # Store this interaction in memory for guest user with car-specific tagging
-            chat_memory.store_message(
+            await run_in_threadpool(
+                chat_writer.submit,
                 user_id=user_id,
                 user_message=user_message,
                 bot_response=response_text,
@@ -566,7 +765,188 @@ def car_specific_chatbot_api(
             timestamp=datetime.utcnow(),
             session_id=session_id,
             context_used=context_used,
-            specialized_context=specialized_context
+            specialized_context=specialized_context,
+            prompt_tokens=get_prompt_tokens(),
+            timings=get_request_timings() if debug else None
+        )
+        
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Car-specific chatbot API error: {str(e)}"
+        )
+
+async def _stream_chat_events(chunks, on_complete, done_payload, include_timings=False):
+    """
+    Wrap an async LLM chunk generator as NDJSON events.
+    Emits {"type": "token"} lines while generating and a final {"type": "done"} line;
+    on_complete receives the full text once the stream has finished.
+    With include_timings the done line carries the full stage breakdown.
+    """
+    parts = []
+    try:
+        async for chunk in chunks:
+            parts.append(chunk)
+            yield json.dumps({"type": "token", "content": chunk}) + "\n"
+        
+        response_text = "".join(parts)
+        await run_in_threadpool(on_complete, response_text)
+        
+        done_payload = {**done_payload, "prompt_tokens": get_prompt_tokens(), "timestamp": datetime.utcnow().isoformat()}
+        if include_timings:
+            done_payload["timings"] = get_request_timings()
+        yield json.dumps({"type": "done", **done_payload}) + "\n"
+    except HTTPException as e:
+        yield json.dumps({"type": "error", "status_code": e.status_code, "detail": e.detail}) + "\n"
+    except Exception as e:
+        yield json.dumps({"type": "error", "detail": f"Streaming error: {str(e)}"}) + "\n"
+
+
+async def _single_chunk(text: str):
+    yield text
+
+
+@app.post("/api/chatbot/stream")
+async def chatbot_stream_api(
+    request: ChatbotRequest,
+    debug: bool = False,
+    current_user: Optional[User] = Depends(get_optional_current_user)
+):
+    """
+    Streaming variant of /api/chatbot - returns NDJSON token events as the model generates them
+    The full response is stored in chat memory once the stream finishes
+    """
+    try:
+        user_message = request.message
+        selected_car_ids = request.selected_cars or []
+        session_id = chat_session_id(request.session_id, current_user)
+        
+        # Spec/price lookups are answered straight from the catalog, no LLM needed
+        with timed("route"):
+            catalog_answer = None if selected_car_ids else await run_in_threadpool(route_car_query, user_message)
+        
+        # Reject up front rather than after the 200 response has started
+        if catalog_answer is None:
+            require_retriever_ready()
+            llm_limiter.check_capacity()
+        
+        selected_cars_info = []
+        if selected_car_ids:
+            try:
+                car_ids = [int(car_id) for car_id in selected_car_ids]
+                with timed("cars"):
+                    selected_cars_from_db = await run_in_threadpool(get_cars_by_ids_controller, car_ids)
+                selected_cars_info = [convert_car_to_response(car) for car in selected_cars_from_db]
+            except ValueError:
+                selected_cars_info = []
+        
+        # Guests share the special guest user ID and get fewer context items
+        user_id = current_user.id if current_user else 0
+        relevant_context = await run_in_threadpool(
+            chat_memory.get_relevant_context,
+            user_id=user_id,
+            current_message=user_message,
+            limit=5 if current_user else 3,
+            session_id=session_id
+        )
+        context_used = f"Used {len(relevant_context)} previous conversation(s) for context" if relevant_context else None
+        user_name = current_user.name if current_user and current_user.name else "Customer"
+        
+        if catalog_answer is not None:
+            chunks = _single_chunk(catalog_answer)
+        else:
+            chunks = astream_response_with_memory(
+                user_input=user_message,
+                conversation_context=relevant_context,
+                selected_cars=selected_cars_info,
+                user_name=user_name,
+                cache_response=current_user is None and not selected_car_ids
+            )
+        
+        def store_turn(response_text: str):
+            chat_writer.submit(
+                user_id=user_id,
+                user_message=user_message,
+                bot_response=response_text,
+                selected_cars=selected_car_ids,
+                session_id=session_id,
+                context_used=context_used
+            )
+        
+        return StreamingResponse(
+            _stream_chat_events(chunks, store_turn, {"session_id": session_id, "context_used": context_used}, debug),
+            media_type="application/x-ndjson"
+        )
+        
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Chatbot API error: {str(e)}"
+        )
+
+@app.post("/api/chatbot/car/{car_id}/stream")
+async def car_specific_chatbot_stream_api(
+    car_id: int,
+    request: CarSpecificChatbotRequest,
+    debug: bool = False,
+    current_user: Optional[User] = Depends(get_optional_current_user)
+):
+    """
+    Streaming variant of /api/chatbot/car/{car_id} - returns NDJSON token events
+    The full response is stored in chat memory once the stream finishes
+    """
+    try:
+        # Reject up front rather than after the 200 response has started
+        # (no retriever needed: the car's catalog document is looked up directly)
+        llm_limiter.check_capacity()
+        
+        user_message = request.message
+        session_id = chat_session_id(request.session_id, current_user)
+        
+        with timed("cars"):
+            cars_from_db = await run_in_threadpool(get_cars_by_ids_controller, [car_id])
+        if not cars_from_db:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Car with ID {car_id} not found"
+            )
+        car_info = cars_from_db[0]
+        
+        user_id = current_user.id if current_user else 0
+        relevant_context = await run_in_threadpool(
+            chat_memory.get_relevant_context,
+            user_id=user_id,
+            current_message=user_message,
+            limit=5 if current_user else 3,
+            session_id=session_id
+        )
+        context_used = f"Used {len(relevant_context)} previous conversation(s) for context" if relevant_context else None
+        user_name = current_user.name if current_user and current_user.name else "Customer"
+        
+        chunks = astream_response_with_car_specific_context(
+            user_input=user_message,
+            specific_car=car_info,
+            conversation_context=relevant_context,
+            user_name=user_name
+        )
+        
+        def store_turn(response_text: str):
+            chat_writer.submit(
+                user_id=user_id,
+                user_message=user_message,
+                bot_response=response_text,
+                selected_cars=[str(car_id)],
+                session_id=session_id,
+                context_used=f"{context_used} | Car-specific mode: {car_id}" if context_used else f"Car-specific mode: {car_id}"
+            )
+        
+        return StreamingResponse(
+            _stream_chat_events(chunks, store_turn, {"session_id": session_id, "context_used": context_used, "car_id": car_id}, debug),
+            media_type="application/x-ndjson"
         )
         
     except HTTPException as e:
@@ -587,6 +967,8 @@ def chatbot_message(
     Process chatbot message and return AI response
     """
     try:
+        require_retriever_ready()
+        
         user_message = message.get("message", "")
         print(message, current_user)
 
@@ -639,29 +1021,30 @@ def generate_enhanced_automotive_response(message: str, selected_cars: list, use
     return generate_automotive_response(enhanced_message, user)
 
 
-def generate_enhanced_automotive_response_with_memory(message: str, selected_cars, user, conversation_context=None):
+async def generate_enhanced_automotive_response_with_memory(message: str, selected_cars, user, conversation_context=None, cache_response=False):
     """
     Generate automotive response using memory/RAG context
     """
     # Prepare user name for personalization
     user_name = user.name if hasattr(user, 'name') and user.name and user.name != "Guest" else "Customer"
     
-    return get_response_with_memory(
+    return await aget_response_with_memory(
         user_input=message,
         conversation_context=conversation_context,
         selected_cars=selected_cars,
-        user_name=user_name
+        user_name=user_name,
+        cache_response=cache_response
     )
 
 
-def generate_car_specific_response_with_memory(message: str, specific_car, user, conversation_context=None):
+async def generate_car_specific_response_with_memory(message: str, specific_car, user, conversation_context=None):
     """
     Generate specialized car-focused response using memory/RAG context
     """
     # Prepare user name for personalization
     user_name = user.name if hasattr(user, 'name') and user.name else "Customer"
     
-    return get_response_with_car_specific_context(
+    return await aget_response_with_car_specific_context(
         user_input=message,
         specific_car=specific_car,
         conversation_context=conversation_context,
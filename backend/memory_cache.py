@@ -0,0 +1,220 @@
+"""
+In-process cache of active users' chat memory
+
+A user in an active conversation adds one memory entry per turn, yet
+get_relevant_context used to read their history from the database every
+turn. The cache keeps each active user's memory window (the last 30 days of
+entries, with the message text and the features used for scoring) so context
+lookups run without a query. The first lookup loads the window from the
+database. store_message / store_messages then append new entries
+write-through.
+
+The cache is bounded by the total number of entries across users, evicting
+least recently used users first. Users with more than
+MEMORY_CACHE_MAX_USER_ENTRIES entries in the window are not cached and keep
+using the database. Entries are reloaded after MEMORY_CACHE_TTL_SECONDS, which
+bounds staleness when several processes write to the same database.
+"""
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MEMORY_CACHE_ENABLED = os.getenv("MEMORY_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+MEMORY_CACHE_MAX_ENTRIES = int(os.getenv("MEMORY_CACHE_MAX_ENTRIES", "50000"))
+MEMORY_CACHE_MAX_USER_ENTRIES = int(os.getenv("MEMORY_CACHE_MAX_USER_ENTRIES", "2000"))
+MEMORY_CACHE_TTL_SECONDS = float(os.getenv("MEMORY_CACHE_TTL_SECONDS", "300"))
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def to_microseconds(value: datetime) -> int:
+    """Naive UTC datetime as integer microseconds (exact, unlike timestamp())"""
+    return (value - _EPOCH) // _MICROSECOND
+
+
+class CachedMemory(NamedTuple):
+    """A memory entry with its message, as needed to score and return it"""
+    message_id: int
+    keyword_mask: int
+    model_mask: int
+    intent: Optional[str]
+    importance_score: float
+    created_at: int  # entry created_at, microseconds since the epoch
+    car_models_mentioned: Optional[str]
+    message: str
+    response: Optional[str]
+    message_created_at: datetime
+
+
+def _entry_size(entry: CachedMemory) -> int:
+    return sys.getsizeof(entry) + sum(sys.getsizeof(value) for value in entry)
+
+
+class _UserMemory:
+    __slots__ = ("entries", "size", "loaded_at")
+
+    def __init__(self, entries: List[CachedMemory]):
+        self.entries = entries
+        self.size = sum(_entry_size(entry) for entry in entries)
+        self.loaded_at = time.monotonic()
+
+
+class UserMemoryCache:
+    """
+    LRU cache (by total entries) of each active user's memory window
+    """
+    def __init__(
+        self,
+        max_entries: int = MEMORY_CACHE_MAX_ENTRIES,
+        max_user_entries: int = MEMORY_CACHE_MAX_USER_ENTRIES,
+        ttl_seconds: float = MEMORY_CACHE_TTL_SECONDS
+    ):
+        self.max_entries = max_entries
+        self.max_user_entries = max(0, min(max_user_entries, max_entries))
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._users: "OrderedDict[int, _UserMemory]" = OrderedDict()
+        self._entries = 0
+        self._bytes = 0
+        # Users over max_user_entries -> when that was seen
+        self._oversized: "OrderedDict[int, float]" = OrderedDict()
+        # Write generations, so a load that raced a write is not cached
+        self._generation = 0
+        self._last_write: Dict[int, int] = {}
+        self._oldest_valid_load = 0
+
+    def get(self, user_id: int) -> Optional[List[CachedMemory]]:
+        """
+        The user's cached entries (a snapshot), or None if they have to be loaded
+        """
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is not None and time.monotonic() - user.loaded_at > self.ttl_seconds:
+                self._remove(user_id)
+                user = None
+            if user is None:
+                self.misses += 1
+                return None
+            self._users.move_to_end(user_id)
+            self.hits += 1
+            return list(user.entries)
+
+    def begin_load(self) -> int:
+        """Token to pass to put() for entries read from the database after this call"""
+        with self._lock:
+            return self._generation
+
+    def put(self, user_id: int, entries: List[CachedMemory], token: int) -> bool:
+        """
+        Cache a user's entries loaded from the database; skipped if the user wrote
+        since begin_load (the load may have missed it) or has too many entries
+        """
+        with self._lock:
+            if token < self._oldest_valid_load or self._last_write.get(user_id, -1) > token:
+                return False
+            self._last_write.pop(user_id, None)
+            if len(entries) > self.max_user_entries:
+                self._mark_oversized(user_id)
+                return False
+            if user_id in self._users:
+                self._remove(user_id)
+            user = self._users[user_id] = _UserMemory(list(entries))
+            self._entries += len(user.entries)
+            self._bytes += user.size
+            self._evict()
+            return True
+
+    def add(self, user_id: int, entries: List[CachedMemory]):
+        """Write-through: append newly stored entries to a cached user"""
+        with self._lock:
+            self._generation += 1
+            self._last_write[user_id] = self._generation
+            if len(self._last_write) > self.max_entries:
+                # Forget old writes; loads that started before now are not cached
+                self._last_write.clear()
+                self._oldest_valid_load = self._generation
+
+            user = self._users.get(user_id)
+            if user is None:
+                return
+            if len(user.entries) + len(entries) > self.max_user_entries:
+                self._remove(user_id)
+                self._mark_oversized(user_id)
+                return
+            user.entries.extend(entries)
+            added = sum(_entry_size(entry) for entry in entries)
+            user.size += added
+            self._entries += len(entries)
+            self._bytes += added
+            self._evict()
+
+    def invalidate(self, user_id: Optional[int] = None):
+        """Drop one user's entries (or everyone's) after changes made outside store_message"""
+        with self._lock:
+            self._generation += 1
+            self._oldest_valid_load = self._generation
+            if user_id is None:
+                self._users.clear()
+                self._oversized.clear()
+                self._entries = self._bytes = 0
+            else:
+                self._oversized.pop(user_id, None)
+                if user_id in self._users:
+                    self._remove(user_id)
+
+    def is_oversized(self, user_id: int) -> bool:
+        """True while a user recently had too many entries to cache (skip loading them)"""
+        with self._lock:
+            marked_at = self._oversized.get(user_id)
+            if marked_at is None:
+                return False
+            if time.monotonic() - marked_at > self.ttl_seconds:
+                del self._oversized[user_id]
+                return False
+            return True
+
+    def _mark_oversized(self, user_id: int):
+        self._oversized[user_id] = time.monotonic()
+        self._oversized.move_to_end(user_id)
+        while len(self._oversized) > self.max_entries:
+            self._oversized.popitem(last=False)
+
+    def _remove(self, user_id: int):
+        user = self._users.pop(user_id)
+        self._entries -= len(user.entries)
+        self._bytes -= user.size
+
+    def _evict(self):
+        while self._entries > self.max_entries:
+            self._remove(next(iter(self._users)))
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "users": len(self._users),
+                "entries": self._entries,
+                "max_entries": self.max_entries,
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+# Global instance (None when MEMORY_CACHE_ENABLED is off)
+memory_cache = UserMemoryCache() if MEMORY_CACHE_ENABLED else None
@@ -0,0 +1,452 @@
+"""
+Retention and compaction of chat memory entries
+
+ChatMemoryEntry keeps every turn's user message and bot response, but context
+lookups only read the last 30 days (and a guest session's last
+GUEST_MEMORY_TTL_MINUTES). The compaction job keeps the memory tables bounded:
+
+- Entries older than MEMORY_RETENTION_DAYS are deleted with their keyword/model
+  index rows. Guest entries are deleted once past the guest memory TTL, after
+  which nothing reads them.
+- Older entries (past MEMORY_SUMMARIZE_AFTER_DAYS) are merged per conversation
+  into one summary entry. The summary holds the conversation's questions
+  (newest first, up to MEMORY_SUMMARY_MAX_CHARS), the union of their keywords
+  and car models (with masks and index rows), the most common intent and the
+  highest importance. Later runs merge newly aged entries into it.
+- With MEMORY_ARCHIVE_PATH set, removed entries are appended to that JSON-lines
+  file first.
+- The memory tables are then vacuumed and analyzed, so the space is reused and
+  the planner sees the new row counts. PostgreSQL gets VACUUM (ANALYZE) per
+  table. SQLite gets ANALYZE and PRAGMA incremental_vacuum (which only frees
+  pages in databases created with auto_vacuum=INCREMENTAL); a full VACUUM
+  rewrites and locks the whole database file, so it only runs from the
+  command line with --full-vacuum.
+
+Chat history (ChatMessage) is not touched. With MEMORY_COMPACTION_ENABLED the
+job runs in a background thread at startup and then every
+MEMORY_COMPACTION_INTERVAL_HOURS. It can also be run by hand:
+
+    python memory_compaction.py --dry-run   # what would be removed, and the space reclaimed
+    python memory_compaction.py [--json] [--full-vacuum]
+
+Runs in several processes may overlap: a batch whose entries another run has
+already removed is rolled back.
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from itertools import groupby
+from typing import List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import and_, delete, insert, or_, text
+from sqlmodel import Session, func, select
+
+from chat_memory_controller import GUEST_MEMORY_TTL_MINUTES, GUEST_USER_ID, keyword_mask, model_mask
+from models import ChatMemoryEntry, ChatMemoryModel, ChatMemoryTerm
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+MEMORY_COMPACTION_ENABLED = os.getenv("MEMORY_COMPACTION_ENABLED", "false").lower() in ("1", "true", "yes")
+MEMORY_COMPACTION_INTERVAL_HOURS = float(os.getenv("MEMORY_COMPACTION_INTERVAL_HOURS", "24"))
+MEMORY_RETENTION_DAYS = int(os.getenv("MEMORY_RETENTION_DAYS", "90"))
+MEMORY_SUMMARIZE_AFTER_DAYS = int(os.getenv("MEMORY_SUMMARIZE_AFTER_DAYS", "7"))
+MEMORY_SUMMARY_MAX_CHARS = int(os.getenv("MEMORY_SUMMARY_MAX_CHARS", "500"))
+MEMORY_ARCHIVE_PATH = os.getenv("MEMORY_ARCHIVE_PATH", "")
+MEMORY_COMPACTION_VACUUM = os.getenv("MEMORY_COMPACTION_VACUUM", "true").lower() in ("1", "true", "yes")
+
+SUMMARY_PREFIX = "Earlier in this conversation: "
+_TOPIC_MAX_CHARS = 120
+
+MEMORY_TABLES = [ChatMemoryEntry.__table__, ChatMemoryTerm.__table__, ChatMemoryModel.__table__]
+
+# Space estimates: text is counted in the row and once per index holding it
+# (the entry's content index, the term/model primary keys and lookup indexes),
+# plus a rough fixed cost per row for headers, integer/timestamp columns and index entries
+_ENTRY_ROW_OVERHEAD = 96
+_INDEX_ROW_OVERHEAD = 72
+
+
+def _terms(value: Optional[str]) -> List[str]:
+    return json.loads(value) if value else []
+
+
+def _entry_bytes(content: str, keywords: Optional[str], intent: Optional[str], car_models: Optional[str]) -> int:
+    """Approximate bytes an entry and its index rows take (see _ENTRY_ROW_OVERHEAD)"""
+    size = _ENTRY_ROW_OVERHEAD + 2 * len(content.encode())
+    size += sum(len(value.encode()) for value in (keywords, intent, car_models) if value)
+    for term in set(_terms(keywords)) | set(_terms(car_models)):
+        size += _INDEX_ROW_OVERHEAD + 3 * len(term.encode())
+    return size
+
+
+def _index_rows(entry) -> int:
+    return len(set(_terms(entry.keywords))) + len(set(_terms(entry.car_models_mentioned)))
+
+
+def _topic(text: str) -> str:
+    topic = " ".join(text.split())
+    if len(topic) > _TOPIC_MAX_CHARS:
+        topic = topic[:_TOPIC_MAX_CHARS - 3].rstrip() + "..."
+    return topic
+
+
+def memory_table_bytes(engine) -> Optional[int]:
+    """
+    Size of the memory tables with their indexes (PostgreSQL) or of the whole
+    database file (SQLite); None for other databases
+    """
+    with engine.connect() as connection:
+        if engine.dialect.name == "postgresql":
+            return connection.execute(text(
+                "SELECT " + " + ".join(f"pg_total_relation_size('{table.name}')" for table in MEMORY_TABLES)
+            )).scalar()
+        if engine.dialect.name == "sqlite":
+            page_count = connection.execute(text("PRAGMA page_count")).scalar()
+            return page_count * connection.execute(text("PRAGMA page_size")).scalar()
+    return None
+
+
+def vacuum_memory_tables(engine, full: bool = False) -> bool:
+    """
+    Reclaim the space of deleted rows and refresh planner statistics; returns
+    False for databases without a known command. full rebuilds a SQLite
+    database file (offline use only)
+    """
+    preparer = engine.dialect.identifier_preparer
+    # VACUUM cannot run inside a transaction
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        if engine.dialect.name == "postgresql":
+            # Space goes back to the table's free space map, to be reused by new entries
+            for table in MEMORY_TABLES:
+                connection.execute(text(f"VACUUM (ANALYZE) {preparer.format_table(table)}"))
+            return True
+        if engine.dialect.name == "sqlite":
+            if full:
+                # Rewrites the whole database file (locks it for the duration)
+                connection.execute(text("VACUUM"))
+            else:
+                # Frees one page per step; executescript steps it to completion
+                connection.connection.driver_connection.executescript("PRAGMA incremental_vacuum")
+            for table in MEMORY_TABLES:
+                connection.execute(text(f"ANALYZE {preparer.format_table(table)}"))
+            return True
+    return False
+
+
+class MemoryCompactor:
+    """
+    Deletes expired memory entries, merges old ones into per-conversation
+    summaries and vacuums the memory tables
+    """
+    def __init__(
+        self,
+        memory=None,
+        retention_days: int = MEMORY_RETENTION_DAYS,
+        summarize_after_days: int = MEMORY_SUMMARIZE_AFTER_DAYS,
+        summary_max_chars: int = MEMORY_SUMMARY_MAX_CHARS,
+        archive_path: Optional[str] = MEMORY_ARCHIVE_PATH or None,
+        vacuum: bool = MEMORY_COMPACTION_VACUUM,
+        full_vacuum: bool = False,
+        batch_size: int = 1000
+    ):
+        self._memory = memory
+        self.retention_days = retention_days
+        self.summarize_after_days = summarize_after_days
+        self.summary_max_chars = summary_max_chars
+        self.archive_path = archive_path
+        self.vacuum = vacuum
+        self.full_vacuum = full_vacuum
+        self.batch_size = batch_size
+        self.runs = 0
+        self.entries_removed = 0
+        self.summaries_created = 0
+        self.bytes_reclaimed = 0
+        self.last_report = None
+        self._lock = threading.Lock()  # One run at a time in this process
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def memory(self):
+        if self._memory is None:
+            from chat_memory_controller import chat_memory
+            self._memory = chat_memory
+        return self._memory
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def run(self, dry_run: bool = False, now: Optional[datetime] = None) -> dict:
+        """
+        Compact the memory tables; with dry_run, only report what would be
+        removed and the (estimated) bytes reclaimed
+        """
+        now = now or datetime.utcnow()
+        engine = self.memory.engine
+        with self._lock:
+            started = time.perf_counter()
+            report = {
+                "dry_run": dry_run,
+                "expired_entries": 0,
+                "summarized_entries": 0,
+                "summaries": 0,
+                "index_rows_deleted": 0,
+                "archived": 0,
+                "bytes_reclaimed": 0,
+                "vacuumed": False,
+                "table_bytes_before": memory_table_bytes(engine),
+                "table_bytes_after": None,
+            }
+            self._expire(report, now, dry_run)
+            self._summarize(report, now, dry_run)
+
+            if not dry_run:
+                if report["expired_entries"] or report["summarized_entries"]:
+                    if self.memory.cache is not None:
+                        self.memory.cache.invalidate()
+                    if self.vacuum:
+                        report["vacuumed"] = vacuum_memory_tables(engine, full=self.full_vacuum)
+                report["table_bytes_after"] = memory_table_bytes(engine)
+                self.runs += 1
+                self.entries_removed += report["expired_entries"] + report["summarized_entries"]
+                self.summaries_created += report["summaries"]
+                self.bytes_reclaimed += report["bytes_reclaimed"]
+            report["seconds"] = round(time.perf_counter() - started, 3)
+            self.last_report = {**report, "finished_at": datetime.utcnow().isoformat()}
+        logger.info("Memory compaction%s: %s", " (dry run)" if dry_run else "", report)
+        return report
+
+    def _expire(self, report: dict, now: datetime, dry_run: bool):
+        expired = or_(
+            and_(
+                ChatMemoryEntry.user_id != GUEST_USER_ID,
+                ChatMemoryEntry.created_at < now - timedelta(days=self.retention_days)
+            ),
+            and_(
+                ChatMemoryEntry.user_id == GUEST_USER_ID,
+                ChatMemoryEntry.created_at < now - timedelta(minutes=GUEST_MEMORY_TTL_MINUTES)
+            )
+        )
+        last_id = 0
+        while True:
+            with Session(self.memory.engine) as session:
+                entries = session.exec(
+                    select(ChatMemoryEntry).where(expired, ChatMemoryEntry.id > last_id)
+                    .order_by(ChatMemoryEntry.id).limit(self.batch_size)
+                ).all()
+                if not entries:
+                    return
+                last_id = entries[-1].id
+                if not dry_run:
+                    if not self._delete(session, entries, "expired"):
+                        continue
+                    session.commit()
+                    report["archived"] += len(entries) if self.archive_path else 0
+            report["expired_entries"] += len(entries)
+            report["index_rows_deleted"] += sum(_index_rows(entry) for entry in entries)
+            report["bytes_reclaimed"] += sum(
+                _entry_bytes(entry.content, entry.keywords, entry.intent, entry.car_models_mentioned) for entry in entries
+            )
+
+    def _summarize(self, report: dict, now: datetime, dry_run: bool):
+        # (entries past retention are left to _expire, so a dry run does not count them twice)
+        old = and_(
+            ChatMemoryEntry.user_id != GUEST_USER_ID,
+            ChatMemoryEntry.created_at < now - timedelta(days=self.summarize_after_days),
+            ChatMemoryEntry.created_at >= now - timedelta(days=self.retention_days)
+        )
+        # Conversations with more than one old entry (one is an earlier summary or nothing to merge)
+        with Session(self.memory.engine) as session:
+            conversation_ids = session.exec(
+                select(ChatMemoryEntry.conversation_id).where(old)
+                .group_by(ChatMemoryEntry.conversation_id).having(func.count() > 1)
+                .order_by(ChatMemoryEntry.conversation_id)
+            ).all()
+
+        step = max(1, self.batch_size // 10)
+        for start in range(0, len(conversation_ids), step):
+            with Session(self.memory.engine) as session:
+                entries = session.exec(
+                    select(ChatMemoryEntry).where(old, ChatMemoryEntry.conversation_id.in_(conversation_ids[start:start + step]))
+                    .order_by(ChatMemoryEntry.conversation_id, ChatMemoryEntry.created_at, ChatMemoryEntry.id)
+                ).all()
+                groups = [list(group) for _, group in groupby(entries, key=lambda entry: entry.conversation_id)]
+                groups = [group for group in groups if len(group) > 1]
+                if not groups:
+                    continue
+                summaries = [self.summarize_entries(group) for group in groups]
+                merged = [entry for group in groups for entry in group]
+
+                if not dry_run:
+                    if not self._delete(session, merged, "summarized"):
+                        continue
+                    entry_ids = session.execute(
+                        insert(ChatMemoryEntry).returning(ChatMemoryEntry.id, sort_by_parameter_order=True), summaries
+                    ).scalars().all()
+                    self.memory.index_memory_entries(session, [
+                        (entry_id, row["user_id"], row["created_at"], _terms(row["keywords"]), _terms(row["car_models_mentioned"]))
+                        for entry_id, row in zip(entry_ids, summaries)
+                    ])
+                    session.commit()
+                    report["archived"] += len(merged) if self.archive_path else 0
+
+            report["summarized_entries"] += len(merged)
+            report["summaries"] += len(summaries)
+            report["index_rows_deleted"] += sum(_index_rows(entry) for entry in merged)
+            report["bytes_reclaimed"] += sum(
+                _entry_bytes(entry.content, entry.keywords, entry.intent, entry.car_models_mentioned) for entry in merged
+            ) - sum(
+                _entry_bytes(row["content"], row["keywords"], row["intent"], row["car_models_mentioned"]) for row in summaries
+            )
+
+    def summarize_entries(self, entries: List[ChatMemoryEntry]) -> dict:
+        """
+        ChatMemoryEntry column values of the summary of one conversation's entries
+        (oldest first; an earlier summary among them is merged in)
+        """
+        topics = []
+        for entry in entries:
+            if entry.is_summary:
+                topics.extend(entry.content[len(SUMMARY_PREFIX):].split("; "))
+            else:
+                topics.append(entry.content.split(" | ", 1)[0])
+        topics = [_topic(topic) for topic in topics if topic.strip()]
+
+        # Newest questions first, each once, while they fit
+        kept, length = [], len(SUMMARY_PREFIX)
+        for topic in reversed(topics):
+            if topic in kept:
+                continue
+            if kept and length + len(topic) + 2 > self.summary_max_chars:
+                break
+            kept.append(topic)
+            length += len(topic) + 2
+        content = SUMMARY_PREFIX + "; ".join(reversed(kept))
+
+        keywords = sorted({term for entry in entries for term in _terms(entry.keywords)})
+        car_models = sorted({model for entry in entries for model in _terms(entry.car_models_mentioned)})
+        latest = entries[-1]
+        return {
+            "user_id": latest.user_id,
+            "conversation_id": latest.conversation_id,
+            "message_id": latest.message_id,
+            "content": content,
+            "keywords": json.dumps(keywords),
+            "intent": Counter(entry.intent for entry in entries).most_common(1)[0][0],
+            "car_models_mentioned": json.dumps(car_models),
+            "keyword_mask": keyword_mask(keywords),
+            "model_mask": model_mask(car_models),
+            "importance_score": max(entry.importance_score for entry in entries),
+            "created_at": latest.created_at,
+            "is_summary": True
+        }
+
+    def _delete(self, session: Session, entries: List[ChatMemoryEntry], reason: str) -> bool:
+        """
+        Delete entries with their index rows (archiving them first, if configured);
+        rolls back and returns False if another run removed some of them already
+        """
+        entry_ids = [entry.id for entry in entries]
+        session.execute(delete(ChatMemoryTerm).where(ChatMemoryTerm.entry_id.in_(entry_ids)))
+        session.execute(delete(ChatMemoryModel).where(ChatMemoryModel.entry_id.in_(entry_ids)))
+        deleted = session.execute(delete(ChatMemoryEntry).where(ChatMemoryEntry.id.in_(entry_ids))).rowcount
+        if deleted != len(entry_ids):
+            session.rollback()
+            return False
+        if self.archive_path:
+            # Before the commit: a crash may archive entries twice, never lose them
+            with open(self.archive_path, "a") as f:
+                for entry in entries:
+                    row = {column.name: getattr(entry, column.name) for column in ChatMemoryEntry.__table__.columns}
+                    f.write(json.dumps({**row, "archive_reason": reason}, default=lambda value: value.isoformat()) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        return True
+
+    def start(self, interval_hours: float = MEMORY_COMPACTION_INTERVAL_HOURS):
+        """
+        Run compaction now and every interval_hours in a daemon thread (no-op if already running)
+        """
+        if self.running:
+            return
+        self._stop.clear()
+
+        def run():
+            while not self._stop.is_set():
+                try:
+                    self.run()
+                except Exception:
+                    logger.exception("Memory compaction failed")
+                self._stop.wait(interval_hours * 3600)
+
+        self._thread = threading.Thread(target=run, name="memory-compaction", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.running,
+            "runs": self.runs,
+            "entries_removed": self.entries_removed,
+            "summaries_created": self.summaries_created,
+            "bytes_reclaimed": self.bytes_reclaimed,
+            "last_run": self.last_report,
+        }
+
+
+# Global instance
+memory_compactor = MemoryCompactor()
+
+
+def start_memory_compaction():
+    """Start the periodic compaction job when MEMORY_COMPACTION_ENABLED is on"""
+    if MEMORY_COMPACTION_ENABLED:
+        memory_compactor.start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact chat memory: retention, per-conversation summaries, VACUUM/ANALYZE")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would be removed and the space reclaimed")
+    parser.add_argument("--retention-days", type=int, default=MEMORY_RETENTION_DAYS)
+    parser.add_argument("--summarize-after-days", type=int, default=MEMORY_SUMMARIZE_AFTER_DAYS)
+    parser.add_argument("--archive-path", default=MEMORY_ARCHIVE_PATH or None)
+    parser.add_argument("--no-vacuum", action="store_true", help="Skip VACUUM/ANALYZE")
+    parser.add_argument("--full-vacuum", action="store_true",
+                        help="SQLite: rebuild the database file with VACUUM (locks it; stop the app first)")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    compactor = MemoryCompactor(
+        retention_days=args.retention_days,
+        summarize_after_days=args.summarize_after_days,
+        archive_path=args.archive_path,
+        vacuum=not args.no_vacuum,
+        full_vacuum=args.full_vacuum
+    )
+    report = compactor.run(dry_run=args.dry_run)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{'Dry run: would remove' if args.dry_run else 'Removed'} {report['expired_entries']} expired entries")
+    print(f"{'Would merge' if args.dry_run else 'Merged'} {report['summarized_entries']} entries into {report['summaries']} summaries")
+    print(f"Index rows deleted: {report['index_rows_deleted']}, archived entries: {report['archived']}")
+    print(f"Estimated space reclaimed: {report['bytes_reclaimed'] / 1024:.1f} KiB")
+    if report["table_bytes_before"] is not None:
+        after = report["table_bytes_after"]
+        print(f"Table size: {report['table_bytes_before'] / 1024:.1f} KiB" + (f" -> {after / 1024:.1f} KiB" if after is not None else ""))
+    print(f"Took {report['seconds']}s (vacuumed: {report['vacuumed']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""
+Prometheus metrics for capacity planning
+
+Rendered in the Prometheus text exposition format by GET /metrics. Request
+counts and latency are recorded by the middleware in main.py; everything
+else (LLM queue, DB pool, caches, rate limiter) is read from the existing
+counters at scrape time, so there is nothing to pay per request beyond a
+dictionary update and a histogram observation.
+
+Latency histograms use the stage buckets from timing.py, exported in seconds.
+"""
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+from timing import StageHistogram, get_stage_histograms
+
+_lock = threading.Lock()
+_requests: Dict[Tuple[str, str, str], int] = defaultdict(int)  # (method, route, status) -> count
+_request_latency: Dict[Tuple[str, str], StageHistogram] = {}  # (method, route) -> histogram (ms)
+_in_flight = {"http": 0, "chat": 0}
+
+_db_pool = {"checkouts": 0, "checked_out": 0, "connects": 0}
+_db_pool_wait = StageHistogram()
+_pools = []
+
+
+def is_chat_path(path: str) -> bool:
+    return path.startswith("/api/chatbot") or path.startswith("/chatbot/")
+
+
+def request_started(path: str):
+    with _lock:
+        _in_flight["http"] += 1
+        if is_chat_path(path):
+            _in_flight["chat"] += 1
+
+
+def request_finished(path: str, method: str, route: str, status_code: int, seconds: float):
+    """Count a finished request; route is the matched path template (not the raw URL)"""
+    with _lock:
+        _in_flight["http"] -= 1
+        if is_chat_path(path):
+            _in_flight["chat"] -= 1
+        _requests[(method, route, str(status_code))] += 1
+        histogram = _request_latency.get((method, route))
+        if histogram is None:
+            histogram = _request_latency[(method, route)] = StageHistogram()
+    histogram.observe(seconds * 1000)
+
+
+def instrument_engine(engine):
+    """
+    Track connection checkouts and time spent waiting for a pooled connection
+    (the wait includes opening a new connection when the pool has none idle)
+    """
+    pool = engine.pool
+    _pools.append(pool)
+
+    @event.listens_for(pool, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        with _lock:
+            _db_pool["connects"] += 1
+
+    @event.listens_for(pool, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        with _lock:
+            _db_pool["checkouts"] += 1
+            _db_pool["checked_out"] += 1
+
+    @event.listens_for(pool, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        with _lock:
+            _db_pool["checked_out"] -= 1
+
+    connect = pool.connect
+
+    def timed_connect():
+        start = time.perf_counter()
+        try:
+            return connect()
+        finally:
+            _db_pool_wait.observe((time.perf_counter() - start) * 1000)
+
+    pool.connect = timed_connect
+
+
+# Exposition
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _number(value) -> str:
+    return f"{value:g}" if isinstance(value, float) else str(value)
+
+
+class _Writer:
+    def __init__(self):
+        self.lines: List[str] = []
+
+    def header(self, name: str, kind: str, help_text: str):
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {kind}")
+
+    def sample(self, name: str, value, labels: dict = None):
+        self.lines.append(f"{name}{_labels(labels or {})} {_number(value)}")
+
+    def metric(self, name: str, kind: str, help_text: str, value, labels: dict = None):
+        self.header(name, kind, help_text)
+        self.sample(name, value, labels)
+
+    def histogram(self, name: str, histogram: StageHistogram, labels: dict = None):
+        """Write a millisecond StageHistogram as a Prometheus histogram in seconds"""
+        labels = labels or {}
+        snapshot = histogram.snapshot()
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, snapshot["buckets"].values()):
+            cumulative += count
+            self.sample(f"{name}_bucket", cumulative, {**labels, "le": _number(bound / 1000)})
+        self.sample(f"{name}_bucket", snapshot["count"], {**labels, "le": "+Inf"})
+        self.sample(f"{name}_sum", round(snapshot["sum_ms"] / 1000, 6), labels)
+        self.sample(f"{name}_count", snapshot["count"], labels)
+
+    def render(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text format"""
+    from chat_writer import chat_writer
+    from embedding_cache import get_query_embedding_cache
+    from llm_limiter import llm_limiter
+    from memory_cache import memory_cache
+    from memory_compaction import memory_compactor
+    from response_cache import get_response_cache
+    from security import login_rate_limiter
+
+    out = _Writer()
+
+    with _lock:
+        requests = dict(_requests)
+        latency = dict(_request_latency)
+        in_flight = dict(_in_flight)
+        db_pool = dict(_db_pool)
+
+    # HTTP
+    out.header("autocare_http_requests_total", "counter", "HTTP requests by method, route and status code")
+    for (method, route, status_code), count in sorted(requests.items()):
+        out.sample("autocare_http_requests_total", count, {"method": method, "route": route, "status": status_code})
+    out.header("autocare_http_request_duration_seconds", "histogram", "HTTP request latency (streaming responses until the last byte)")
+    for (method, route), histogram in sorted(latency.items()):
+        out.histogram("autocare_http_request_duration_seconds", histogram, {"method": method, "route": route})
+    out.metric("autocare_http_requests_in_flight", "gauge", "HTTP requests being processed", in_flight["http"])
+    out.metric("autocare_chat_requests_in_flight", "gauge", "Chat requests being processed (including open streams)", in_flight["chat"])
+
+    # Chat stages (timing.py)
+    out.header("autocare_chat_stage_duration_seconds", "histogram", "Time spent in each stage of chat requests")
+    for stage, histogram in sorted(get_stage_histograms().items()):
+        out.histogram("autocare_chat_stage_duration_seconds", histogram, {"stage": stage})
+
+    # LLM limiter
+    out.metric("autocare_llm_in_flight", "gauge", "LLM generations running", llm_limiter.in_flight)
+    out.metric("autocare_llm_queue_depth", "gauge", "Requests waiting for an LLM slot", llm_limiter.waiting)
+    out.metric("autocare_llm_max_concurrency", "gauge", "LLM slots (LLM_MAX_CONCURRENCY)", llm_limiter.max_concurrent)
+    out.metric("autocare_llm_max_queue", "gauge", "LLM wait queue bound (LLM_MAX_QUEUE)", llm_limiter.max_queue)
+
+    # Database pool
+    out.metric("autocare_db_pool_checkouts_total", "counter", "Connections checked out of the pool", db_pool["checkouts"])
+    out.metric("autocare_db_pool_connects_total", "counter", "New database connections opened", db_pool["connects"])
+    out.metric("autocare_db_pool_checked_out", "gauge", "Connections currently checked out", db_pool["checked_out"])
+    pool_sizes = [pool.size() for pool in _pools if isinstance(pool, QueuePool)]
+    if pool_sizes:
+        out.metric("autocare_db_pool_size", "gauge", "Configured pool size", sum(pool_sizes))
+    out.header("autocare_db_pool_wait_seconds", "histogram", "Time to get a connection from the pool")
+    out.histogram("autocare_db_pool_wait_seconds", _db_pool_wait)
+
+    # Caches
+    # (create=False: scraping must not open a cache that the app has not used)
+    for name, cache in (("embedding", get_query_embedding_cache(create=False)), ("response", get_response_cache(create=False))):
+        if cache is None:
+            continue
+        lookups = cache.hits + cache.misses
+        out.metric(f"autocare_{name}_cache_hits_total", "counter", f"{name.capitalize()} cache hits", cache.hits)
+        out.metric(f"autocare_{name}_cache_misses_total", "counter", f"{name.capitalize()} cache misses", cache.misses)
+        out.metric(f"autocare_{name}_cache_hit_ratio", "gauge", f"{name.capitalize()} cache hits / lookups",
+                   round(cache.hits / lookups, 4) if lookups else 0.0)
+
+    # Hot chat memory cache
+    if memory_cache is not None:
+        memory = memory_cache.stats()
+        out.metric("autocare_memory_cache_hits_total", "counter", "Memory context lookups served from the cache", memory["hits"])
+        out.metric("autocare_memory_cache_misses_total", "counter", "Memory context lookups that read the database", memory["misses"])
+        out.metric("autocare_memory_cache_hit_ratio", "gauge", "Memory cache hits / lookups", memory["hit_ratio"])
+        out.metric("autocare_memory_cache_users", "gauge", "Users in the memory cache", memory["users"])
+        out.metric("autocare_memory_cache_entries", "gauge", "Memory entries cached (MEMORY_CACHE_MAX_ENTRIES bound)", memory["entries"])
+        out.metric("autocare_memory_cache_bytes", "gauge", "Approximate memory used by cached entries", memory["bytes"])
+        out.metric("autocare_memory_cache_evictions_total", "counter", "Users evicted from the memory cache", memory["evictions"])
+
+    # Chat write-behind queue
+    writer = chat_writer.stats()
+    out.metric("autocare_chat_write_queue_depth", "gauge", "Chat turns waiting to be stored (write-behind queue)", writer["queue_depth"])
+    out.metric("autocare_chat_write_turns_total", "counter", "Chat turns stored by the write-behind queue", writer["written"])
+    out.metric("autocare_chat_write_batches_total", "counter", "Batches stored by the write-behind queue", writer["batches"])
+    out.metric("autocare_chat_write_failed_total", "counter", "Chat turns the write-behind queue failed to store", writer["failed"])
+
+    # Memory compaction job
+    compaction = memory_compactor.stats()
+    out.metric("autocare_memory_compaction_runs_total", "counter", "Memory compaction runs", compaction["runs"])
+    out.metric("autocare_memory_compaction_entries_removed_total", "counter", "Memory entries deleted or merged into summaries", compaction["entries_removed"])
+    out.metric("autocare_memory_compaction_summaries_total", "counter", "Summary memory entries created", compaction["summaries_created"])
+    out.metric("autocare_memory_compaction_bytes_reclaimed_total", "counter", "Estimated bytes reclaimed by memory compaction", compaction["bytes_reclaimed"])
+
+    # Login rate limiter
+    attempts = login_rate_limiter.attempts
+    out.metric("autocare_login_rate_limiter_identifiers", "gauge", "Identifiers tracked by the login rate limiter", len(attempts))
+    out.metric("autocare_login_rate_limiter_attempts", "gauge", "Failed login attempts held in memory",
+               sum(len(times) for times in list(attempts.values())))
+
+    return out.render()
@@ -1,5 +1,6 @@
 from typing import Optional, List
-from sqlmodel import SQLModel, Field, Relationship, UniqueConstraint
+from sqlalchemy import BigInteger, Column
+from sqlmodel import SQLModel, Field, Relationship, UniqueConstraint, Index
 from decimal import Decimal
 from datetime import datetime
 
@@ -81,6 +82,14 @@ class ChatMemoryEntry(SQLModel, table=True):
     """
     Stores preprocessed memory entries for RAG retrieval
     """
+    # Context retrieval reads one user's recent entries (overall and by intent)
+    __table_args__ = (
+        Index("ix_chatmemoryentry_user_id_created_at", "user_id", "created_at"),
+        Index("ix_chatmemoryentry_user_id_intent_created_at", "user_id", "intent", "created_at"),
+        # Guest context reads one conversation's latest entries
+        Index("ix_chatmemoryentry_conversation_id_created_at", "conversation_id", "created_at"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="user.id", index=True)
     conversation_id: int = Field(foreign_key="chatconversation.id")
@@ -91,10 +100,43 @@ class ChatMemoryEntry(SQLModel, table=True):
     keywords: Optional[str] = Field(default=None)  # Extracted keywords
     intent: Optional[str] = Field(default=None)  # Classified intent (comparison, info, etc.)
     car_models_mentioned: Optional[str] = Field(default=None)  # JSON array of mentioned models
+    # Keywords / models as bitmasks over the extraction vocabularies (see chat_memory_controller)
+    keyword_mask: Optional[int] = Field(default=None, sa_column=Column(BigInteger))
+    model_mask: Optional[int] = Field(default=None, sa_column=Column(BigInteger))
     
     # Relevance scoring
     importance_score: float = Field(default=0.5)  # 0-1 score for importance
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    # Merged from older entries of the conversation by memory_compaction (content is the summary)
+    is_summary: Optional[bool] = Field(default=False)
+
+
+class ChatMemoryTerm(SQLModel, table=True):
+    """
+    Inverted index of memory entry keywords (one row per entry and keyword)
+    """
+    __table_args__ = (
+        Index("ix_chatmemoryterm_user_id_term_created_at", "user_id", "term", "created_at"),
+    )
+
+    entry_id: int = Field(foreign_key="chatmemoryentry.id", primary_key=True)
+    term: str = Field(primary_key=True)
+    user_id: int = Field(foreign_key="user.id")
+    created_at: datetime  # Copied from the entry so old history is skipped by the index
+
+
+class ChatMemoryModel(SQLModel, table=True):
+    """
+    Inverted index of car models mentioned in memory entries (one row per entry and model)
+    """
+    __table_args__ = (
+        Index("ix_chatmemorymodel_user_id_model_created_at", "user_id", "model", "created_at"),
+    )
+
+    entry_id: int = Field(foreign_key="chatmemoryentry.id", primary_key=True)
+    model: str = Field(primary_key=True)
+    user_id: int = Field(foreign_key="user.id")
+    created_at: datetime  # Copied from the entry so old history is skipped by the index
 
 
 # Car-related models
@@ -119,7 +161,7 @@ class Car(SQLModel, table=True):
     engine_type: str
     displacement_cc: Optional[int] = None
     cylinders: str
-    horsepower_hp: Optional[int] = None
+    horsepower_hp: Optional[int] = Field(default=None, index=True)
     torque_nm: Optional[int] = None
     
     # Drivetrain
@@ -143,7 +185,7 @@ class Car(SQLModel, table=True):
     interior_materials_colors: Optional[str] = None
     
     # Pricing
-    base_msrp_usd: Optional[int] = None
+    base_msrp_usd: Optional[int] = Field(default=None, index=True)
     
     # Media
     image_link: Optional[str] = None
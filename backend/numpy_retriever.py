@@ -0,0 +1,179 @@
+"""
+In-process exact kNN retriever backed by a memory-mapped NumPy matrix
+
+For a catalog of ~100 documents a brute-force cosine search is a single
+(n x d) @ (d,) matmul, which is much cheaper than going through Chroma's
+persistence layer on every query.
+"""
+import json
+import os
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+MATRIX_FILE = "embeddings.npy"
+DOCUMENTS_FILE = "documents.json"
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalize each row (zero rows stay zero)"""
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class NumpyVectorIndex:
+    """
+    Normalized float32 embedding matrix plus the documents it was built from,
+    persisted as embeddings.npy + documents.json in a directory
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.documents: List[Document] = []
+
+    @property
+    def matrix_path(self) -> str:
+        return os.path.join(self.directory, MATRIX_FILE)
+
+    @property
+    def documents_path(self) -> str:
+        return os.path.join(self.directory, DOCUMENTS_FILE)
+
+    def exists(self) -> bool:
+        return os.path.exists(self.matrix_path) and os.path.exists(self.documents_path)
+
+    def load(self) -> "NumpyVectorIndex":
+        """
+        Memory-map the embedding matrix and load the documents
+        """
+        if not self.exists():
+            return self
+
+        self.matrix = np.load(self.matrix_path, mmap_mode="r")
+        with open(self.documents_path, "r", encoding="utf-8") as f:
+            records = json.load(f)
+        self.documents = [
+            Document(page_content=record["page_content"], metadata=record["metadata"], id=record["id"])
+            for record in records
+        ]
+        return self
+
+    def save(self, matrix: np.ndarray, documents: List[Document]):
+        """
+        Atomically write the matrix and documents, then re-open them memory-mapped
+        """
+        os.makedirs(self.directory, exist_ok=True)
+
+        matrix_tmp = self.matrix_path + ".tmp"
+        with open(matrix_tmp, "wb") as f:
+            np.save(f, normalize_rows(matrix))
+
+        documents_tmp = self.documents_path + ".tmp"
+        with open(documents_tmp, "w", encoding="utf-8") as f:
+            json.dump(
+                [{"id": d.id, "page_content": d.page_content, "metadata": d.metadata} for d in documents],
+                f
+            )
+
+        os.replace(matrix_tmp, self.matrix_path)
+        os.replace(documents_tmp, self.documents_path)
+        self.load()
+
+    def sync(self, documents: List[Document], embeddings: Embeddings) -> dict:
+        """
+        Rebuild the matrix for documents, re-using stored vectors for rows whose
+        content_hash is unchanged so only new or changed rows are embedded
+        """
+        existing_rows = {}
+        for row, document in enumerate(self.documents):
+            existing_rows[document.id] = (row, document.metadata.get("content_hash"))
+
+        reused = {}
+        to_embed = []
+        added = updated = 0
+        for document in documents:
+            previous = existing_rows.get(document.id)
+            if previous is None:
+                added += 1
+                to_embed.append(document)
+            elif previous[1] != document.metadata.get("content_hash"):
+                updated += 1
+                to_embed.append(document)
+            else:
+                reused[document.id] = previous[0]
+
+        wanted_ids = {document.id for document in documents}
+        removed = sum(1 for doc_id in existing_rows if doc_id not in wanted_ids)
+
+        stats = {
+            "added": added,
+            "updated": updated,
+            "removed": removed,
+            "unchanged": len(reused),
+        }
+        if not to_embed and not removed and len(reused) == len(self.documents):
+            return stats
+
+        new_vectors = {}
+        if to_embed:
+            vectors = embeddings.embed_documents([document.page_content for document in to_embed])
+            new_vectors = {document.id: vector for document, vector in zip(to_embed, vectors)}
+
+        rows = []
+        for document in documents:
+            if document.id in reused:
+                rows.append(np.asarray(self.matrix[reused[document.id]], dtype=np.float32))
+            else:
+                rows.append(np.asarray(new_vectors[document.id], dtype=np.float32))
+
+        matrix = np.vstack(rows) if rows else np.zeros((0, 0), dtype=np.float32)
+        self.save(matrix, documents)
+        return stats
+
+    def search(self, query_vector, k: int = 3) -> List[tuple]:
+        """
+        Exact cosine top-k: returns [(document, score), ...] best first
+        """
+        if not self.documents:
+            return []
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+
+        scores = self.matrix @ query
+        k = min(k, len(self.documents))
+        if k < len(self.documents):
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(self.documents))
+        top = top[np.argsort(-scores[top])]
+        return [(self.documents[i], float(scores[i])) for i in top]
+
+
+class NumpyRetriever(BaseRetriever):
+    """
+    LangChain retriever over a NumpyVectorIndex (drop-in for the Chroma retriever)
+    """
+    index: NumpyVectorIndex
+    embeddings: Embeddings
+    k: int = 3
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: Optional[CallbackManagerForRetrieverRun] = None
+    ) -> List[Document]:
+        query_vector = self.embeddings.embed_query(query)
+        return [document for document, _ in self.index.search(query_vector, self.k)]
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: Optional[AsyncCallbackManagerForRetrieverRun] = None
+    ) -> List[Document]:
+        query_vector = await self.embeddings.aembed_query(query)
+        return [document for document, _ in self.index.search(query_vector, self.k)]
@@ -0,0 +1,357 @@
+"""
+Pool of Ollama endpoints behind a single LangChain LLM
+
+Every generation goes to the healthy endpoint with the fewest outstanding
+requests. Endpoints that fail (connection errors, timeouts, 5xx responses)
+are skipped and the request fails over to the next one; after
+OLLAMA_FAILURE_THRESHOLD consecutive failures an endpoint's circuit opens
+for OLLAMA_CIRCUIT_COOLDOWN_SECONDS, after which one trial request is let
+through. Client errors (4xx, e.g. a model that is not pulled) are raised to
+the caller and do not count against the endpoint. A background thread polls
+/api/tags on every endpoint so dead boxes are taken out of rotation (and
+brought back) without waiting for user traffic; only a successful trial
+request closes an open circuit.
+
+Configure with a comma-separated OLLAMA_BASE_URLS.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional, Tuple
+
+import httpx
+from fastapi import HTTPException, status
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+from langchain_ollama import OllamaLLM
+from ollama import ResponseError
+from pydantic import PrivateAttr
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+OLLAMA_BASE_URLS = [url.strip() for url in os.getenv("OLLAMA_BASE_URLS", "").split(",") if url.strip()]
+OLLAMA_FAILURE_THRESHOLD = int(os.getenv("OLLAMA_FAILURE_THRESHOLD", "3"))
+OLLAMA_CIRCUIT_COOLDOWN_SECONDS = float(os.getenv("OLLAMA_CIRCUIT_COOLDOWN_SECONDS", "30"))
+OLLAMA_HEALTH_CHECK_INTERVAL_SECONDS = float(os.getenv("OLLAMA_HEALTH_CHECK_INTERVAL_SECONDS", "10"))
+OLLAMA_RETRY_AFTER_SECONDS = int(os.getenv("OLLAMA_RETRY_AFTER_SECONDS", "10"))
+
+# Errors that mean "this endpoint is unusable right now" (not "the request is bad")
+FAILOVER_ERRORS = (httpx.TransportError, ConnectionError, TimeoutError, ResponseError)
+
+
+def _is_endpoint_failure(error: Exception) -> bool:
+    """Ollama reports bad requests as ResponseError too; only 5xx is the endpoint's fault"""
+    if isinstance(error, ResponseError):
+        return error.status_code >= 500
+    return True
+
+
+class OllamaEndpoint:
+    """
+    One Ollama base URL with its client, load and circuit breaker state
+    """
+    def __init__(self, base_url: str, llm: OllamaLLM, failure_threshold: int = OLLAMA_FAILURE_THRESHOLD):
+        self.base_url = base_url.rstrip("/")
+        self.llm = llm
+        self.failure_threshold = failure_threshold
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.healthy = True
+        self.circuit_open_until = 0.0
+        self.trial_in_flight = False
+
+    def circuit_state(self, now: float) -> str:
+        if self.consecutive_failures < self.failure_threshold:
+            return "closed"
+        return "open" if now < self.circuit_open_until else "half_open"
+
+    def is_available(self, now: float) -> bool:
+        if not self.healthy:
+            return False
+        state = self.circuit_state(now)
+        # Half-open: let a single trial request through
+        return state == "closed" or (state == "half_open" and not self.trial_in_flight)
+
+    def stats(self) -> dict:
+        return {
+            "base_url": self.base_url,
+            "healthy": self.healthy,
+            "circuit": self.circuit_state(time.time()),
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+        }
+
+
+class OllamaPoolLLM(LLM):
+    """
+    LLM that load balances generation across several Ollama endpoints
+    (least outstanding requests, health checks, circuit breaking, failover)
+    """
+    base_urls: List[str]
+    model: str = "llama3.2"
+    keep_alive: Optional[str] = None
+    num_ctx: Optional[int] = None
+    num_predict: Optional[int] = None
+    failure_threshold: int = OLLAMA_FAILURE_THRESHOLD
+    cooldown_seconds: float = OLLAMA_CIRCUIT_COOLDOWN_SECONDS
+    health_check_timeout: float = 2.0
+
+    _endpoints: List[OllamaEndpoint] = PrivateAttr(default_factory=list)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _next: int = PrivateAttr(default=0)
+    _health_thread: Any = PrivateAttr(default=None)
+    _stop_health_checks: Any = PrivateAttr(default_factory=threading.Event)
+
+    def model_post_init(self, __context: Any) -> None:
+        self._endpoints = [
+            OllamaEndpoint(url, OllamaLLM(
+                model=self.model,
+                base_url=url,
+                keep_alive=self.keep_alive,
+                num_ctx=self.num_ctx,
+                num_predict=self.num_predict
+            ), self.failure_threshold)
+            for url in self.base_urls
+        ]
+
+    @property
+    def _llm_type(self) -> str:
+        return "ollama-pool"
+
+    @property
+    def endpoints(self) -> List[OllamaEndpoint]:
+        return self._endpoints
+
+    # Endpoint selection and bookkeeping
+
+    def _acquire(self, tried: set) -> Tuple[Optional[OllamaEndpoint], bool]:
+        """
+        Reserve the available endpoint with the fewest outstanding requests
+        (ties are rotated so idle endpoints share the load); returns the
+        endpoint and whether this request is its half-open trial
+        """
+        now = time.time()
+        with self._lock:
+            count = len(self._endpoints)
+            candidates = [
+                self._endpoints[(self._next + i) % count] for i in range(count)
+            ]
+            candidates = [e for e in candidates if e.base_url not in tried and e.is_available(now)]
+            if not candidates:
+                return None, False
+            endpoint = min(candidates, key=lambda e: e.outstanding)
+            self._next = (self._endpoints.index(endpoint) + 1) % count
+            trial = endpoint.circuit_state(now) == "half_open"
+            if trial:
+                endpoint.trial_in_flight = True
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint, trial
+
+    def _release(self, endpoint: OllamaEndpoint, trial: bool, error: Optional[Exception] = None):
+        with self._lock:
+            endpoint.outstanding -= 1
+            if error is not None:
+                endpoint.failures += 1
+            if trial:
+                endpoint.trial_in_flight = False
+            elif endpoint.circuit_state(time.time()) != "closed":
+                # Sent before the circuit opened: only the trial may close or reopen it
+                return
+            if error is None:
+                endpoint.consecutive_failures = 0
+                return
+            endpoint.consecutive_failures += 1
+            if endpoint.consecutive_failures >= self.failure_threshold:
+                endpoint.circuit_open_until = time.time() + self.cooldown_seconds
+                logger.warning("Ollama endpoint %s circuit open: %s", endpoint.base_url, error)
+
+    def _unavailable(self, error: Optional[Exception]) -> HTTPException:
+        detail = "No LLM endpoint is available right now. Please try again shortly."
+        if error is not None:
+            detail = f"{detail} Last error: {error}"
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=detail,
+            headers={"Retry-After": str(OLLAMA_RETRY_AFTER_SECONDS)}
+        )
+
+    def _attempts(self):
+        """(endpoint, is trial) to try for one request, best first, each endpoint at most once"""
+        tried = set()
+        while True:
+            endpoint, trial = self._acquire(tried)
+            if endpoint is None:
+                return
+            tried.add(endpoint.base_url)
+            yield endpoint, trial
+
+    # LLM interface
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        last_error = None
+        for endpoint, trial in self._attempts():
+            try:
+                response = endpoint.llm.invoke(prompt, stop=stop, **kwargs)
+            except FAILOVER_ERRORS as e:
+                if not _is_endpoint_failure(e):
+                    self._release(endpoint, trial)
+                    raise
+                self._release(endpoint, trial, e)
+                last_error = e
+                continue
+            except BaseException:
+                self._release(endpoint, trial)
+                raise
+            self._release(endpoint, trial)
+            return response
+        raise self._unavailable(last_error)
+
+    async def _acall(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        last_error = None
+        for endpoint, trial in self._attempts():
+            try:
+                response = await endpoint.llm.ainvoke(prompt, stop=stop, **kwargs)
+            except FAILOVER_ERRORS as e:
+                if not _is_endpoint_failure(e):
+                    self._release(endpoint, trial)
+                    raise
+                self._release(endpoint, trial, e)
+                last_error = e
+                continue
+            except BaseException:
+                self._release(endpoint, trial)
+                raise
+            self._release(endpoint, trial)
+            return response
+        raise self._unavailable(last_error)
+
+    def _stream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[GenerationChunk]:
+        last_error = None
+        for endpoint, trial in self._attempts():
+            started = False
+            try:
+                for text in endpoint.llm.stream(prompt, stop=stop, **kwargs):
+                    started = True
+                    if run_manager:
+                        run_manager.on_llm_new_token(text)
+                    yield GenerationChunk(text=text)
+            except FAILOVER_ERRORS as e:
+                if not _is_endpoint_failure(e):
+                    self._release(endpoint, trial)
+                    raise
+                self._release(endpoint, trial, e)
+                # Tokens already sent cannot be taken back; only fail over before the first one
+                if started:
+                    raise
+                last_error = e
+                continue
+            except BaseException:
+                self._release(endpoint, trial)
+                raise
+            self._release(endpoint, trial)
+            return
+        raise self._unavailable(last_error)
+
+    async def _astream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[GenerationChunk]:
+        last_error = None
+        for endpoint, trial in self._attempts():
+            started = False
+            try:
+                async for text in endpoint.llm.astream(prompt, stop=stop, **kwargs):
+                    started = True
+                    if run_manager:
+                        await run_manager.on_llm_new_token(text)
+                    yield GenerationChunk(text=text)
+            except FAILOVER_ERRORS as e:
+                if not _is_endpoint_failure(e):
+                    self._release(endpoint, trial)
+                    raise
+                self._release(endpoint, trial, e)
+                if started:
+                    raise
+                last_error = e
+                continue
+            except BaseException:
+                self._release(endpoint, trial)
+                raise
+            self._release(endpoint, trial)
+            return
+        raise self._unavailable(last_error)
+
+    # Health checks
+
+    def check_health(self):
+        """
+        Poll /api/tags on every endpoint; reachable endpoints are (re)marked
+        healthy. An open circuit is left alone: it closes only after its
+        cooldown, when a trial request succeeds
+        """
+        for endpoint in self._endpoints:
+            try:
+                httpx.get(f"{endpoint.base_url}/api/tags", timeout=self.health_check_timeout).raise_for_status()
+                healthy = True
+            except httpx.HTTPError as e:
+                healthy = False
+                if endpoint.healthy:
+                    logger.warning("Ollama endpoint %s failed health check: %s", endpoint.base_url, e)
+
+            with self._lock:
+                if healthy and not endpoint.healthy:
+                    logger.info("Ollama endpoint %s is healthy again", endpoint.base_url)
+                endpoint.healthy = healthy
+
+    def start_health_checks(self, interval: float = OLLAMA_HEALTH_CHECK_INTERVAL_SECONDS):
+        """
+        Run check_health every interval seconds in a daemon thread (no-op if already running)
+        """
+        if self._health_thread is not None and self._health_thread.is_alive():
+            return
+        self._stop_health_checks.clear()
+
+        def run():
+            while not self._stop_health_checks.is_set():
+                self.check_health()
+                self._stop_health_checks.wait(interval)
+
+        self._health_thread = threading.Thread(target=run, name="ollama-health-checks", daemon=True)
+        self._health_thread.start()
+
+    def stop_health_checks(self):
+        self._stop_health_checks.set()
+
+    def stats(self) -> List[dict]:
+        with self._lock:
+            return [endpoint.stats() for endpoint in self._endpoints]
@@ -0,0 +1,210 @@
+"""
+Token budget for LLM prompts
+
+Prefill time grows with prompt length, and the chat prompts used to include
+every retrieved document (as a Document repr, metadata and all) plus full
+Markdown bot responses from previous turns. The packer below gives the
+instructions and the current question what they need, caps conversation
+memory (past bot responses are condensed to a short plain-text summary) and
+fills the rest of the budget with catalog documents. The token count of the
+packed prompt is recorded per request in a context variable.
+
+Tokens are counted with tiktoken (in requirements.txt). tiktoken downloads
+its encoding file on first use, so warm_tokenizer() loads it at startup rather
+than on a request; set TIKTOKEN_CACHE_DIR to a directory holding the file for
+offline hosts. If tiktoken is missing or the file cannot be loaded, a ~4
+characters per token estimate is used instead (close enough for Llama-family
+tokenizers) and a warning is logged.
+"""
+import logging
+import os
+import re
+import threading
+from contextvars import ContextVar
+from typing import Callable, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+PROMPT_MAX_TOKENS = int(os.getenv("PROMPT_MAX_TOKENS", "3072"))
+PROMPT_MEMORY_MAX_TOKENS = int(os.getenv("PROMPT_MEMORY_MAX_TOKENS", "768"))
+PROMPT_PAST_RESPONSE_MAX_TOKENS = int(os.getenv("PROMPT_PAST_RESPONSE_MAX_TOKENS", "120"))
+# A document is only cut down to fit if at least this many tokens of it remain
+MIN_DOCUMENT_TOKENS = 64
+CHARS_PER_TOKEN = 4
+
+_prompt_stats: ContextVar[Optional[dict]] = ContextVar("prompt_stats", default=None)
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    """tiktoken encoding if available (loaded once), else None"""
+    global _encoding, _encoding_loaded
+
+    if not _encoding_loaded:
+        # Callers racing the first load wait for it instead of falling back to the estimate
+        with _encoding_lock:
+            if not _encoding_loaded:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding("cl100k_base")
+                except Exception:
+                    # Not installed, or the encoding file cannot be fetched
+                    _encoding = None
+                    logger.warning("tiktoken unavailable, estimating prompt tokens as %d characters each", CHARS_PER_TOKEN)
+                _encoding_loaded = True
+    return _encoding
+
+
+def warm_tokenizer() -> bool:
+    """Load the tokenizer (fetching its encoding file if needed); False if falling back to the estimate"""
+    return _get_encoding() is not None
+
+
+def count_tokens(text: str) -> int:
+    """Number of tokens in text"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return max(1, -(-len(text) // CHARS_PER_TOKEN))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Cut text down to at most max_tokens (ending with an ellipsis if cut)"""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    encoding = _get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        return encoding.decode(tokens[:max_tokens - 1]).rstrip() + "…"
+
+    cut = text[:(max_tokens - 1) * CHARS_PER_TOKEN]
+    if " " in cut:
+        cut = cut.rsplit(" ", 1)[0]
+    return cut.rstrip() + "…"
+
+
+def summarize_response(text: str, max_tokens: int = PROMPT_PAST_RESPONSE_MAX_TOKENS) -> str:
+    """
+    Condense a past Markdown bot response to plain text: tables are dropped,
+    formatting is stripped and whole leading sentences are kept up to max_tokens
+    """
+    lines = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("|"):
+            continue
+        line = re.sub(r"^(#+|>|[-*+]|\d+\.)\s*", "", line)
+        line = re.sub(r"(\*\*|__|\*|`)", "", line)
+        lines.append(line)
+    plain = re.sub(r"\s+", " ", " ".join(lines)).strip()
+
+    if count_tokens(plain) <= max_tokens:
+        return plain
+
+    summary = ""
+    for sentence in re.split(r"(?<=[.!?])\s+", plain):
+        candidate = f"{summary} {sentence}".strip()
+        if count_tokens(candidate) > max_tokens:
+            break
+        summary = candidate
+    return summary or truncate_tokens(plain, max_tokens)
+
+
+def pack_documents(documents, max_tokens: int):
+    """
+    Render retrieved documents as plain text, best first, until the budget runs out;
+    returns (text, tokens)
+    """
+    parts = []
+    used = 0
+    for document in documents:
+        content = getattr(document, "page_content", str(document))
+        tokens = count_tokens(content)
+        if used + tokens > max_tokens:
+            remaining = max_tokens - used
+            if remaining >= MIN_DOCUMENT_TOKENS:
+                content = truncate_tokens(content, remaining)
+                parts.append(content)
+                used += count_tokens(content)
+            break
+        parts.append(content)
+        used += tokens
+    return "\n\n".join(parts), used
+
+
+def pack_history(entries: List[dict], max_tokens: int, render_entry: Callable[[dict, str], str],
+                 response_max_tokens: int = PROMPT_PAST_RESPONSE_MAX_TOKENS):
+    """
+    Render conversation memory entries (oldest first) with condensed bot responses,
+    keeping the most recent ones that fit; returns (text, tokens)
+    """
+    kept = []
+    used = 0
+    for entry in reversed(entries):
+        rendered = render_entry(entry, summarize_response(entry.get("response") or "", response_max_tokens))
+        tokens = count_tokens(rendered)
+        if used + tokens > max_tokens:
+            break
+        kept.append(rendered)
+        used += tokens
+    return "\n\n".join(reversed(kept)), used
+
+
+def pack_prompt(
+    instructions: str,
+    fixed_text: str,
+    documents,
+    history_entries: List[dict],
+    render_entry: Callable[[dict, str], str],
+    max_tokens: int = PROMPT_MAX_TOKENS,
+    memory_max_tokens: int = PROMPT_MEMORY_MAX_TOKENS,
+    instruction_tokens: Optional[int] = None
+):
+    """
+    Split the prompt budget: instructions and fixed inputs (question, customer
+    name, selected cars) are always included, memory gets up to a third of the
+    rest (capped at memory_max_tokens) and catalog documents get what is left.
+    Returns (data text, history text, stats) and records stats for the request.
+    instruction_tokens can be passed in when the template's size is precomputed.
+    """
+    if instruction_tokens is None:
+        instruction_tokens = count_tokens(instructions)
+    fixed_tokens = count_tokens(fixed_text)
+    available = max(0, max_tokens - instruction_tokens - fixed_tokens)
+
+    memory_budget = min(memory_max_tokens, available // 3)
+    history, memory_tokens = pack_history(history_entries or [], memory_budget, render_entry)
+    data, data_tokens = pack_documents(documents or [], available - memory_tokens)
+
+    stats = {
+        "prompt_tokens": instruction_tokens + fixed_tokens + memory_tokens + data_tokens,
+        "instruction_tokens": instruction_tokens,
+        "input_tokens": fixed_tokens,
+        "memory_tokens": memory_tokens,
+        "data_tokens": data_tokens,
+    }
+    _prompt_stats.set(stats)
+    return data, history, stats
+
+
+def get_prompt_stats() -> Optional[dict]:
+    """Token breakdown of the last prompt packed in the current request, if any"""
+    return _prompt_stats.get()
+
+
+def get_prompt_tokens() -> Optional[int]:
+    """Token count of the last prompt packed in the current request, if any"""
+    stats = _prompt_stats.get()
+    return stats["prompt_tokens"] if stats else None
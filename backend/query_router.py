@@ -0,0 +1,417 @@
+"""
+Structured query router for spec and price lookups
+
+Questions like "horsepower of 2023 M3 Competition" or "SUVs under $60,000"
+have exact answers in the Car table. This module parses model, trim, year,
+body/engine type and numeric constraints out of the message, runs an indexed
+SQL query and renders a Markdown answer, so the common lookup questions skip
+vector retrieval and LLM generation entirely. Only messages that are nothing
+but a lookup take this path: anything that needs judgement (comparisons,
+recommendations, "why"...) or has words the parser does not account for
+("...and how does it handle in snow?") is left to the LLM.
+"""
+import os
+import re
+from typing import List, Optional, Tuple
+
+from pydantic import BaseModel
+from dotenv import load_dotenv
+
+import vector
+from car_controllers import query_cars_controller, get_model_trims_controller
+
+load_dotenv()
+
+QUERY_ROUTER_ENABLED = os.getenv("QUERY_ROUTER_ENABLED", "true").lower() in ("1", "true", "yes")
+MAX_ROWS = 10
+
+# column -> (trigger phrases, table header, value format)
+SPEC_FIELDS = {
+    "horsepower_hp": (("horsepower", "hp", "bhp", "power"), "Horsepower", "{} hp"),
+    "torque_nm": (("torque",), "Torque", "{} Nm"),
+    "base_msrp_usd": (("price", "cost", "msrp", "how much"), "Base MSRP", "${:,}"),
+    "acceleration_0_100_s": (("acceleration", "0-100", "0 to 100", "0-60", "0 to 60"), "0-100 km/h", "{} s"),
+    "top_speed_kmh": (("top speed", "max speed", "maximum speed"), "Top Speed", "{} km/h"),
+    "electric_range_km": (("electric range", "range"), "Electric Range", "{} km"),
+    "fuel_consumption_combined": (("fuel consumption", "fuel economy", "mpg", "consumption"), "Fuel Consumption", "{} L/100 km"),
+    "curb_weight_kg": (("curb weight", "weight", "heavy"), "Curb Weight", "{} kg"),
+    "body_type": (("body type", "body style"), "Body", "{}"),
+    "engine_type": (("engine",), "Engine", "{}"),
+    "displacement_cc": (("displacement",), "Displacement", "{} cc"),
+    "cylinders": (("cylinders",), "Cylinders", "{}"),
+    "transmission": (("transmission", "gearbox"), "Transmission", "{}"),
+    "drivetrain": (("drivetrain", "awd", "rwd", "fwd", "all-wheel", "rear-wheel"), "Drivetrain", "{}"),
+    "co2_emissions": (("co2", "emissions"), "CO2 Emissions", "{} g/km"),
+}
+
+BODY_TYPE_TERMS = {
+    "suv": ["SUV", "Coupe SUV"],
+    "suvs": ["SUV", "Coupe SUV"],
+    "sedan": ["Sedan"],
+    "sedans": ["Sedan"],
+    "coupe": ["Coupe"],
+    "coupes": ["Coupe"],
+    "convertible": ["Roadster"],
+    "convertibles": ["Roadster"],
+    "roadster": ["Roadster"],
+    "roadsters": ["Roadster"],
+    "wagon": ["Wagon"],
+    "wagons": ["Wagon"],
+    "touring": ["Wagon"],
+    "hatchback": ["Hatchback"],
+    "hatchbacks": ["Hatchback"],
+}
+
+ENGINE_TYPE_TERMS = {
+    "electric": ["Electric"],
+    "ev": ["Electric"],
+    "evs": ["Electric"],
+    "diesel": ["Diesel"],
+    "hybrid": ["Plug-in Hybrid", "Petrol Hybrid"],
+    "hybrids": ["Plug-in Hybrid", "Petrol Hybrid"],
+    "petrol": ["Petrol"],
+    "gasoline": ["Petrol"],
+}
+
+# Questions that need judgement rather than a lookup go to the LLM
+LLM_ONLY_TERMS = (
+    "compare", "comparison", "vs", "versus", "difference", "recommend", "suggest",
+    "should", "best", "better", "why", "opinion", "review", "reliable", "worth", "family",
+)
+LIST_TERMS = ("cars", "models", "bmws", "options", "which", "list", "show", "any", "what are", "cheapest", "most powerful")
+# Plural body/engine types ask for a list on their own ("SUVs under $60,000")
+LIST_TYPE_TERMS = tuple(term for term in (*BODY_TYPE_TERMS, *ENGINE_TYPE_TERMS) if term.endswith("s"))
+ORDER_TERMS = ("cheapest", "most powerful", "most expensive")
+# Words that may surround a lookup; any other word left over after parsing sends the message to the LLM
+FILLER_WORDS = {
+    "what", "what's", "whats", "is", "are", "was", "the", "a", "an", "of", "for", "on", "in", "with", "and",
+    "i", "i'm", "im", "me", "my", "please", "tell", "give", "get", "how", "much", "many", "does", "do", "it",
+    "its", "it's", "this", "that", "these", "those", "there", "their", "they", "to", "at", "about", "all",
+    "bmw", "bmw's", "model", "car", "year", "trim", "version", "spec", "specs", "specification",
+    "specifications", "time", "has", "have", "can", "you", "looking", "find", "available", "official",
+    "exact", "current", "new", "'s", "’s", "s", "km", "kmh", "km/h", "mph", "l", "hp", "nm", "kg", "cc",
+}
+
+UPPER_BOUND = r"(?:under|below|less than|cheaper than|up to|no more than|at most|max(?:imum)?|within)"
+LOWER_BOUND = r"(?:over|above|more than|at least|greater than|starting at|min(?:imum)?)"
+AMOUNT = r"(\$)?\s*(\d[\d,]*(?:\.\d+)?)\s*(k|thousand)?\s*(hp|horsepower|bhp|usd|dollars)?"
+
+
+class CarQuery(BaseModel):
+    """Constraints parsed from a chat message"""
+    pairs: List[Tuple[str, str]] = []  # matching (model_name, trim_variant) pairs
+    min_year: Optional[int] = None
+    max_year: Optional[int] = None
+    min_price: Optional[int] = None
+    max_price: Optional[int] = None
+    min_horsepower: Optional[int] = None
+    max_horsepower: Optional[int] = None
+    body_types: List[str] = []
+    engine_types: List[str] = []
+    spec_fields: List[str] = []
+    order_by: Optional[str] = None
+    descending: bool = False
+    is_list_query: bool = False
+    unparsed_words: List[str] = []  # words that are not part of the lookup
+    needs_llm: bool = False
+
+    def has_constraints(self) -> bool:
+        return any(value is not None for value in (
+            self.min_year, self.max_year, self.min_price, self.max_price,
+            self.min_horsepower, self.max_horsepower
+        )) or bool(self.body_types or self.engine_types)
+
+
+def _phrase_pattern(phrase: str) -> str:
+    # Whole tokens only: "m" must not match inside "I'm", but "M5's" still names the M5
+    return r"(?<![\w'’-])" + re.escape(phrase) + r"(?![\w-])(?!['’](?!s\b))"
+
+
+def _contains(text: str, phrase: str) -> bool:
+    return re.search(_phrase_pattern(phrase), text) is not None
+
+
+def _blank(text: str, pattern: str) -> str:
+    """Replace matches with spaces (keeping offsets), once they have been parsed"""
+    return re.sub(pattern, lambda match: " " * len(match.group(0)), text)
+
+
+def _parse_amount(dollar, number, thousands, unit):
+    """Return (kind, value) for a matched AMOUNT, kind in {"price", "horsepower", None}"""
+    value = float(number.replace(",", ""))
+    if thousands:
+        value *= 1000
+    if unit in ("hp", "horsepower", "bhp"):
+        return "horsepower", int(value)
+    if dollar or thousands or unit in ("usd", "dollars") or value >= 1000:
+        return "price", int(value)
+    return None, int(value)
+
+
+def _match_catalog(text: str, catalog_pairs: List[Tuple[str, str]]):
+    """
+    Greedily match model names and trims (longest first, non-overlapping);
+    returns (matched models, matched trims, text with matches blanked out)
+    """
+    candidates = [(model, "model") for model in {m for m, _ in catalog_pairs}]
+    candidates += [(trim, "trim") for trim in {t for _, t in catalog_pairs} if trim and trim.lower() != "base"]
+    candidates.sort(key=lambda c: len(c[0]), reverse=True)
+
+    models, trims = set(), set()
+    taken = []
+    for name, kind in candidates:
+        for match in re.finditer(_phrase_pattern(name.lower()), text):
+            span = match.span()
+            overlapping = [t for t in taken if t[0] < span[1] and span[0] < t[1]]
+            # The same span may name both a model and a trim (e.g. "M3")
+            if overlapping and span not in overlapping:
+                continue
+            (models if kind == "model" else trims).add(name)
+            if span not in taken:
+                taken.append(span)
+
+    for start, end in taken:
+        text = text[:start] + " " * (end - start) + text[end:]
+    return models, trims, text
+
+
+def parse_car_query(message: str, catalog_pairs: List[Tuple[str, str]]) -> CarQuery:
+    """
+    Parse a chat message into structured car constraints
+    """
+    text = message.lower()
+    query = CarQuery()
+
+    query.needs_llm = any(_contains(text, term) for term in LLM_ONLY_TERMS)
+    query.is_list_query = any(_contains(text, term) for term in LIST_TERMS + LIST_TYPE_TERMS)
+
+    models, trims, text = _match_catalog(text, catalog_pairs)
+    if models or trims:
+        pairs = [
+            (model, trim) for model, trim in catalog_pairs
+            if (not models or model in models) and (not trims or trim in trims)
+        ]
+        if not pairs:
+            pairs = [(model, trim) for model, trim in catalog_pairs if model in models or trim in trims]
+        query.pairs = sorted(set(pairs))
+
+    # Year ranges first, then any remaining explicit year
+    for match in re.finditer(r"\b(after|newer than|since|from|before|older than|prior to)\s+(20[0-3]\d)\b", text):
+        word, year = match.group(1), int(match.group(2))
+        if word in ("after", "newer than"):
+            query.min_year = year + 1
+        elif word in ("since", "from"):
+            query.min_year = year
+        else:
+            query.max_year = year - 1
+        text = text[:match.start()] + " " * (match.end() - match.start()) + text[match.end():]
+    if query.min_year is None and query.max_year is None:
+        years = re.findall(r"\b(20[0-3]\d)\b", text)
+        if len(years) == 1:
+            query.min_year = query.max_year = int(years[0])
+            text = re.sub(r"\b20[0-3]\d\b", " ", text)
+
+    # Numeric constraints
+    between = re.search(r"\bbetween\s+" + AMOUNT + r"\s+and\s+" + AMOUNT, text)
+    if between:
+        low_kind, low = _parse_amount(*between.groups()[:4])
+        high_kind, high = _parse_amount(*between.groups()[4:])
+        kind = low_kind or high_kind
+        if kind == "price":
+            query.min_price, query.max_price = low * (1000 if high_kind == "price" and low < 1000 else 1), high
+        elif kind == "horsepower":
+            query.min_horsepower, query.max_horsepower = low, high
+        else:
+            # A range of something we cannot filter on (km, seconds...); left unparsed
+            query.needs_llm = True
+        if kind:
+            text = _blank(text, re.escape(between.group(0)))
+    for bound, pattern in (("max", UPPER_BOUND), ("min", LOWER_BOUND)):
+        for match in re.finditer(r"\b" + pattern + r"\s+" + AMOUNT, text):
+            kind, value = _parse_amount(*match.groups())
+            if kind == "price":
+                setattr(query, f"{bound}_price", value)
+            elif kind == "horsepower":
+                setattr(query, f"{bound}_horsepower", value)
+            else:
+                query.needs_llm = True
+                continue
+            text = text[:match.start()] + " " * (match.end() - match.start()) + text[match.end():]
+
+    for term, values in BODY_TYPE_TERMS.items():
+        if _contains(text, term):
+            query.body_types = sorted(set(query.body_types) | set(values))
+            text = _blank(text, _phrase_pattern(term))
+    for term, values in ENGINE_TYPE_TERMS.items():
+        if _contains(text, term) and not _contains(text, f"{term} range"):
+            query.engine_types = sorted(set(query.engine_types) | set(values))
+            text = _blank(text, _phrase_pattern(term))
+
+    for column, (phrases, _, _) in SPEC_FIELDS.items():
+        if any(_contains(text, phrase) for phrase in phrases):
+            query.spec_fields.append(column)
+    # Blank longest phrases first ("electric range" before "range")
+    for phrase in sorted({p for phrases, _, _ in SPEC_FIELDS.values() for p in phrases} | set(LIST_TERMS) | set(ORDER_TERMS), key=len, reverse=True):
+        text = _blank(text, _phrase_pattern(phrase))
+
+    # Whatever is left must be filler, or the message is more than a lookup
+    query.unparsed_words = [word for word in re.findall(r"[a-z0-9/'’$]+", text) if word not in FILLER_WORDS]
+    if query.unparsed_words:
+        query.needs_llm = True
+
+    # Ordering
+    if _contains(text, "cheapest") or query.max_price:
+        query.order_by = "base_msrp_usd"
+    elif _contains(text, "most powerful") or query.min_horsepower:
+        query.order_by, query.descending = "horsepower_hp", True
+    elif _contains(text, "most expensive"):
+        query.order_by, query.descending = "base_msrp_usd", True
+
+    return query
+
+
+def _format_value(column: str, value) -> str:
+    if value is None or value == "":
+        return "—"
+    fmt = SPEC_FIELDS[column][2] if column in SPEC_FIELDS else "{}"
+    if column == "base_msrp_usd":
+        return fmt.format(int(value))
+    return fmt.format(value)
+
+
+def _markdown_table(cars, columns: List[str]) -> str:
+    headers = ["Model", "Year", "Trim"] + [SPEC_FIELDS[c][1] if c in SPEC_FIELDS else c for c in columns]
+    lines = [
+        "| " + " | ".join(headers) + " |",
+        "|" + "|".join(["---"] * len(headers)) + "|",
+    ]
+    for car in cars:
+        cells = [f"**{car.model_name}**", str(car.model_year), car.trim_variant]
+        cells += [_format_value(c, getattr(car, c)) for c in columns]
+        lines.append("| " + " | ".join(cells) + " |")
+    return "\n".join(lines)
+
+
+def _describe_constraints(query: CarQuery) -> str:
+    kinds = " ".join("/".join(types) for types in (query.engine_types, query.body_types) if types)
+    parts = [f"**{kinds}** BMW models" if kinds else "BMW models"]
+    if query.min_price and query.max_price:
+        parts.append(f"priced between **${query.min_price:,}** and **${query.max_price:,}**")
+    elif query.max_price:
+        parts.append(f"priced under **${query.max_price:,}**")
+    elif query.min_price:
+        parts.append(f"priced over **${query.min_price:,}**")
+    if query.min_horsepower:
+        parts.append(f"with at least **{query.min_horsepower} hp**")
+    if query.max_horsepower:
+        parts.append(f"with at most **{query.max_horsepower} hp**")
+    if query.min_year and query.min_year == query.max_year:
+        parts.append(f"from **{query.min_year}**")
+    else:
+        if query.min_year:
+            parts.append(f"from **{query.min_year}** onwards")
+        if query.max_year:
+            parts.append(f"up to **{query.max_year}**")
+    return " ".join(parts)
+
+
+def answer_car_query(query: CarQuery) -> Optional[str]:
+    """
+    Run the SQL for a parsed query and render a Markdown answer,
+    or return None if the question should go to the LLM
+    """
+    if query.needs_llm:
+        return None
+
+    if query.pairs and query.spec_fields:
+        # Spec lookup for named models/trims
+        pair_set = set(query.pairs)
+        cars = query_cars_controller(
+            model_names=sorted({model for model, _ in query.pairs}),
+            trim_variants=sorted({trim for _, trim in query.pairs}),
+            min_year=query.min_year,
+            max_year=query.max_year,
+            body_types=query.body_types or None,
+            engine_types=query.engine_types or None,
+            order_by="model_year",
+            descending=True,
+            limit=100
+        )
+        cars = [car for car in cars if (car.model_name, car.trim_variant) in pair_set][:MAX_ROWS]
+        if not cars:
+            return None
+        names = sorted({f"{car.model_name} {car.trim_variant}" for car in cars})
+        if len(names) > 3:
+            names = sorted({car.model_name for car in cars})
+        subject = ", ".join(names)
+        fields = ", ".join(SPEC_FIELDS[c][1].lower() for c in query.spec_fields)
+        return (
+            f"Here's the **{fields}** for the **{subject}** straight from our catalog:\n\n"
+            f"{_markdown_table(cars, query.spec_fields)}\n\n"
+            f"> Would you like a detailed walkthrough of any of these, or to schedule a test drive?"
+        )
+
+    if query.is_list_query and query.has_constraints() and not query.pairs:
+        # Catalog search by numeric/body/engine constraints
+        cars = query_cars_controller(
+            min_year=query.min_year,
+            max_year=query.max_year,
+            min_price=query.min_price,
+            max_price=query.max_price,
+            min_horsepower=query.min_horsepower,
+            max_horsepower=query.max_horsepower,
+            body_types=query.body_types or None,
+            engine_types=query.engine_types or None,
+            order_by=query.order_by or "base_msrp_usd",
+            descending=query.descending,
+            limit=MAX_ROWS + 1
+        )
+        description = _describe_constraints(query)
+        if not cars:
+            return (
+                f"I couldn't find any {description} in our catalog.\n\n"
+                f"> Try widening the range, or tell me what matters most to you and I'll suggest alternatives."
+            )
+        more = len(cars) > MAX_ROWS
+        cars = cars[:MAX_ROWS]
+        columns = ["body_type", "engine_type", "horsepower_hp", "base_msrp_usd"]
+        columns += [c for c in query.spec_fields if c not in columns]
+        header = f"Here are the {description}" + (f" (showing the first {MAX_ROWS})" if more else "") + ":"
+        return (
+            f"{header}\n\n{_markdown_table(cars, columns)}\n\n"
+            f"> Want more detail on any of these models, or a side-by-side comparison?"
+        )
+
+    return None
+
+
+# (model_name, trim_variant) pairs in the Car table, reloaded after a reindex
+_catalog_pairs = None
+_catalog_index_version = None
+
+
+def reset_catalog_cache():
+    """
+    Forget the cached model/trim pairs so the next routed message reloads
+    them (call after changing the Car table)
+    """
+    global _catalog_pairs
+    _catalog_pairs = None
+
+
+def route_car_query(message: str) -> Optional[str]:
+    """
+    Answer a chat message straight from the Car table if it is a structured
+    lookup; returns None when the message should go through the LLM
+    """
+    global _catalog_pairs, _catalog_index_version
+
+    if not QUERY_ROUTER_ENABLED:
+        return None
+    if _catalog_pairs is None or _catalog_index_version != vector.index_version:
+        _catalog_index_version = vector.index_version
+        _catalog_pairs = get_model_trims_controller()
+    if not _catalog_pairs:
+        return None
+
+    return answer_car_query(parse_car_query(message, _catalog_pairs))
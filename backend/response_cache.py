@@ -0,0 +1,146 @@
+"""
+Semantic response cache for anonymous chat traffic
+
+Guests with no selected cars ask the same handful of questions all day. A
+cached answer is reused when a new question's embedding is close enough to a
+previous one *and* retrieval returned the same catalog documents for the same
+selected cars, so answers never leak across different car contexts. Only
+questions asked without conversation context are cached or served from the
+cache, since a follow-up's answer depends on the session's history. Entries
+expire after a TTL and the whole cache is dropped when the car catalog is
+reindexed.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.95"))
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+
+
+def _unit(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SemanticResponseCache:
+    """
+    In-memory cache of LLM responses keyed on (retrieved document IDs, selected
+    car IDs) and matched within a key by query-embedding cosine similarity
+    """
+    def __init__(
+        self,
+        similarity_threshold: float = RESPONSE_CACHE_SIMILARITY,
+        ttl_seconds: int = RESPONSE_CACHE_TTL_SECONDS,
+        max_entries: int = RESPONSE_CACHE_MAX_ENTRIES
+    ):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # bucket key -> {entry id: (unit query vector, response, created_at)}
+        self._buckets = {}
+        # entry id -> bucket key, in insertion order (for max_entries eviction)
+        self._order = OrderedDict()
+        self._next_id = 0
+        self._index_version = None
+
+    @staticmethod
+    def make_key(document_ids: Iterable, car_ids: Iterable) -> tuple:
+        return tuple(str(i) for i in document_ids), tuple(sorted(str(i) for i in car_ids))
+
+    def _sync_index_version(self, index_version):
+        # Answers were generated from the old catalog; drop them on reindex
+        if index_version != self._index_version:
+            self._buckets.clear()
+            self._order.clear()
+            self._index_version = index_version
+
+    def _remove(self, entry_id):
+        key = self._order.pop(entry_id)
+        bucket = self._buckets[key]
+        del bucket[entry_id]
+        if not bucket:
+            del self._buckets[key]
+
+    def lookup(self, query_vector, document_ids: Iterable, car_ids: Iterable = (), index_version=None) -> Optional[str]:
+        """
+        Return a cached response for a semantically equivalent query, or None
+        """
+        key = self.make_key(document_ids, car_ids)
+        query = _unit(query_vector)
+        now = time.time()
+
+        with self._lock:
+            self._sync_index_version(index_version)
+
+            bucket = self._buckets.get(key, {})
+            for entry_id in [i for i, (_, _, created_at) in bucket.items() if now - created_at > self.ttl_seconds]:
+                self._remove(entry_id)
+            bucket = self._buckets.get(key)
+
+            if bucket:
+                entry_ids = list(bucket)
+                scores = np.stack([bucket[i][0] for i in entry_ids]) @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.similarity_threshold:
+                    self.hits += 1
+                    return bucket[entry_ids[best]][1]
+
+            self.misses += 1
+            return None
+
+    def store(self, query_vector, document_ids: Iterable, car_ids: Iterable, response: str, index_version=None):
+        """
+        Cache a generated response (oldest entries are evicted beyond max_entries)
+        """
+        key = self.make_key(document_ids, car_ids)
+        with self._lock:
+            self._sync_index_version(index_version)
+            entry_id = self._next_id
+            self._next_id += 1
+            self._buckets.setdefault(key, {})[entry_id] = (_unit(query_vector), response, time.time())
+            self._order[entry_id] = key
+            while len(self._order) > self.max_entries:
+                self._remove(next(iter(self._order)))
+
+    def invalidate(self):
+        with self._lock:
+            self._buckets.clear()
+            self._order.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._order),
+        }
+
+
+_response_cache = None
+
+
+def get_response_cache(create: bool = True) -> Optional[SemanticResponseCache]:
+    """
+    Shared cache instance (None unless RESPONSE_CACHE_ENABLED is set)
+    """
+    global _response_cache
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    if _response_cache is None and create:
+        _response_cache = SemanticResponseCache()
+    return _response_cache
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field
-from typing import Optional, List
+from typing import Optional, List, Dict
 from datetime import datetime
 
 class AddressCreate(BaseModel):
@@ -171,6 +171,8 @@ class ChatbotResponse(BaseModel):
     selected_cars_info: Optional[List[CarResponse]] = None
     session_id: Optional[str] = None  # Session ID for conversation tracking
     context_used: Optional[str] = None  # What historical context was used
+    prompt_tokens: Optional[int] = None  # Size of the LLM prompt (None when no LLM call was made)
+    timings: Optional[Dict[str, float]] = None  # Per-stage latency in ms (only with ?debug=true)
 
 # Car-specific chatbot schemas
 class CarSpecificChatbotRequest(BaseModel):
@@ -185,6 +187,8 @@ class CarSpecificChatbotResponse(BaseModel):
     session_id: Optional[str] = None  # Session ID for conversation tracking
     context_used: Optional[str] = None  # What historical context was used
     specialized_context: Optional[str] = None  # Car-specific context used
+    prompt_tokens: Optional[int] = None  # Size of the LLM prompt (None when no LLM call was made)
+    timings: Optional[Dict[str, float]] = None  # Per-stage latency in ms (only with ?debug=true)
 
 # Chat history schemas
 class ConversationSummary(BaseModel):
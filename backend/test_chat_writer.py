@@ -0,0 +1,125 @@
+"""
+Test the write-behind queue for chat turns
+"""
+import os
+import tempfile
+
+from sqlalchemy import event
+from sqlmodel import Session, select
+
+from chat_writer import ChatWriter
+from conftest import count, make_memory
+from models import ChatConversation, ChatMemoryEntry, ChatMessage
+
+
+def test_turns_stored_in_batches():
+    memory, engine, user_id = make_memory(on_disk=True)
+    commits = []
+    event.listen(engine, "commit", lambda conn: commits.append(1))
+
+    writer = ChatWriter(memory=memory, batch_size=10, flush_ms=5000)
+    writer.start()
+    for i in range(25):
+        writer.submit(user_id, f"What is the price of the X{i % 7}?", f"Answer {i}", session_id="s1")
+    assert writer.stats()["queue_depth"] > 0
+    writer.stop()
+
+    # Two full batches as they filled up, the rest on shutdown
+    stats = writer.stats()
+    assert (stats["queue_depth"], stats["written"], stats["batches"], stats["sync_writes"]) == (0, 25, 3, 0)
+    assert len(commits) == 3
+    assert count(engine, ChatMessage) == 25
+    assert count(engine, ChatMemoryEntry) == 25
+    assert count(engine, ChatConversation) == 1
+    with Session(engine) as session:
+        messages = session.exec(select(ChatMessage).order_by(ChatMessage.id)).all()
+        assert [m.response for m in messages] == [f"Answer {i}" for i in range(25)]
+    assert memory.get_relevant_context(user_id, "price of the X5")
+    print("✅ Queued turns are stored in batches and drained on shutdown")
+
+
+def test_flushed_after_interval():
+    memory, engine, user_id = make_memory(on_disk=True)
+    writer = ChatWriter(memory=memory, batch_size=100, flush_ms=20)
+    writer.start()
+    writer.submit(user_id, "Compare the X5 and the X3", "The X5 is larger.")
+    for _ in range(100):
+        if writer.stats()["written"]:
+            break
+        writer._thread.join(0.01)
+    assert writer.stats()["written"] == 1
+    writer.stop()
+    print("✅ A partial batch is stored after flush_ms")
+
+
+def test_journal_replayed_after_crash():
+    memory, engine, user_id = make_memory(on_disk=True)
+    journal_path = os.path.join(tempfile.mkdtemp(), "chat_journal.jsonl")
+
+    # A writer that dies before it can store anything (its queue is lost)
+    crashed = ChatWriter(memory=memory, batch_size=100, flush_ms=60000, journal_path=journal_path)
+    crashed.start()
+    crashed.submit(user_id, "What is the price of the X5?", "The X5 starts at $65,000.", selected_cars=["3"])
+    crashed.submit(user_id, "Tell me about the Z4", "The Z4 is a roadster.")
+    crashed._queue.clear()
+    crashed.stop()
+    assert count(engine, ChatMessage) == 0
+
+    writer = ChatWriter(memory=memory, batch_size=100, flush_ms=10, journal_path=journal_path)
+    assert writer.start() == 2
+    writer.stop()
+    assert count(engine, ChatMessage) == 2
+    with Session(engine) as session:
+        assert session.exec(select(ChatMessage).order_by(ChatMessage.id)).first().selected_cars == '["3"]'
+    # Stored turns are dropped from the journal
+    assert os.path.getsize(journal_path) == 0
+    print("✅ Journaled turns are replayed on startup")
+
+
+def test_only_unstored_turns_replayed():
+    memory, engine, user_id = make_memory(on_disk=True)
+    journal_path = os.path.join(tempfile.mkdtemp(), "chat_journal.jsonl")
+
+    # The first batch is stored and checkpointed, the third turn is lost with the queue
+    crashed = ChatWriter(memory=memory, batch_size=2, flush_ms=60000, journal_path=journal_path)
+    crashed.start()
+    for i in range(3):
+        crashed.submit(user_id, f"What is the price of the X{i}?", f"Answer {i}")
+    for _ in range(100):
+        if crashed.stats()["written"] == 2:
+            break
+        crashed._thread.join(0.01)
+    with crashed._cond:
+        crashed._queue.clear()
+    crashed.stop()
+    with open(journal_path) as f:
+        assert sum('"checkpoint"' in line for line in f) >= 1
+
+    writer = ChatWriter(memory=memory, batch_size=100, flush_ms=10, journal_path=journal_path)
+    assert writer.start() == 1
+    writer.stop()
+    with Session(engine) as session:
+        messages = session.exec(select(ChatMessage).order_by(ChatMessage.id)).all()
+        assert [m.response for m in messages] == ["Answer 0", "Answer 1", "Answer 2"]
+    assert os.path.getsize(journal_path) == 0
+    print("✅ Only turns past the last journal checkpoint are replayed")
+
+
+def test_synchronous_when_not_running_or_full():
+    memory, engine, user_id = make_memory(on_disk=True)
+    writer = ChatWriter(memory=memory, max_queue=0)
+    writer.submit(user_id, "Recommend a family car", "The X5.")
+    writer.start()
+    writer.submit(user_id, "Recommend a family car", "The X7.")
+    writer.stop()
+    assert count(engine, ChatMessage) == 2
+    assert writer.stats()["sync_writes"] == 2
+    print("✅ Turns are written synchronously when the queue is unavailable")
+
+
+if __name__ == "__main__":
+    test_turns_stored_in_batches()
+    test_flushed_after_interval()
+    test_journal_replayed_after_crash()
+    test_only_unstored_turns_replayed()
+    test_synchronous_when_not_running_or_full()
@@ -0,0 +1,109 @@
+"""
+Test the persistent query-embedding cache
+"""
+import asyncio
+import os
+import tempfile
+import threading
+
+import numpy as np
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from embedding_cache import CachedQueryEmbeddings, QueryEmbeddingCache, normalize_query
+
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    """Fake embeddings that count embed_query calls"""
+    queries: int = 0
+
+    def embed_query(self, text):
+        self.queries += 1
+        return super().embed_query(text)
+
+
+def test_normalize_query():
+    assert normalize_query("  What is the price of X5?  ") == "what is the price of x5"
+    assert normalize_query("what is   the price\nof x5") == "what is the price of x5"
+    print("✅ Query normalization")
+
+
+def test_repeated_queries_skip_embedding_and_survive_restart():
+    base = CountingEmbeddings(size=8)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cache.db")
+        cached = CachedQueryEmbeddings(base, QueryEmbeddingCache(path), namespace="test")
+
+        first = cached.embed_query("What is the price of X5?")
+        second = cached.embed_query("what is the price of x5")
+        assert base.queries == 1
+        assert np.allclose(first, second)
+        assert cached.cache.stats()["hits"] == 1
+        assert cached.cache.stats()["misses"] == 1
+
+        # A new cache instance over the same file still has the entry
+        restarted = CachedQueryEmbeddings(base, QueryEmbeddingCache(path), namespace="test")
+        restarted.embed_query("what is the price of x5")
+        assert base.queries == 1
+    print("✅ Repeated queries are served from the persistent cache")
+
+
+def test_lru_eviction_by_size():
+    with tempfile.TemporaryDirectory() as tmp:
+        # Each 8-dim float32 vector is 32 bytes plus the key
+        cache = QueryEmbeddingCache(os.path.join(tmp, "cache.db"), max_bytes=120)
+        cache.put("a", [0.0] * 8)
+        cache.put("b", [1.0] * 8)
+        cache.get("a")  # "a" is now most recently used
+        cache.put("c", [2.0] * 8)
+        cache.put("d", [3.0] * 8)
+
+        assert cache.stats()["bytes"] <= 120
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.get("d") is not None
+    print("✅ Least recently used entries are evicted beyond max_bytes")
+
+
+def test_hits_do_not_write_per_lookup():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = QueryEmbeddingCache(os.path.join(tmp, "cache.db"), touch_batch=3)
+        for key in "abc":
+            cache.put(key, [0.0] * 8)
+        changes = cache._conn.total_changes
+        cache.get("a")
+        cache.get("b")
+        cache.get("a")
+        assert cache._conn.total_changes == changes  # LRU positions held in memory
+        cache.get("c")
+        assert cache._conn.total_changes == changes + 3  # One batched UPDATE of the three keys
+        cache.get("a")
+        cache.flush()
+        assert cache._conn.total_changes == changes + 4
+    print("✅ LRU touches on hits are written in batches")
+
+
+def test_async_lookups_off_the_event_loop():
+    base = CountingEmbeddings(size=8)
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = QueryEmbeddingCache(os.path.join(tmp, "cache.db"))
+        threads = []
+        get = cache.get
+        cache.get = lambda key: threads.append(threading.get_ident()) or get(key)
+        cached = CachedQueryEmbeddings(base, cache, namespace="test")
+
+        async def run():
+            await cached.aembed_query("What is the price of X5?")
+            return await cached.aembed_query("what is the price of x5")
+
+        assert asyncio.run(run()) == cached.embed_query("what is the price of x5")
+        assert base.queries == 1
+        assert threading.get_ident() not in threads[:2]
+    print("✅ Async lookups run the SQLite I/O in a worker thread")
+
+
+if __name__ == "__main__":
+    test_normalize_query()
+    test_repeated_queries_skip_embedding_and_survive_restart()
+    test_lru_eviction_by_size()
+    test_hits_do_not_write_per_lookup()
+    test_async_lookups_off_the_event_loop()
@@ -0,0 +1,55 @@
+"""
+Test the deterministic fake LLM and embedding backends
+"""
+import asyncio
+import time
+
+import numpy as np
+
+from fake_backends import FakeEmbeddings, FakeLLM
+
+
+def test_fake_llm_is_deterministic():
+    llm = FakeLLM(response_tokens=30)
+    first = llm.invoke("What is the price of the X5?")
+    assert first == llm.invoke("What is the price of the X5?")
+    assert first != llm.invoke("What is the price of the X3?")
+    assert "".join(llm.stream("What is the price of the X5?")) == first
+    assert len(list(llm.stream("hi"))) == 30
+    print("✅ Fake LLM output depends only on the prompt")
+
+
+def test_fake_llm_latency_profile():
+    llm = FakeLLM(first_token_ms=100, tokens_per_second=100, response_tokens=11)
+
+    async def run():
+        start = time.perf_counter()
+        first_token_at = None
+        async for _ in llm.astream("hi"):
+            if first_token_at is None:
+                first_token_at = time.perf_counter() - start
+        return first_token_at, time.perf_counter() - start
+
+    first_token, total = asyncio.run(run())
+    # 100 ms to the first token, then 10 more tokens at 10 ms each
+    assert 0.09 <= first_token < 0.15
+    assert 0.19 <= total < 0.3
+    print(f"✅ Fake LLM paced: first token {first_token * 1000:.0f} ms, total {total * 1000:.0f} ms")
+
+
+def test_fake_embeddings():
+    embeddings = FakeEmbeddings(size=64)
+    vector = embeddings.embed_query("x5 price")
+    assert len(vector) == 64
+    assert np.isclose(np.linalg.norm(vector), 1.0)
+    assert vector == asyncio.run(embeddings.aembed_query("x5 price"))
+    assert embeddings.embed_documents(["x5 price", "i4 range"])[0] == vector
+    assert embeddings.embed_query("i4 range") != vector
+    print("✅ Fake embeddings are deterministic unit vectors")
+
+
+if __name__ == "__main__":
+    test_fake_llm_is_deterministic()
+    test_fake_llm_latency_profile()
+    test_fake_embeddings()
+    print("🎉 All fake backend tests passed!")
@@ -0,0 +1,117 @@
+"""
+Test the LLM concurrency limiter
+"""
+import asyncio
+
+from fastapi import HTTPException
+
+from llm_limiter import LLMConcurrencyLimiter
+
+
+def test_limits_in_flight_calls():
+    limiter = LLMConcurrencyLimiter(max_concurrent=2, max_queue=10, queue_timeout=None)
+    peak = 0
+
+    async def fake_llm_call():
+        nonlocal peak
+        async with limiter.slot():
+            peak = max(peak, limiter.in_flight)
+            await asyncio.sleep(0.01)
+
+    async def run():
+        await asyncio.gather(*(fake_llm_call() for _ in range(8)))
+
+    asyncio.run(run())
+
+    assert peak == 2
+    assert limiter.in_flight == 0
+    assert limiter.waiting == 0
+    print("✅ In-flight LLM calls bounded by max_concurrent")
+
+
+def test_rejects_when_queue_full():
+    limiter = LLMConcurrencyLimiter(max_concurrent=1, max_queue=1, queue_timeout=None, retry_after=7)
+
+    async def run():
+        release = asyncio.Event()
+
+        async def hold_slot():
+            async with limiter.slot():
+                await release.wait()
+
+        holder = asyncio.create_task(hold_slot())
+        queued = asyncio.create_task(hold_slot())
+        await asyncio.sleep(0)
+
+        try:
+            await limiter.acquire()
+            raise AssertionError("Expected the limiter to reject the request")
+        except HTTPException as e:
+            assert e.status_code == 503
+            assert e.headers["Retry-After"] == "7"
+
+        release.set()
+        await asyncio.gather(holder, queued)
+
+    asyncio.run(run())
+    assert limiter.in_flight == 0
+    print("✅ Requests beyond the queue bound get 503 with Retry-After")
+
+
+def test_queue_timeout():
+    limiter = LLMConcurrencyLimiter(max_concurrent=1, max_queue=5, queue_timeout=0.01)
+
+    async def run():
+        await limiter.acquire()
+        try:
+            await limiter.acquire()
+            raise AssertionError("Expected the queued request to time out")
+        except HTTPException as e:
+            assert e.status_code == 503
+        finally:
+            limiter.release()
+
+    asyncio.run(run())
+    assert limiter.waiting == 0
+    print("✅ Queued requests time out with 503")
+
+
+def test_no_permits_lost_to_timeouts_or_cancellation():
+    limiter = LLMConcurrencyLimiter(max_concurrent=2, max_queue=1000, queue_timeout=0.001)
+
+    async def call():
+        try:
+            async with limiter.slot():
+                await asyncio.sleep(0.001)
+        except HTTPException:
+            pass
+
+    async def run():
+        # Timeouts racing releases
+        await asyncio.gather(*(call() for _ in range(300)))
+        # Waiters cancelled while queued
+        await limiter.acquire()
+        await limiter.acquire()
+        limiter.queue_timeout = 10
+        waiters = [asyncio.create_task(limiter.acquire()) for _ in range(5)]
+        await asyncio.sleep(0)
+        limiter.release()
+        for waiter in waiters:
+            waiter.cancel()
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+        for result in results:
+            if result is None:  # Got the released slot before the cancel
+                limiter.release()
+        limiter.release()
+
+    asyncio.run(run())
+    assert (limiter.in_flight, limiter.waiting) == (0, 0)
+    assert limiter._semaphore._value == 2
+    print("✅ Timed out or cancelled waiters never keep a slot")
+
+
+if __name__ == "__main__":
+    test_limits_in_flight_calls()
+    test_rejects_when_queue_full()
+    test_queue_timeout()
+    test_no_permits_lost_to_timeouts_or_cancellation()
@@ -0,0 +1,95 @@
+"""
+Test the per-user hot memory cache
+"""
+from datetime import datetime
+
+from sqlalchemy import event
+
+from chat_memory_controller import ChatMemoryController
+from conftest import make_memory
+from memory_cache import CachedMemory, UserMemoryCache
+
+
+def entry(message_id: int) -> CachedMemory:
+    return CachedMemory(message_id, 0, 0, "general", 0.5, 0, None, "hi", None, datetime.utcnow())
+
+
+def test_active_user_served_without_queries():
+    cache = UserMemoryCache(max_entries=100, max_user_entries=50)
+    cached, engine, user_id = make_memory(cache)
+    uncached = ChatMemoryController(engine=engine)
+    cached.store_message(user_id, "What is the price of the X5?", "The X5 starts at $65,000.")
+    cached.store_message(user_id, "Tell me about the Z4 interior", "The Z4 has a two-seat cabin.")
+
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    cached.get_relevant_context(user_id, "price of the X5")  # Loads the user's window
+    assert len(statements) == 1
+
+    # Write-through: the new turn is visible without reading the database
+    cached.store_message(user_id, "How much does the X5 M cost?", "Around $108,000.")
+    statements.clear()
+    context = cached.get_relevant_context(user_id, "price of the X5")
+    assert statements == []
+    assert context == uncached.get_relevant_context(user_id, "price of the X5")
+    assert [c["message"] for c in context][:2] == ["What is the price of the X5?", "How much does the X5 M cost?"]
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 3)
+    assert stats["hit_ratio"] == 0.5 and stats["bytes"] > 0
+    print("✅ Context for an active user comes from the cache, kept current write-through")
+
+
+def test_batched_writes_update_cache():
+    cache = UserMemoryCache()
+    cached, engine, user_id = make_memory(cache)
+    uncached = ChatMemoryController(engine=engine)
+    assert cached.get_relevant_context(user_id, "price of the X5") == []
+    now = datetime.utcnow()
+    cached.store_messages([
+        {"user_id": user_id, "user_message": "Compare the X5 and the X3", "bot_response": "The X5 is larger.", "created_at": now},
+        {"user_id": user_id, "user_message": "What is the price of the X5?", "bot_response": "About $65,000.", "created_at": now},
+    ])
+    assert cache.stats()["entries"] == 2
+    assert cached.get_relevant_context(user_id, "price of the X5") == uncached.get_relevant_context(user_id, "price of the X5")
+    print("✅ Batched writes are added to cached users")
+
+
+def test_lru_eviction_by_total_entries():
+    cache = UserMemoryCache(max_entries=5, max_user_entries=3)
+    assert cache.put(1, [entry(1), entry(2)], cache.begin_load())
+    assert cache.put(2, [entry(3), entry(4)], cache.begin_load())
+    assert cache.get(1) is not None  # User 1 is now the most recently used
+    assert cache.put(3, [entry(5), entry(6)], cache.begin_load())
+
+    assert cache.get(2) is None
+    assert cache.get(1) is not None and cache.get(3) is not None
+    assert cache.stats()["entries"] == 4 and cache.stats()["evictions"] == 1
+
+    # Too many entries for one user: not cached, and not reloaded every turn
+    assert not cache.put(4, [entry(i) for i in range(4)], cache.begin_load())
+    assert cache.is_oversized(4)
+    cache.add(1, [entry(7), entry(8)])
+    assert cache.get(1) is None and cache.is_oversized(1)
+    print("✅ Users evicted least recently used first; oversized users skipped")
+
+
+def test_load_racing_a_write_not_cached():
+    cache = UserMemoryCache()
+    token = cache.begin_load()
+    cache.add(1, [entry(1)])  # Stored while the load was reading
+    assert not cache.put(1, [], token)
+    assert cache.put(1, [entry(1)], cache.begin_load())
+
+    token = cache.begin_load()
+    cache.invalidate()
+    assert not cache.put(2, [], token)
+    assert cache.put(2, [], cache.begin_load())
+    print("✅ Loads that raced a write or invalidation are not cached")
+
+
+if __name__ == "__main__":
+    test_active_user_served_without_queries()
+    test_batched_writes_update_cache()
+    test_lru_eviction_by_total_entries()
+    test_load_racing_a_write_not_cached()
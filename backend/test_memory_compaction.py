@@ -0,0 +1,133 @@
+"""
+Test chat memory retention and compaction
+"""
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+from sqlmodel import Session, select
+
+from chat_memory_controller import GUEST_USER_ID, ChatMemoryController, keyword_mask
+from conftest import count, make_memory
+from memory_cache import UserMemoryCache
+from memory_compaction import SUMMARY_PREFIX, MemoryCompactor
+from models import ChatMemoryEntry, ChatMemoryModel, ChatMemoryTerm
+
+
+def turn(user_id, message, response, days_ago, session_id="s1", minutes_ago=0):
+    return {
+        "user_id": user_id, "user_message": message, "bot_response": response, "session_id": session_id,
+        "created_at": datetime.utcnow() - timedelta(days=days_ago, minutes=minutes_ago)
+    }
+
+
+def seed(memory, user_id):
+    memory.store_messages([
+        turn(user_id, "Tell me about the 5 Series", "The 5 Series is a midsize sedan.", 200, session_id="old"),
+        turn(user_id, "What is the price of the X5?", "The X5 starts at $65,000.", 12),
+        turn(user_id, "Compare the X5 and the X3", "The X5 is larger than the X3.", 11),
+        turn(user_id, "What is the price of the X5?", "Still $65,000.", 10),
+        turn(user_id, "Does the Z4 have a manual?", "No, the Z4 is automatic only.", 1),
+        turn(GUEST_USER_ID, "Recommend a family car", "The X7.", 0, session_id="guest", minutes_ago=600),
+    ])
+
+
+def test_dry_run_reports_without_changes():
+    memory, engine, user_id = make_memory(guest=True, on_disk=True)
+    seed(memory, user_id)
+    compactor = MemoryCompactor(memory=memory, retention_days=90, summarize_after_days=7, vacuum=False)
+
+    report = compactor.run(dry_run=True)
+    assert (report["expired_entries"], report["summarized_entries"], report["summaries"]) == (2, 3, 1)
+    assert report["bytes_reclaimed"] > 0 and report["table_bytes_before"] > 0
+    assert count(engine, ChatMemoryEntry) == 6
+    assert compactor.stats()["runs"] == 0
+
+    # The real run does what the dry run reported
+    actual = compactor.run()
+    for key in ("expired_entries", "summarized_entries", "summaries", "index_rows_deleted", "bytes_reclaimed"):
+        assert actual[key] == report[key], key
+    print("✅ Dry run reports the entries and space a compaction would reclaim")
+
+
+def test_expired_removed_and_old_entries_summarized():
+    cache = UserMemoryCache()
+    memory, engine, user_id = make_memory(cache, guest=True, on_disk=True)
+    seed(memory, user_id)
+    assert memory.get_relevant_context(user_id, "price of the X5")  # Loads the user into the cache
+    archive_path = os.path.join(tempfile.mkdtemp(), "archive.jsonl")
+    compactor = MemoryCompactor(memory=memory, retention_days=90, summarize_after_days=7, archive_path=archive_path)
+
+    report = compactor.run()
+    assert report["vacuumed"] and report["archived"] == 5
+    assert cache.stats()["users"] == 0  # Invalidated
+
+    # The 200 day old entry and the guest's expired entry are gone; three old turns became one summary
+    with Session(engine) as session:
+        entries = session.exec(select(ChatMemoryEntry).order_by(ChatMemoryEntry.created_at)).all()
+        assert len(entries) == 2
+        summary, recent = entries
+        assert summary.is_summary and not recent.is_summary
+        assert summary.content == SUMMARY_PREFIX + "Compare the X5 and the X3; What is the price of the X5?"
+        assert json.loads(summary.keywords) == ["compare", "price", "x3", "x5"]
+        assert summary.keyword_mask == keyword_mask(["compare", "price", "x3", "x5"])
+        assert json.loads(summary.car_models_mentioned) == ["x3", "x5"]
+        assert summary.intent == "pricing" and round(summary.importance_score, 2) == 0.9
+
+    # Index rows follow the entries
+    assert count(engine, ChatMemoryTerm, ChatMemoryTerm.entry_id == summary.id) == 4
+    assert count(engine, ChatMemoryTerm) + count(engine, ChatMemoryModel) == (4 + 1) + (2 + 1)
+    with open(archive_path) as f:
+        assert sorted(json.loads(line)["archive_reason"] for line in f) == ["expired"] * 2 + ["summarized"] * 3
+
+    # Summaries are found like any entry, from the database and from the cache
+    uncached = ChatMemoryController(engine=engine)
+    for controller in (uncached, memory, memory):
+        context = controller.get_relevant_context(user_id, "price of the X5")
+        assert context[0]["message"] == summary.content and context[0]["response"] is None
+    print("✅ Expired entries removed and old entries merged into a summary")
+
+
+def test_compaction_repeatable():
+    memory, engine, user_id = make_memory(guest=True, on_disk=True)
+    seed(memory, user_id)
+    compactor = MemoryCompactor(memory=memory, retention_days=90, summarize_after_days=7, vacuum=False)
+    compactor.run()
+    assert compactor.run()["summarized_entries"] == 0
+
+    # Entries that age later are merged into the existing summary
+    memory.store_messages([turn(user_id, "What are the specs of the M3?", "The M3 has 473 hp.", 9)])
+    report = compactor.run()
+    assert (report["summarized_entries"], report["summaries"]) == (2, 1)
+    with Session(engine) as session:
+        summary = session.exec(select(ChatMemoryEntry).where(ChatMemoryEntry.is_summary.is_(True))).one()
+        assert summary.content.endswith("; What are the specs of the M3?")
+        assert "m3" in json.loads(summary.car_models_mentioned)
+    assert compactor.stats()["summaries_created"] == 2
+    print("✅ Compaction can run repeatedly; newly aged entries join the summary")
+
+
+def test_sqlite_full_vacuum_only_on_request():
+    statements = {}
+    for full_vacuum in (False, True):
+        memory, engine, user_id = make_memory(guest=True, on_disk=True)
+        seed(memory, user_id)
+        run = statements[full_vacuum] = []
+        event.listen(engine, "before_cursor_execute", lambda conn, cursor, sql, *args, run=run: run.append(sql))
+        report = MemoryCompactor(memory=memory, retention_days=90, summarize_after_days=7, full_vacuum=full_vacuum).run()
+        assert report["vacuumed"]
+
+    # The scheduled job analyzes and frees pages incrementally; VACUUM locks the whole file
+    assert "VACUUM" not in statements[False] and "VACUUM" in statements[True]
+    for run in statements.values():
+        assert any(sql.startswith("ANALYZE") for sql in run)
+    print("✅ SQLite is only rebuilt with VACUUM when asked for")
+
+
+if __name__ == "__main__":
+    test_dry_run_reports_without_changes()
+    test_expired_removed_and_old_entries_summarized()
+    test_compaction_repeatable()
+    test_sqlite_full_vacuum_only_on_request()
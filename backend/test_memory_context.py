@@ -0,0 +1,186 @@
+"""
+Test chat memory context retrieval against an isolated database
+"""
+import json
+import random
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from sqlalchemy import event, insert
+from sqlmodel import Session, create_engine, select
+
+import chat_memory_controller
+from chat_memory_controller import ChatMemoryController, keyword_mask, model_mask, score_candidates
+from conftest import count, make_memory
+from models import ChatConversation, ChatMemoryEntry, ChatMemoryTerm, ChatMessage
+
+
+def test_relevant_context_in_one_query():
+    memory, engine, user_id = make_memory()
+    memory.store_message(user_id, "What is the price of the X5?", "The X5 starts at $65,000.")
+    memory.store_message(user_id, "Tell me about the Z4 interior", "The Z4 has a two-seat cabin.")
+    memory.store_message(user_id, "How much does the X5 M cost?", "Around $108,000.")
+
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    context = memory.get_relevant_context(user_id, "price of the X5", limit=2)
+
+    # Candidate ranking, then the top messages - not one query per result
+    assert len(statements) == 2
+    assert [c["message"] for c in context] == ["What is the price of the X5?", "How much does the X5 M cost?"]
+    assert context[0]["response"] == "The X5 starts at $65,000."
+    assert context[0]["cars_mentioned"] == ["x5"]
+    assert context[0]["intent"] == "pricing"
+    assert context[0]["timestamp"] is not None
+    assert context[0]["relevance_score"] >= context[1]["relevance_score"]
+    print("✅ Context fetched with a constant number of queries")
+
+
+def test_store_message_in_one_transaction():
+    memory, engine, user_id = make_memory()
+    commits, statements = [], []
+    event.listen(engine, "commit", lambda conn: commits.append(1))
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2].lstrip().upper()))
+
+    conversation_id = memory.store_message(user_id, "Compare the X5 and the X3", "The X5 is larger.", session_id="s1")
+
+    # One commit, and no reads once writing has started (no refresh round-trips)
+    assert len(commits) == 1
+    first_write = next(i for i, sql in enumerate(statements) if not sql.startswith("SELECT"))
+    assert not any(sql.startswith("SELECT") for sql in statements[first_write:])
+
+    assert memory.store_message(user_id, "What is the price of the X3?", "About $48,000.", session_id="s1") == conversation_id
+    assert len(commits) == 2
+    with Session(engine) as session:
+        assert session.get(ChatConversation, conversation_id).title.startswith("Comparing")
+    assert count(engine, ChatMessage) == 2
+    assert count(engine, ChatMemoryEntry) == 2
+    print("✅ Each chat turn is stored with a single commit")
+
+
+def test_context_scoped_to_user():
+    memory, engine, user_id = make_memory()
+    memory.store_message(user_id, "What is the price of the X5?", "The X5 starts at $65,000.")
+
+    assert memory.get_relevant_context(user_id + 1, "price of the X5") == []
+    print("✅ Other users' memory is not returned")
+
+
+def test_guest_memory_scoped_to_session():
+    memory, engine, _ = make_memory(guest=True)
+    guest = chat_memory_controller.GUEST_USER_ID
+    memory.store_message(guest, "What is the price of the X5?", "The X5 starts at $65,000.", session_id="guest-a")
+    memory.store_message(guest, "Compare the X5 and the X3", "The X5 is larger.", session_id="guest-b")
+
+    assert [c["message"] for c in memory.get_relevant_context(guest, "price of the X5", session_id="guest-a")] == [
+        "What is the price of the X5?"
+    ]
+    assert [c["message"] for c in memory.get_relevant_context(guest, "price of the X5", session_id="guest-b")] == [
+        "Compare the X5 and the X3"
+    ]
+    assert memory.get_relevant_context(guest, "price of the X5") == []
+    assert count(engine, ChatConversation) == 2
+
+    # Only the session's latest entries are read, in one query
+    for i in range(chat_memory_controller.GUEST_MEMORY_MAX_ENTRIES + 5):
+        memory.store_message(guest, f"What is the price of the 2015 X5? ({i})", "About $40,000.", session_id="guest-a")
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    context = memory.get_relevant_context(guest, "price of the X5", limit=50, session_id="guest-a")
+    assert len(statements) == 1
+    assert len(context) == chat_memory_controller.GUEST_MEMORY_MAX_ENTRIES
+    assert "What is the price of the X5?" not in [c["message"] for c in context]
+    print("✅ Guest memory is scoped to the session and bounded")
+
+
+def test_indexed_ranking_matches_full_scan():
+    memory, engine, user_id = make_memory()
+    rng = random.Random(7)
+    models = ["X5", "X3", "3 Series", "5 Series", "M3", "Z4"]
+    questions = ["What is the price of the {}?", "Compare the {} and the {}", "horsepower of the 2015 {}",
+                 "Should I buy the {} or the {}?", "Tell me about the {} interior", "Recommend a family car"]
+    for _ in range(120):
+        question = rng.choice(questions).format(*rng.sample(models, 2))
+        memory.store_message(user_id, question, f"The {rng.choice(models)} is great. " * rng.randint(1, 20))
+
+    with Session(engine) as session:
+        entries = session.exec(select(ChatMemoryEntry)).all()
+    for query in ["price of the X5", "compare the 3 series and the m3", "Which BMW is best?", "hello"]:
+        keywords = memory.extract_keywords(query)
+        full_scan = sorted(
+            (score for score in (memory.calculate_relevance_score(e, keywords, query) for e in entries) if score > 0.1),
+            reverse=True
+        )[:5]
+        indexed = [c["relevance_score"] for c in memory.get_relevant_context(user_id, query)]
+        assert [round(s, 6) for s in indexed] == [round(s, 6) for s in full_scan], query
+    print("✅ Index-based candidates rank like a full scan of the user's entries")
+
+
+def test_backfill_indexes_older_entries():
+    memory, engine, user_id = make_memory()
+    memory.store_message(user_id, "What is the price of the X5?", "The X5 starts at $65,000.")
+
+    # Simulate an entry written before the index tables existed
+    with Session(engine) as session:
+        entry = session.exec(select(ChatMemoryEntry)).first()
+        session.execute(insert(ChatMemoryEntry), [{
+            "user_id": user_id, "conversation_id": entry.conversation_id, "message_id": entry.message_id,
+            "content": "old", "keywords": json.dumps(["price", "x3"]), "intent": "pricing",
+            "car_models_mentioned": json.dumps(["x3"]), "importance_score": 0.5
+        }])
+        session.commit()
+
+    assert memory.backfill_memory_index() == 1
+    assert memory.backfill_memory_index() == 0
+    assert memory.backfill_memory_masks() == 1
+    assert memory.backfill_memory_masks() == 0
+    assert count(engine, ChatMemoryTerm) == 4
+    with Session(engine) as session:
+        old = session.exec(select(ChatMemoryEntry).where(ChatMemoryEntry.content == "old")).one()
+        assert old.keyword_mask == keyword_mask(["price", "x3"])
+        assert old.model_mask == model_mask(["x3"])
+    print("✅ Backfill indexes entries stored before the index tables and mask columns")
+
+
+def test_vectorized_scores_match_per_entry_scores():
+    memory = ChatMemoryController(engine=create_engine("sqlite://"))
+    rng = random.Random(3)
+    now = datetime.utcnow()
+    entries = []
+    for _ in range(200):
+        keywords = rng.sample(chat_memory_controller.KEYWORD_VOCABULARY, rng.randint(0, 4))
+        models = rng.sample(chat_memory_controller.CAR_MODEL_VOCABULARY, rng.randint(0, 3))
+        entries.append(ChatMemoryEntry(
+            user_id=1, conversation_id=1, message_id=1, content="",
+            keywords=json.dumps(keywords), car_models_mentioned=json.dumps(models),
+            keyword_mask=keyword_mask(keywords), model_mask=model_mask(models),
+            intent=rng.choice(["pricing", "comparison", "general"]),
+            importance_score=rng.choice([0.5, 0.7, 1.0]),
+            created_at=now - timedelta(hours=rng.randint(0, 40 * 24))
+        ))
+
+    for query in ["compare the x5 and the 2015 m3 price", "hello"]:
+        keywords = memory.extract_keywords(query)
+        models = memory.extract_car_models(query)
+        expected = [memory.calculate_relevance_score(e, keywords, query) for e in entries]
+        scores = score_candidates(
+            np.array([e.keyword_mask for e in entries], dtype=np.int64),
+            np.array([e.model_mask for e in entries], dtype=np.int64),
+            np.array([e.intent for e in entries], dtype=object) == memory.classify_intent(query),
+            np.array([(now - e.created_at).days for e in entries]),
+            np.array([e.importance_score for e in entries]),
+            keyword_mask(keywords), model_mask(models)
+        )
+        assert np.allclose(scores, expected)
+    print("✅ Vectorized bitmask scoring matches the per-entry score")
+
+
+if __name__ == "__main__":
+    test_relevant_context_in_one_query()
+    test_store_message_in_one_transaction()
+    test_context_scoped_to_user()
+    test_guest_memory_scoped_to_session()
+    test_indexed_ranking_matches_full_scan()
+    test_backfill_indexes_older_entries()
+    test_vectorized_scores_match_per_entry_scores()
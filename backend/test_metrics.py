@@ -0,0 +1,80 @@
+"""
+Test the Prometheus metrics exposition
+"""
+from sqlalchemy import create_engine, text
+
+import metrics
+from timing import StageHistogram
+
+
+def _samples(output: str) -> dict:
+    samples = {}
+    for line in output.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+
+def test_request_counts_and_latency():
+    metrics.request_started("/api/chatbot")
+    in_flight = _samples(metrics.render_metrics())
+    assert in_flight["autocare_chat_requests_in_flight"] >= 1
+
+    metrics.request_finished("/api/chatbot", "POST", "/api/chatbot", 200, 0.3)
+    metrics.request_started("/api/cars/7")
+    metrics.request_finished("/api/cars/7", "GET", "/api/cars/{car_id}", 404, 0.002)
+
+    samples = _samples(metrics.render_metrics())
+    assert samples['autocare_http_requests_total{method="POST",route="/api/chatbot",status="200"}'] >= 1
+    assert samples['autocare_http_requests_total{method="GET",route="/api/cars/{car_id}",status="404"}'] >= 1
+    assert samples['autocare_http_request_duration_seconds_bucket{method="POST",route="/api/chatbot",le="0.25"}'] == 0
+    assert samples['autocare_http_request_duration_seconds_bucket{method="POST",route="/api/chatbot",le="0.5"}'] >= 1
+    assert samples["autocare_chat_requests_in_flight"] == in_flight["autocare_chat_requests_in_flight"] - 1
+    print("✅ Request counts, latency histograms and in-flight gauges by route")
+
+
+def test_histogram_is_cumulative_in_seconds():
+    histogram = StageHistogram(buckets=(10, 100))
+    for ms in (5, 50, 50, 500):
+        histogram.observe(ms)
+
+    writer = metrics._Writer()
+    writer.histogram("test_seconds", histogram, {"stage": "prefill"})
+    samples = _samples(writer.render())
+
+    assert samples['test_seconds_bucket{stage="prefill",le="0.01"}'] == 1
+    assert samples['test_seconds_bucket{stage="prefill",le="0.1"}'] == 3
+    assert samples['test_seconds_bucket{stage="prefill",le="+Inf"}'] == 4
+    assert samples['test_seconds_sum{stage="prefill"}'] == 0.605
+    assert samples['test_seconds_count{stage="prefill"}'] == 4
+    print("✅ Histograms exported cumulative, in seconds")
+
+
+def test_db_pool_instrumentation():
+    engine = create_engine("sqlite://")
+    metrics.instrument_engine(engine)
+    before = _samples(metrics.render_metrics())
+
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+        during = _samples(metrics.render_metrics())
+    after = _samples(metrics.render_metrics())
+
+    assert after["autocare_db_pool_checkouts_total"] == before["autocare_db_pool_checkouts_total"] + 1
+    assert during["autocare_db_pool_checked_out"] == before["autocare_db_pool_checked_out"] + 1
+    assert after["autocare_db_pool_checked_out"] == before["autocare_db_pool_checked_out"]
+    assert after["autocare_db_pool_wait_seconds_count"] == before["autocare_db_pool_wait_seconds_count"] + 1
+    print("✅ DB pool checkouts and wait time")
+
+
+def test_label_values_escaped():
+    assert metrics._labels({"route": 'a"b\\c'}) == '{route="a\\"b\\\\c"}'
+    print("✅ Label values escaped")
+
+
+if __name__ == "__main__":
+    test_request_counts_and_latency()
+    test_histogram_is_cumulative_in_seconds()
+    test_db_pool_instrumentation()
+    test_label_values_escaped()
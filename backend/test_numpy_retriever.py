@@ -0,0 +1,78 @@
+"""
+Test the in-process NumPy exact-kNN retriever
+"""
+import tempfile
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from numpy_retriever import NumpyRetriever, NumpyVectorIndex
+from vector import content_hash
+
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    """Fake embeddings that count how many documents were embedded"""
+    embedded: int = 0
+
+    def embed_documents(self, texts):
+        self.embedded += len(texts)
+        return super().embed_documents(texts)
+
+
+def make_documents(texts):
+    return [
+        Document(page_content=text, metadata={"content_hash": content_hash(text)}, id=f"doc_{i}")
+        for i, text in enumerate(texts)
+    ]
+
+
+def test_exact_top_k_matches_brute_force():
+    embeddings = CountingEmbeddings(size=32)
+    documents = make_documents([f"BMW model number {i}" for i in range(20)])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = NumpyVectorIndex(tmp).load()
+        index.sync(documents, embeddings)
+
+        assert index.matrix.dtype == np.float32
+        assert index.matrix.flags["C_CONTIGUOUS"]
+        assert np.allclose(np.linalg.norm(index.matrix, axis=1), 1.0, atol=1e-5)
+
+        retriever = NumpyRetriever(index=index, embeddings=embeddings, k=3)
+        results = retriever.invoke("BMW model number 7")
+
+        # Reference: cosine similarity computed one document at a time
+        query = np.array(embeddings.embed_query("BMW model number 7"))
+        expected = sorted(
+            documents,
+            key=lambda d: -np.dot(query, embeddings.embed_query(d.page_content))
+            / (np.linalg.norm(query) * np.linalg.norm(embeddings.embed_query(d.page_content)))
+        )[:3]
+        assert [d.id for d in results] == [d.id for d in expected]
+        assert results[0].id == "doc_7"
+    print("✅ NumPy retriever returns the exact cosine top-k")
+
+
+def test_reload_is_memory_mapped_and_incremental():
+    embeddings = CountingEmbeddings(size=16)
+    documents = make_documents(["X5 SUV", "3 Series sedan", "Z4 roadster"])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        NumpyVectorIndex(tmp).load().sync(documents, embeddings)
+        assert embeddings.embedded == 3
+
+        reloaded = NumpyVectorIndex(tmp).load()
+        assert isinstance(reloaded.matrix, np.memmap)
+        assert [d.id for d in reloaded.documents] == ["doc_0", "doc_1", "doc_2"]
+
+        changed = documents[:2] + make_documents(["", "", "i4 gran coupe"])[2:]
+        stats = reloaded.sync(changed, embeddings)
+        assert stats == {"added": 0, "updated": 1, "removed": 0, "unchanged": 2}
+        assert embeddings.embedded == 4
+    print("✅ Index reloads memory-mapped and re-embeds only changed rows")
+
+
+if __name__ == "__main__":
+    test_exact_top_k_matches_brute_force()
+    test_reload_is_memory_mapped_and_incremental()
@@ -0,0 +1,237 @@
+"""
+Test the Ollama endpoint pool against local stub Ollama servers
+"""
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from fastapi import HTTPException
+from ollama import ResponseError
+
+from ollama_pool import OllamaPoolLLM
+
+
+class StubOllama:
+    """Minimal Ollama API: /api/tags and streaming /api/generate"""
+    def __init__(self, reply="hello from stub", delay=0.0):
+        self.reply = reply
+        self.delay = delay
+        self.fail = False
+        self.fail_status = 500
+        self.generate_calls = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if stub.fail:
+                    self.send_response(500)
+                    self.end_headers()
+                    return
+                body = json.dumps({"models": []}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                stub.generate_calls += 1
+                if stub.fail:
+                    body = json.dumps({"error": "stub failure"}).encode()
+                    self.send_response(stub.fail_status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                time.sleep(stub.delay)
+                lines = [{"model": "llama3.2", "response": word + " ", "done": False} for word in stub.reply.split()]
+                lines.append({"model": "llama3.2", "response": "", "done": True, "done_reason": "stop"})
+                body = "".join(json.dumps(line) + "\n" for line in lines).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def make_pool(*urls, **kwargs):
+    return OllamaPoolLLM(base_urls=list(urls), model="llama3.2", **kwargs)
+
+
+def test_requests_are_spread_across_endpoints():
+    a, b = StubOllama("from a"), StubOllama("from b")
+    try:
+        pool = make_pool(a.url, b.url)
+        replies = {pool.invoke("hi").strip() for _ in range(4)}
+        assert replies == {"from a", "from b"}
+        assert a.generate_calls == 2 and b.generate_calls == 2
+        assert all(e["outstanding"] == 0 for e in pool.stats())
+    finally:
+        a.stop()
+        b.stop()
+    print("✅ Idle endpoints share the load")
+
+
+def test_least_outstanding_routing():
+    slow, fast = StubOllama("slow", delay=0.3), StubOllama("fast")
+    try:
+        pool = make_pool(slow.url, fast.url)
+
+        async def run():
+            # The first request ties and goes to the slow box...
+            busy = asyncio.create_task(pool.ainvoke("hi"))
+            await asyncio.sleep(0.1)
+            # ...so requests made while it is in flight avoid it
+            others = [await pool.ainvoke("hi") for _ in range(2)]
+            return [await busy] + others
+
+        replies = [r.strip() for r in asyncio.run(run())]
+        assert replies == ["slow", "fast", "fast"]
+        assert slow.generate_calls == 1 and fast.generate_calls == 2
+    finally:
+        slow.stop()
+        fast.stop()
+    print("✅ Requests go to the endpoint with the fewest outstanding requests")
+
+
+def test_failover_and_circuit_breaker():
+    bad, good = StubOllama(), StubOllama("from good")
+    bad.fail = True
+    try:
+        pool = make_pool(bad.url, good.url, failure_threshold=2, cooldown_seconds=60)
+        for _ in range(4):
+            assert pool.invoke("hi").strip() == "from good"
+        # Two failures open the circuit; afterwards the bad endpoint is skipped entirely
+        assert bad.generate_calls == 2
+        assert pool.stats()[0]["circuit"] == "open"
+
+        streamed = "".join(pool.stream("hi")).strip()
+        assert streamed == "from good"
+    finally:
+        bad.stop()
+        good.stop()
+    print("✅ Failed endpoints fail over and trip their circuit breaker")
+
+
+def test_client_errors_do_not_fail_over():
+    missing, good = StubOllama(), StubOllama("from good")
+    missing.fail, missing.fail_status = True, 404
+    try:
+        pool = make_pool(missing.url, good.url, failure_threshold=1)
+        try:
+            pool.invoke("hi")
+            assert False, "Expected the 404 to reach the caller"
+        except ResponseError as e:
+            assert e.status_code == 404
+        assert good.generate_calls == 0
+        stats = pool.stats()[0]
+        assert (stats["failures"], stats["circuit"], stats["outstanding"]) == (0, "closed", 0)
+    finally:
+        missing.stop()
+        good.stop()
+    print("✅ Client errors are raised without failing over or tripping the circuit")
+
+
+def test_health_check_does_not_close_open_circuit():
+    flaky = StubOllama("from flaky")
+    flaky.fail = True
+    try:
+        pool = make_pool(flaky.url, failure_threshold=1, cooldown_seconds=0.3)
+        try:
+            pool.invoke("hi")
+            assert False, "Expected 503 once the only endpoint fails"
+        except HTTPException as e:
+            assert e.status_code == 503
+        assert pool.stats()[0]["circuit"] == "open"
+
+        # The box answers /api/tags again, but the circuit waits out its cooldown
+        flaky.fail = False
+        pool.check_health()
+        assert pool.stats()[0]["circuit"] == "open"
+
+        time.sleep(0.35)
+        assert pool.stats()[0]["circuit"] == "half_open"
+        assert pool.invoke("hi").strip() == "from flaky"
+        assert pool.stats()[0]["circuit"] == "closed"
+    finally:
+        flaky.stop()
+    print("✅ Health checks leave open circuits to the half-open trial")
+
+
+def test_only_the_trial_closes_the_circuit():
+    stub = StubOllama()
+    try:
+        pool = make_pool(stub.url, failure_threshold=1, cooldown_seconds=0.2)
+        # Three requests in flight when the circuit opens
+        fast, slow, failing = (pool._acquire(set()) for _ in range(3))
+        pool._release(*failing, ConnectionError("down"))
+        assert pool.stats()[0]["circuit"] == "open"
+
+        # A request sent before the circuit opened does not close it
+        pool._release(*fast)
+        assert pool.stats()[0]["circuit"] == "open"
+
+        time.sleep(0.25)
+        trial = pool._acquire(set())
+        assert trial[1] and pool._acquire(set()) == (None, False)
+        # ...and failing does not let a second trial through
+        pool._release(*slow, ConnectionError("down"))
+        assert pool._acquire(set()) == (None, False)
+
+        pool._release(*trial)
+        assert pool.stats()[0]["circuit"] == "closed"
+        assert (pool.stats()[0]["outstanding"], pool.stats()[0]["failures"]) == (0, 2)
+    finally:
+        stub.stop()
+    print("✅ Only the half-open trial request closes the circuit")
+
+
+def test_health_checks_and_all_down():
+    a, b = StubOllama("from a"), StubOllama("from b")
+    pool = make_pool(a.url, b.url)
+    try:
+        b.stop()
+        pool.check_health()
+        assert [e["healthy"] for e in pool.stats()] == [True, False]
+        assert {pool.invoke("hi").strip() for _ in range(3)} == {"from a"}
+
+        a.fail = True
+        pool.check_health()
+        try:
+            pool.invoke("hi")
+            assert False, "Expected 503 with no healthy endpoints"
+        except HTTPException as e:
+            assert e.status_code == 503 and "Retry-After" in e.headers
+
+        a.fail = False
+        pool.check_health()
+        assert pool.invoke("hi").strip() == "from a"
+    finally:
+        a.stop()
+    print("✅ Health checks take endpoints out of rotation and back")
+
+
+if __name__ == "__main__":
+    test_requests_are_spread_across_endpoints()
+    test_least_outstanding_routing()
+    test_failover_and_circuit_breaker()
+    test_client_errors_do_not_fail_over()
+    test_health_check_does_not_close_open_circuit()
+    test_only_the_trial_closes_the_circuit()
+    test_health_checks_and_all_down()
+    print("🎉 All Ollama pool tests passed!")
@@ -0,0 +1,71 @@
+"""
+Test prompt token budgeting and context packing
+"""
+from langchain_core.documents import Document
+
+from prompt_budget import count_tokens, get_prompt_tokens, pack_prompt, summarize_response
+
+LONG_RESPONSE = """## BMW X5 Overview
+
+The **2019 BMW X5 xDrive40i** is a *luxurious* midsize SUV. It has plenty of room for the family.
+
+| Spec | Value |
+|---|---|
+| Horsepower | 335 hp |
+
+- Panoramic roof
+- Adaptive suspension
+
+> Would you like to schedule a test drive?
+""" * 20
+
+
+def render(entry, response):
+    return f"Customer: {entry['message']}\nYour response: {response}"
+
+
+def test_summarize_response_strips_markdown():
+    summary = summarize_response(LONG_RESPONSE, max_tokens=40)
+    assert count_tokens(summary) <= 40
+    assert summary.startswith("BMW X5 Overview The 2019 BMW X5 xDrive40i is a luxurious midsize SUV.")
+    assert "|" not in summary and "**" not in summary
+    print("✅ Past responses are condensed to plain text within budget")
+
+
+def test_pack_prompt_respects_budget():
+    documents = [Document(page_content="Model Name: X5\n" + "spec line " * 300, id=f"doc_{i}") for i in range(3)]
+    history = [{"message": f"question {i}", "response": LONG_RESPONSE} for i in range(3)]
+
+    data, memory, stats = pack_prompt(
+        instructions="You are Grace. {data} {conversation_history}",
+        fixed_text="What is the X5 price?",
+        documents=documents,
+        history_entries=history,
+        render_entry=render,
+        max_tokens=1500,
+        memory_max_tokens=300
+    )
+
+    assert stats["prompt_tokens"] <= 1500
+    assert stats["memory_tokens"] <= 300
+    assert get_prompt_tokens() == stats["prompt_tokens"]
+    # Most recent interactions win, kept oldest first
+    assert "question 2" in memory and "Document(" not in data
+    assert data.startswith("Model Name: X5")
+    print(f"✅ Packed prompt fits the budget: {stats}")
+
+
+def test_small_inputs_are_untouched():
+    documents = [Document(page_content="Model Name: i4", id="i4")]
+    history = [{"message": "hi", "response": "Hello! How can I help?"}]
+    data, memory, stats = pack_prompt("Instructions", "question", documents, history, render)
+    assert data == "Model Name: i4"
+    assert memory == "Customer: hi\nYour response: Hello! How can I help?"
+    print("✅ Prompts under budget are not truncated")
+
+
+if __name__ == "__main__":
+    test_summarize_response_strips_markdown()
+    test_pack_prompt_respects_budget()
+    test_small_inputs_are_untouched()
+    print("🎉 All prompt budget tests passed!")
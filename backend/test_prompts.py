@@ -0,0 +1,66 @@
+"""
+Test the versioned prompt registry
+"""
+from langchain_core.language_models.fake import FakeListLLM
+
+from prompt_budget import count_tokens
+from prompts import PromptRegistry, prompt_registry
+
+
+def test_chains_are_built_once_per_model():
+    model = FakeListLLM(responses=["ok"])
+    memory = prompt_registry.get("memory")
+    assert memory.chain(model) is memory.chain(model)
+    assert memory.chain(FakeListLLM(responses=["ok"])) is not memory.chain(model)
+    assert memory.instruction_tokens > 0
+    print("✅ Chains are cached per model")
+
+
+def test_instruction_tokens_counted_on_first_use():
+    # Registering a prompt (as importing prompts.py does) must not load the tokenizer
+    version = PromptRegistry().register("greeting", "v1", "Hello {name}, how can I help?")
+    assert version._instruction_tokens is None
+    assert version.instruction_tokens == count_tokens(version.template)
+    print("✅ Instruction tokens are counted lazily")
+
+
+def test_versions_can_be_swapped():
+    registry = PromptRegistry()
+    registry.register("greeting", "v1", "Hello {name}")
+    registry.register("greeting", "v2", "Hi {name}!")
+    assert registry.get("greeting").version == "v1"
+
+    registry.activate("greeting", "v2")
+    model = FakeListLLM(responses=["ok"])
+    rendered = registry.get("greeting").chain(model).first.invoke({"name": "Grace"})
+    assert rendered.to_string() == "Human: Hi Grace!"
+    assert registry.versions() == {"greeting": {"active": "v2", "versions": ["v1", "v2"]}}
+
+    try:
+        registry.activate("greeting", "v3")
+        assert False, "Unknown version should raise"
+    except KeyError:
+        pass
+    print("✅ Active prompt versions can be swapped at runtime")
+
+
+def test_active_templates_start_with_static_prefix():
+    for name in ("general", "memory", "car_specific"):
+        prompt = prompt_registry.get(name)
+        prefix = prompt.template[:prompt.template.index("{")]
+        # The instructions, not the request data, make up most of the prompt template
+        assert len(prefix) > 0.75 * len(prompt.template), name
+
+        variables = prompt.prompt.input_variables
+        first = prompt.prompt.invoke({v: "first" for v in variables}).to_string()
+        second = prompt.prompt.invoke({v: "second turn" for v in variables}).to_string()
+        assert first.startswith("Human: " + prefix) and second.startswith("Human: " + prefix)
+    print("✅ Active templates share a byte-identical instruction prefix")
+
+
+if __name__ == "__main__":
+    test_chains_are_built_once_per_model()
+    test_instruction_tokens_counted_on_first_use()
+    test_versions_can_be_swapped()
+    test_active_templates_start_with_static_prefix()
+    print("🎉 All prompt registry tests passed!")
@@ -0,0 +1,100 @@
+"""
+Test the structured query router's message parsing
+"""
+from query_router import parse_car_query
+
+CATALOG = [
+    ("3 Series", "330i"),
+    ("3 Series", "M3"),
+    ("3 Series", "M3 Competition"),
+    ("M3", "E46"),
+    ("M3", "E92"),
+    ("X5", "xDrive40i"),
+    ("X5", "M Competition"),
+    ("X3", "M Competition"),
+    ("i4", "eDrive40"),
+]
+
+
+def test_spec_lookup_for_trim_and_year():
+    query = parse_car_query("What's the horsepower of the 2023 M3 Competition?", CATALOG)
+    assert query.pairs == [("3 Series", "M3 Competition")]
+    assert query.min_year == query.max_year == 2023
+    assert query.spec_fields == ["horsepower_hp"]
+    assert not query.needs_llm
+    print("✅ Longest trim match wins and the year is parsed")
+
+
+def test_model_and_trim_combine():
+    query = parse_car_query("x5 m competition 0-100 time", CATALOG)
+    assert query.pairs == [("X5", "M Competition")]
+    assert query.spec_fields == ["acceleration_0_100_s"]
+
+    # "M3" is both a model and a 3 Series trim
+    query = parse_car_query("price of the m3", CATALOG)
+    assert set(query.pairs) == {("M3", "E46"), ("M3", "E92"), ("3 Series", "M3")}
+    print("✅ Model and trim matches are combined")
+
+
+def test_price_and_body_constraints():
+    query = parse_car_query("Show me SUVs under $60,000", CATALOG)
+    assert query.is_list_query and query.has_constraints()
+    assert query.max_price == 60000
+    assert query.body_types == ["Coupe SUV", "SUV"]
+    assert query.order_by == "base_msrp_usd"
+
+    query = parse_car_query("which electric cars between 40k and 70k after 2021", CATALOG)
+    assert (query.min_price, query.max_price) == (40000, 70000)
+    assert query.engine_types == ["Electric"]
+    assert query.min_year == 2022 and query.max_year is None
+
+    query = parse_car_query("list cars with over 500 hp", CATALOG)
+    assert query.min_horsepower == 500 and query.min_price is None
+    print("✅ Price, horsepower, year and body constraints are parsed")
+
+
+def test_judgement_questions_go_to_llm():
+    assert parse_car_query("Compare the X5 and X3 horsepower", CATALOG).needs_llm
+    assert parse_car_query("Which SUV under $70k should I buy?", CATALOG).needs_llm
+    assert not parse_car_query("i4 electric range", CATALOG).needs_llm
+    assert parse_car_query("i4 electric range", CATALOG).engine_types == []
+    print("✅ Comparisons and recommendations are left to the LLM")
+
+
+def test_only_whole_lookups_skip_the_llm():
+    # "m" in "I'm" is not the trim "M"
+    query = parse_car_query("I'm looking for something with good range", CATALOG + [("X5", "M")])
+    assert query.pairs == [] and query.needs_llm
+
+    # Part lookup, part judgement: the model answers the whole question
+    query = parse_car_query("horsepower of the X5 xDrive40i and how does it handle in snow?", CATALOG)
+    assert query.pairs == [("X5", "xDrive40i")] and query.needs_llm
+    assert query.unparsed_words == ["handle", "snow"]
+
+    query = parse_car_query("What is the X5 xDrive40i's horsepower?", CATALOG)
+    assert query.pairs == [("X5", "xDrive40i")] and not query.needs_llm
+    print("✅ Only messages that are entirely a lookup skip the LLM")
+
+
+def test_plural_types_and_unknown_bounds():
+    # A plural body type is a list query on its own
+    query = parse_car_query("SUVs under $60,000", CATALOG)
+    assert query.is_list_query and not query.needs_llm
+    assert query.max_price == 60000 and query.body_types == ["Coupe SUV", "SUV"]
+
+    # 400 is neither a price nor horsepower: the bound is not dropped silently
+    query = parse_car_query("electric cars with range over 400", CATALOG)
+    assert query.needs_llm and "400" in query.unparsed_words
+    assert query.min_price is None and query.min_horsepower is None
+    assert parse_car_query("cars between 300 and 500 km of range", CATALOG).needs_llm
+    print("✅ Plural types list cars; bounds that cannot be parsed go to the LLM")
+
+
+if __name__ == "__main__":
+    test_spec_lookup_for_trim_and_year()
+    test_model_and_trim_combine()
+    test_price_and_body_constraints()
+    test_judgement_questions_go_to_llm()
+    test_only_whole_lookups_skip_the_llm()
+    test_plural_types_and_unknown_bounds()
+    print("🎉 All query router tests passed!")
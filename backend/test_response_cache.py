@@ -0,0 +1,57 @@
+"""
+Test the semantic response cache
+"""
+import time
+
+from response_cache import SemanticResponseCache
+
+
+def test_similar_query_with_same_documents_hits():
+    cache = SemanticResponseCache(similarity_threshold=0.95, ttl_seconds=60)
+    cache.store([1.0, 0.0, 0.0], ["doc_a", "doc_b"], [], "The X5 starts at $65,000")
+
+    assert cache.lookup([0.99, 0.05, 0.0], ["doc_a", "doc_b"], []) == "The X5 starts at $65,000"
+    # Too dissimilar
+    assert cache.lookup([0.5, 0.5, 0.5], ["doc_a", "doc_b"], []) is None
+    # Same query but retrieval returned different documents
+    assert cache.lookup([1.0, 0.0, 0.0], ["doc_a", "doc_c"], []) is None
+    # Same query but with selected cars
+    assert cache.lookup([1.0, 0.0, 0.0], ["doc_a", "doc_b"], [7]) is None
+
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 3
+    print("✅ Cache hits require similar embeddings, same documents and same cars")
+
+
+def test_ttl_expiry():
+    cache = SemanticResponseCache(ttl_seconds=0)
+    cache.store([1.0, 0.0], ["doc_a"], [], "cached")
+    time.sleep(0.01)
+    assert cache.lookup([1.0, 0.0], ["doc_a"], []) is None
+    assert cache.stats()["entries"] == 0
+    print("✅ Entries expire after the TTL")
+
+
+def test_reindex_invalidates():
+    cache = SemanticResponseCache()
+    cache.store([1.0, 0.0], ["doc_a"], [], "old catalog answer", index_version=1)
+    assert cache.lookup([1.0, 0.0], ["doc_a"], [], index_version=1) == "old catalog answer"
+    assert cache.lookup([1.0, 0.0], ["doc_a"], [], index_version=2) is None
+    print("✅ A new index version drops cached responses")
+
+
+def test_max_entries_evicts_oldest():
+    cache = SemanticResponseCache(max_entries=2)
+    cache.store([1.0, 0.0], ["doc_a"], [], "first")
+    cache.store([0.0, 1.0], ["doc_a"], [], "second")
+    cache.store([1.0, 0.0], ["doc_b"], [], "third")
+    assert cache.lookup([1.0, 0.0], ["doc_a"], []) is None
+    assert cache.lookup([0.0, 1.0], ["doc_a"], []) == "second"
+    print("✅ Oldest entries are evicted beyond max_entries")
+
+
+if __name__ == "__main__":
+    test_similar_query_with_same_documents_hits()
+    test_ttl_expiry()
+    test_reindex_invalidates()
+    test_max_entries_evicts_oldest()
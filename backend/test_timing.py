@@ -0,0 +1,86 @@
+"""
+Test per-stage request timing
+"""
+import asyncio
+import contextvars
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+import timing
+from timing import StageHistogram, get_request_timings, record, server_timing_header, start_request_timing, timed
+
+
+def test_stages_add_up_per_request():
+    def run():
+        start_request_timing()
+        with timed("retrieval"):
+            time.sleep(0.01)
+        record("prefill", 5)
+        record("prefill", 7)
+        return get_request_timings()
+
+    timings = contextvars.copy_context().run(run)
+
+    assert list(timings) == ["retrieval", "prefill"]
+    assert timings["retrieval"] >= 10
+    assert timings["prefill"] == 12
+    print("✅ Stage times recorded per request and repeated stages summed")
+
+
+def test_not_recorded_outside_a_request():
+    def run():
+        record("prefill", 5)
+        return get_request_timings()
+
+    assert contextvars.Context().run(run) is None
+    print("✅ Stages outside a timed request only feed the histograms")
+
+
+def test_threadpool_and_decorated_stages():
+    @timed("memory_store")
+    def store():
+        time.sleep(0.005)
+        return "stored"
+
+    async def run():
+        timings = start_request_timing()
+        assert await run_in_threadpool(store) == "stored"
+        return timings
+
+    timings = asyncio.run(run())
+    assert timings["memory_store"] >= 5
+    print("✅ Decorated stages in worker threads land in the request breakdown")
+
+
+def test_histogram_buckets_and_quantiles():
+    histogram = StageHistogram(buckets=(10, 100, 1000))
+    for ms in [5] * 50 + [50] * 45 + [500] * 4 + [5000]:
+        histogram.observe(ms)
+
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 100
+    assert snapshot["buckets"] == {"10": 50, "100": 45, "1000": 4, "+Inf": 1}
+    assert histogram.quantile(0.5) == 10
+    assert histogram.quantile(0.95) == 100
+    assert histogram.quantile(0.99) == 1000
+    assert StageHistogram().quantile(0.5) is None
+    print("✅ Histogram buckets and approximate quantiles")
+
+
+def test_global_histograms_and_header():
+    before = timing._histogram("test_stage").count
+    record("test_stage", 3)
+    assert timing.get_stage_summaries()["test_stage"]["count"] == before + 1
+
+    header = server_timing_header({"retrieval": 12.34, "prefill": 150.0}, total_ms=200)
+    assert header == "retrieval;dur=12.3, prefill;dur=150.0, total;dur=200.0"
+    print("✅ Process-wide histograms and Server-Timing header")
+
+
+if __name__ == "__main__":
+    test_stages_add_up_per_request()
+    test_not_recorded_outside_a_request()
+    test_threadpool_and_decorated_stages()
+    test_histogram_buckets_and_quantiles()
+    test_global_histograms_and_header()
@@ -0,0 +1,121 @@
+"""
+Test incremental (content-hash) indexing of the car dataset
+"""
+import tempfile
+import threading
+
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+import vector
+from models import Car
+from vector import content_hash, get_car_documents, load_car_documents, sync_vector_store
+
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    """Fake embeddings that count how many documents were embedded"""
+    embedded: int = 0
+
+    def embed_documents(self, texts):
+        self.embedded += len(texts)
+        return super().embed_documents(texts)
+
+
+def make_document(doc_id, text):
+    return Document(page_content=text, metadata={"content_hash": content_hash(text)}, id=doc_id)
+
+
+def test_load_car_documents_have_stable_ids_and_hashes():
+    documents = load_car_documents()
+    ids = [document.id for document in documents]
+
+    assert len(ids) == len(set(ids))
+    assert documents[0].id == "3 Series_2000_318i"
+    assert documents[0].metadata["content_hash"] == content_hash(documents[0].page_content)
+    print(f"✅ {len(documents)} documents with unique stable IDs")
+
+
+def test_sync_only_embeds_changes():
+    embeddings = CountingEmbeddings(size=16)
+    with tempfile.TemporaryDirectory() as tmp:
+        store = Chroma(collection_name="test_cars", persist_directory=tmp, embedding_function=embeddings)
+
+        documents = [make_document(f"car_{i}", f"Car number {i}") for i in range(5)]
+        stats = sync_vector_store(store, documents)
+        assert stats == {"added": 5, "updated": 0, "removed": 0, "unchanged": 0}
+        assert embeddings.embedded == 5
+
+        # Second sync with no changes embeds nothing
+        stats = sync_vector_store(store, documents)
+        assert stats["unchanged"] == 5
+        assert embeddings.embedded == 5
+
+        # One changed, one removed, one new
+        changed = documents[:3] + [make_document("car_3", "Car number 3, facelift"), make_document("car_9", "Car number 9")]
+        stats = sync_vector_store(store, changed)
+        assert stats == {"added": 1, "updated": 1, "removed": 1, "unchanged": 3}
+        assert embeddings.embedded == 7
+        assert sorted(store.get()["ids"]) == ["car_0", "car_1", "car_2", "car_3", "car_9"]
+    print("✅ Incremental sync embeds only new or changed rows")
+
+
+def test_legacy_row_ids_are_migrated_without_embedding():
+    embeddings = CountingEmbeddings(size=16)
+    with tempfile.TemporaryDirectory() as tmp:
+        store = Chroma(collection_name="test_cars", persist_directory=tmp, embedding_function=embeddings)
+        # The original indexer: row numbers as IDs, indented text, no content hash
+        legacy = ["Model Name: X5\n        Model Year: 2020", "Model Name: Z4\n        Model Year: 2019"]
+        store.add_documents([Document(page_content=text, id=str(i)) for i, text in enumerate(legacy)], ids=["0", "1"])
+        assert embeddings.embedded == 2
+
+        documents = [
+            make_document("X5_2020_xDrive40i", "Model Name: X5\nModel Year: 2020"),
+            make_document("Z4_2019_M40i", "Model Name: Z4\nModel Year: 2019, facelift"),
+        ]
+        stats = sync_vector_store(store, documents)
+        assert (stats["added"], stats["removed"], stats["unchanged"]) == (1, 2, 1)
+        assert embeddings.embedded == 3  # Only the changed row
+        assert sorted(store.get()["ids"]) == ["X5_2020_xDrive40i", "Z4_2019_M40i"]
+        assert sync_vector_store(store, documents)["unchanged"] == 2
+    print("✅ Legacy row-number IDs are migrated without re-embedding unchanged rows")
+
+
+def test_car_documents_are_fetched_by_id():
+    documents = {document.id: document for document in load_car_documents()}
+
+    car = Car(model_name="X5", model_year=2019, trim_variant="xDrive40i", body_type="SUV", engine_type="Petrol", cylinders="6")
+    fetched = get_car_documents(car)
+    assert fetched[0].page_content == documents["X5_2019_xDrive40i"].page_content
+    assert len(fetched) == 3
+    assert all(d.metadata["body_type"] == "SUV" and d.metadata["model_name"] != "X5" for d in fetched[1:])
+
+    # Cars missing from the dataset are rendered from the row itself
+    car = Car(model_name="X9", model_year=2030, trim_variant="Concept", body_type="SUV", engine_type="Electric",
+              cylinders="0", horsepower_hp=700)
+    fetched = get_car_documents(car, include_siblings=False)
+    assert len(fetched) == 1 and fetched[0].id == "X9_2030_Concept"
+    assert "Horsepower: 700 hp" in fetched[0].page_content
+    print("✅ Car-specific documents are looked up without a similarity search")
+
+
+def test_car_documents_not_blocked_by_indexing():
+    # Indexing holds _init_lock while it embeds the dataset; the catalog has its own lock
+    vector._set_catalog_documents([])
+    car = Car(model_name="X5", model_year=2019, trim_variant="xDrive40i", body_type="SUV", engine_type="Petrol", cylinders="6")
+    fetched = []
+    with vector._init_lock:
+        thread = threading.Thread(target=lambda: fetched.extend(get_car_documents(car)))
+        thread.start()
+        thread.join(10)
+        assert not thread.is_alive()
+    assert fetched[0].id == "X5_2019_xDrive40i"
+    print("✅ Car-specific documents are served while the index is being built")
+
+
+if __name__ == "__main__":
+    test_load_car_documents_have_stable_ids_and_hashes()
+    test_sync_only_embeds_changes()
+    test_legacy_row_ids_are_migrated_without_embedding()
+    test_car_documents_are_fetched_by_id()
+    test_car_documents_not_blocked_by_indexing()
@@ -0,0 +1,140 @@
+"""
+Per-stage latency of chat requests
+
+Each request gets a dict of stage -> milliseconds in a context variable
+(started by the middleware in main.py). Code on the request path wraps its
+stages in timed("stage"), which adds the elapsed time to the request's
+breakdown and to a process-wide histogram per stage. The breakdown is
+returned in the Server-Timing header, and in the response body on request.
+
+Stages: route (catalog query router), cars (selected car lookup),
+memory_context / memory_store (chat memory), retrieval (vector search or car
+documents), cache (response cache lookup), prompt (prompt packing),
+llm_queue (waiting for an LLM slot), prefill (time to first token) and
+decode (remaining generation).
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+# Histogram bucket upper bounds in milliseconds (the last bucket is +Inf)
+BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("stage_timings", default=None)
+
+
+class StageHistogram:
+    """
+    Fixed-bucket latency histogram (thread-safe; stages are timed in worker threads too)
+    """
+    def __init__(self, buckets=BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, ms: float):
+        index = next((i for i, bound in enumerate(self.buckets) if ms <= bound), len(self.buckets))
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum_ms += ms
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-th observation (None if empty or in +Inf)"""
+        with self._lock:
+            if not self.count:
+                return None
+            rank = q * self.count
+            seen = 0
+            for bound, count in zip(self.buckets, self.counts):
+                seen += count
+                if seen >= rank:
+                    return bound
+        return None
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "count": self.count,
+                "sum_ms": round(self.sum_ms, 1),
+                "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], self.counts)),
+            }
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "mean_ms": round(self.sum_ms / self.count, 1) if self.count else None,
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+        }
+
+
+_histograms: Dict[str, StageHistogram] = {}
+_histograms_lock = threading.Lock()
+
+
+def _histogram(stage: str) -> StageHistogram:
+    histogram = _histograms.get(stage)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = _histograms.setdefault(stage, StageHistogram())
+    return histogram
+
+
+def start_request_timing() -> Dict[str, float]:
+    """Start a fresh breakdown for the current request and return it"""
+    timings = {}
+    _timings.set(timings)
+    return timings
+
+
+def record(stage: str, ms: float):
+    """Add ms to a stage of the current request (if one is being timed) and its histogram"""
+    timings = _timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + ms
+    _histogram(stage).observe(ms)
+
+
+@contextmanager
+def timed(stage: str):
+    """
+    Time the enclosed block (or decorated function) as a request stage;
+    repeated stages within one request add up
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, (time.perf_counter() - start) * 1000)
+
+
+def get_request_timings() -> Optional[Dict[str, float]]:
+    """Stage breakdown (ms, rounded) of the current request so far, if it is being timed"""
+    timings = _timings.get()
+    if timings is None:
+        return None
+    return {stage: round(ms, 1) for stage, ms in timings.items()}
+
+
+def server_timing_header(timings: Dict[str, float], total_ms: Optional[float] = None) -> str:
+    """Format a breakdown as a Server-Timing header value"""
+    parts = [f"{stage};dur={ms:.1f}" for stage, ms in timings.items()]
+    if total_ms is not None:
+        parts.append(f"total;dur={total_ms:.1f}")
+    return ", ".join(parts)
+
+
+def get_stage_histograms() -> Dict[str, StageHistogram]:
+    with _histograms_lock:
+        return dict(_histograms)
+
+
+def get_stage_summaries() -> Dict[str, dict]:
+    """Count, mean and approximate p50/p95/p99 per stage since startup"""
+    return {stage: histogram.summary() for stage, histogram in sorted(get_stage_histograms().items())}
@@ -1,78 +1,422 @@
-from langchain_ollama import OllamaEmbeddings
-from langchain_chroma import Chroma
-from langchain_core.documents import Document
+import hashlib
 import os
-import pandas as pd
+import threading
+import logging
 
-# Load your new dataset
-csv = pd.read_csv("2000-25.csv")
+from dotenv import load_dotenv
 
-# Initialize embeddings model
-embeddings = OllamaEmbeddings(model="mxbai-embed-large")
+load_dotenv()
 
-# Set database location
+logger = logging.getLogger(__name__)
+
+# Dataset and database locations
+csv_path = "2000-25.csv"
 db_location = "./chroma_db"
+numpy_index_location = "./numpy_index"
+
+# Retriever backend: "chroma" (persistent Chroma collection) or "numpy" (in-process exact kNN)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma").lower()
+
+# Fake embeddings (load testing) get their own index so they never mix with real vectors
+EMBEDDINGS_BACKEND = os.getenv("EMBEDDINGS_BACKEND", "ollama").lower()
+if EMBEDDINGS_BACKEND == "fake":
+    db_location += "_fake"
+    numpy_index_location += "_fake"
+
+# The retriever is built lazily (or by a background startup task) so importing
+# this module never blocks on pandas, Chroma or embedding the dataset
+_retriever = None
+_init_lock = threading.Lock()
+_init_thread = None
+_init_error = None
+_embeddings = None
+last_sync_stats = None
+# Bumped whenever a sync changes the indexed documents (used to invalidate response caches)
+index_version = 0
+# Catalog documents by car ID plus precomputed comparison siblings (car-specific chat).
+# Loaded under their own lock: _init_lock is held while the dataset is embedded
+_documents_by_id = {}
+_siblings_by_id = {}
+_catalog_lock = threading.Lock()
+
+
+def render_car_document(row) -> str:
+    """
+    Render one dataset row as the text that gets embedded
+    """
+    content = f"""
+    Model Name: {row['model_name']}
+    Model Year: {row['model_year']}
+    Trim / Variant: {row['trim_variant']}
+    Body Type: {row['body_type']}
+    Dimensions (LxWxH): {row['length_mm']} x {row['width_mm']} x {row['height_mm']} mm
+    Wheelbase: {row['wheelbase_mm']} mm
+    Curb Weight: {row['curb_weight_kg']} kg
+    Exterior Colors: {row['exterior_colors_available']}
+    Interior Materials & Colors: {row['interior_materials_colors']}
+    Engine Type: {row['engine_type']}
+    Displacement: {row['displacement_cc']} cc
+    Cylinders: {row['cylinders']}
+    Horsepower: {row['horsepower_hp']} hp
+    Torque: {row['torque_nm']} Nm
+    Transmission: {row['transmission']}
+    Drivetrain: {row['drivetrain']}
+    Acceleration (0-100 km/h): {row['acceleration_0_100_s']} s
+    Top Speed: {row['top_speed_kmh']} km/h
+    Fuel Consumption (Combined): {row['fuel_consumption_combined']}
+    CO₂ Emissions: {row['co2_emissions']}
+    Electric Range: {row['electric_range_km']} km
+    Infotainment: {row['infotainment']}
+    Safety Features: {row['safety_features']}
+    Wheel Sizes Available: {row['wheel_sizes_available']}
+    Base MSRP (USD): ${row['base_msrp_usd']}
+    """
+    return "\n".join(line.strip() for line in content.strip().splitlines())
+
+
+def car_document_id(model_name, model_year, trim_variant) -> str:
+    """
+    Stable document ID for a car (same format as Car.get_composite_id)
+    """
+    return f"{model_name}_{model_year}_{trim_variant}"
+
+
+def content_hash(page_content: str) -> str:
+    """SHA-256 of a document's rendered content"""
+    return hashlib.sha256(page_content.encode("utf-8")).hexdigest()
 
-# Check if we need to add documents
-add_documents = not os.path.exists(db_location)
 
-if add_documents:
+def load_car_documents():
+    """
+    Load the dataset as LangChain Documents keyed by stable car IDs,
+    with the content hash stored in metadata
+    """
+    from langchain_core.documents import Document
+    import pandas as pd
+
+    # Load your new dataset
+    csv = pd.read_csv(csv_path)
+
     documents = []
-    ids = []
-
-    for i, row in csv.iterrows():
-        # Build text content from your new columns
-        content = f"""
-        Model Name: {row['model_name']}
-        Model Year: {row['model_year']}
-        Trim / Variant: {row['trim_variant']}
-        Body Type: {row['body_type']}
-        Dimensions (LxWxH): {row['length_mm']} x {row['width_mm']} x {row['height_mm']} mm
-        Wheelbase: {row['wheelbase_mm']} mm
-        Curb Weight: {row['curb_weight_kg']} kg
-        Exterior Colors: {row['exterior_colors_available']}
-        Interior Materials & Colors: {row['interior_materials_colors']}
-        Engine Type: {row['engine_type']}
-        Displacement: {row['displacement_cc']} cc
-        Cylinders: {row['cylinders']}
-        Horsepower: {row['horsepower_hp']} hp
-        Torque: {row['torque_nm']} Nm
-        Transmission: {row['transmission']}
-        Drivetrain: {row['drivetrain']}
-        Acceleration (0-100 km/h): {row['acceleration_0_100_s']} s
-        Top Speed: {row['top_speed_kmh']} km/h
-        Fuel Consumption (Combined): {row['fuel_consumption_combined']}
-        CO₂ Emissions: {row['co2_emissions']}
-        Electric Range: {row['electric_range_km']} km
-        Infotainment: {row['infotainment']}
-        Safety Features: {row['safety_features']}
-        Wheel Sizes Available: {row['wheel_sizes_available']}
-        Base MSRP (USD): ${row['base_msrp_usd']}
-        """
-
-        # Create a LangChain Document
-        document = Document(
-            page_content=content.strip(),
+    for _, row in csv.iterrows():
+        page_content = render_car_document(row)
+        doc_id = car_document_id(row["model_name"], row["model_year"], row["trim_variant"])
+        documents.append(Document(
+            page_content=page_content,
             metadata={
-                "model_name": row["model_name"],
-                "model_year": row["model_year"],
-                "body_type": row["body_type"],
+                "model_name": str(row["model_name"]),
+                "model_year": int(row["model_year"]),
+                "body_type": str(row["body_type"]),
+                "base_msrp_usd": int(row["base_msrp_usd"]) if pd.notna(row["base_msrp_usd"]) else 0,
+                "content_hash": content_hash(page_content),
             },
-            id=str(i)
+            id=doc_id
+        ))
+    return documents
+
+
+def find_siblings(documents, k: int = 2) -> dict:
+    """
+    For each document, the IDs of the k closest other models with the same
+    body type (by price, then year) - used as comparison context
+    """
+    siblings = {}
+    for document in documents:
+        meta = document.metadata
+        price = meta.get("base_msrp_usd") or 0
+        candidates = [
+            other for other in documents
+            if other.metadata["body_type"] == meta["body_type"] and other.metadata["model_name"] != meta["model_name"]
+        ]
+        candidates.sort(key=lambda other: (
+            abs((other.metadata.get("base_msrp_usd") or 0) - price),
+            abs(other.metadata["model_year"] - meta["model_year"])
+        ))
+        siblings[document.id] = [other.id for other in candidates[:k]]
+    return siblings
+
+
+def _set_catalog_documents(documents):
+    global _documents_by_id, _siblings_by_id
+
+    _documents_by_id = {document.id: document for document in documents}
+    _siblings_by_id = find_siblings(documents)
+
+
+def load_catalog():
+    """
+    Load the catalog documents for car-specific chat if they are not loaded yet
+    (independent of building the retriever)
+    """
+    if _documents_by_id:
+        return
+    with _catalog_lock:
+        if not _documents_by_id:
+            _set_catalog_documents(load_car_documents())
+
+
+def _car_record(car) -> dict:
+    """Car row (or CarResponse) as the mapping render_car_document expects"""
+    record = {}
+    for field in (
+        "model_name", "model_year", "trim_variant", "body_type", "length_mm", "width_mm", "height_mm",
+        "wheelbase_mm", "curb_weight_kg", "exterior_colors_available", "interior_materials_colors",
+        "engine_type", "displacement_cc", "cylinders", "horsepower_hp", "torque_nm", "transmission",
+        "drivetrain", "acceleration_0_100_s", "top_speed_kmh", "fuel_consumption_combined", "co2_emissions",
+        "electric_range_km", "infotainment", "safety_features", "wheel_sizes_available", "base_msrp_usd"
+    ):
+        value = getattr(car, field, None)
+        record[field] = ", ".join(value) if isinstance(value, list) else value
+    return record
+
+
+def get_car_documents(car, include_siblings: bool = True):
+    """
+    Catalog documents for a known car without a similarity search: the car's
+    own indexed document (rendered from the row if it is not in the dataset)
+    followed by its precomputed siblings
+    """
+    from langchain_core.documents import Document
+
+    load_catalog()
+
+    doc_id = car_document_id(car.model_name, car.model_year, car.trim_variant)
+    document = _documents_by_id.get(doc_id)
+    if document is None:
+        document = Document(page_content=render_car_document(_car_record(car)), id=doc_id)
+
+    documents = [document]
+    if include_siblings:
+        documents += [_documents_by_id[i] for i in _siblings_by_id.get(doc_id, []) if i in _documents_by_id]
+    return documents
+
+
+def _normalize_content(text: str) -> str:
+    return "\n".join(line.strip() for line in text.strip().splitlines())
+
+
+def _adopt_legacy_documents(vector_store, documents, existing_hashes: dict) -> int:
+    """
+    Copy vectors stored under legacy IDs (the CSV row number, no content hash,
+    from before stable IDs) to the current document with the same text, so
+    the first sync of an old collection does not re-embed the whole catalog.
+    The legacy IDs are then deleted like any other stale ID. Returns the
+    number of documents adopted.
+    """
+    legacy_ids = [doc_id for doc_id, digest in existing_hashes.items() if doc_id.isdigit() and digest is None]
+    if not legacy_ids:
+        return 0
+    legacy = vector_store.get(ids=legacy_ids, include=["documents", "embeddings"])
+    embeddings_by_content = {
+        _normalize_content(text): embedding for text, embedding in zip(legacy["documents"], legacy["embeddings"])
+    }
+    adopted = [
+        document for document in documents
+        if document.id not in existing_hashes and _normalize_content(document.page_content) in embeddings_by_content
+    ]
+    if adopted:
+        vector_store._collection.upsert(
+            ids=[document.id for document in adopted],
+            embeddings=[embeddings_by_content[_normalize_content(document.page_content)] for document in adopted],
+            documents=[document.page_content for document in adopted],
+            metadatas=[document.metadata for document in adopted],
         )
-        ids.append(str(i))
-        documents.append(document)
-
-# Initialize vector store
-vector_store = Chroma(
-    collection_name="bmw_car_data",
-    persist_directory=db_location,
-    embedding_function=embeddings
-)
-
-# Add documents if first time
-if add_documents:
-    vector_store.add_documents(documents, ids=ids)
-
-# Create retriever
-retriever = vector_store.as_retriever(search_kwargs={"k": 3})
+        for document in adopted:
+            existing_hashes[document.id] = document.metadata["content_hash"]
+        logger.info("Reused %d embeddings from legacy row-number IDs", len(adopted))
+    return len(adopted)
+
+
+def sync_vector_store(vector_store, documents) -> dict:
+    """
+    Incrementally bring the vector store in line with documents:
+    only new or changed documents (by content hash) are embedded,
+    and documents that disappeared from the dataset are deleted
+    """
+    existing = vector_store.get(include=["metadatas"])
+    existing_hashes = {
+        doc_id: (metadata or {}).get("content_hash")
+        for doc_id, metadata in zip(existing["ids"], existing["metadatas"])
+    }
+    _adopt_legacy_documents(vector_store, documents, existing_hashes)
+
+    wanted_ids = set()
+    to_upsert = []
+    added = updated = 0
+    for document in documents:
+        wanted_ids.add(document.id)
+        if document.id not in existing_hashes:
+            added += 1
+            to_upsert.append(document)
+        elif existing_hashes[document.id] != document.metadata["content_hash"]:
+            updated += 1
+            to_upsert.append(document)
+
+    to_delete = [doc_id for doc_id in existing_hashes if doc_id not in wanted_ids]
+
+    if to_upsert:
+        vector_store.add_documents(to_upsert, ids=[document.id for document in to_upsert])
+    if to_delete:
+        vector_store.delete(ids=to_delete)
+
+    stats = {
+        "added": added,
+        "updated": updated,
+        "removed": len(to_delete),
+        "unchanged": len(documents) - added - updated,
+    }
+    logger.info("Vector store sync: %s", stats)
+    return stats
+
+
+def create_embeddings():
+    """
+    Embeddings model used for both documents and queries
+    (query embeddings are served from the persistent cache when enabled)
+    """
+    from embedding_cache import CachedQueryEmbeddings, get_query_embedding_cache
+
+    if EMBEDDINGS_BACKEND == "fake":
+        from fake_backends import FakeEmbeddings
+
+        embeddings = FakeEmbeddings.from_env()
+        model = f"fake-{embeddings.size}"
+    else:
+        from langchain_ollama import OllamaEmbeddings
+
+        model = "mxbai-embed-large"
+        embeddings = OllamaEmbeddings(model=model)
+
+    cache = get_query_embedding_cache()
+    if cache is not None:
+        return CachedQueryEmbeddings(embeddings, cache, namespace=model)
+    return embeddings
+
+
+def open_vector_store(embeddings=None):
+    """
+    Open the persistent Chroma collection
+    """
+    from langchain_chroma import Chroma
+
+    # Initialize vector store
+    return Chroma(
+        collection_name="bmw_car_data",
+        persist_directory=db_location,
+        embedding_function=embeddings or create_embeddings()
+    )
+
+
+def build_retriever():
+    """
+    Sync the configured backend with the dataset (embedding only new or
+    changed rows) and return a retriever over it
+    """
+    global _embeddings, last_sync_stats, index_version
+
+    documents = load_car_documents()
+    embeddings = create_embeddings()
+
+    if VECTOR_BACKEND == "numpy":
+        from numpy_retriever import NumpyVectorIndex, NumpyRetriever
+
+        index = NumpyVectorIndex(numpy_index_location).load()
+        stats = index.sync(documents, embeddings)
+        retriever = NumpyRetriever(index=index, embeddings=embeddings, k=3)
+    else:
+        vector_store = open_vector_store(embeddings)
+        stats = sync_vector_store(vector_store, documents)
+
+        # Create retriever
+        retriever = vector_store.as_retriever(search_kwargs={"k": 3})
+
+    if stats["added"] or stats["updated"] or stats["removed"]:
+        index_version += 1
+    _embeddings = embeddings
+    last_sync_stats = stats
+    _set_catalog_documents(documents)
+    return retriever
+
+
+def initialize_retriever():
+    """
+    Build the retriever once; safe to call from several threads
+    """
+    global _retriever, _init_error
+
+    with _init_lock:
+        if _retriever is None:
+            try:
+                _retriever = build_retriever()
+                _init_error = None
+            except Exception as e:
+                _init_error = e
+                logger.exception("Vector store initialization failed")
+                raise
+        return _retriever
+
+
+def start_background_initialization():
+    """
+    Start building the retriever in a background thread (no-op if ready or already running)
+    """
+    global _init_thread
+
+    if is_ready() or (_init_thread is not None and _init_thread.is_alive()):
+        return
+
+    def run():
+        try:
+            # The catalog first: car-specific chat needs it, not the embeddings
+            load_catalog()
+            initialize_retriever()
+        except Exception:
+            # Error is recorded in _init_error; a later call can retry
+            pass
+
+    _init_thread = threading.Thread(target=run, name="vector-store-init", daemon=True)
+    _init_thread.start()
+
+
+def is_ready() -> bool:
+    """Whether the retriever has been built"""
+    return _retriever is not None
+
+
+def get_init_error():
+    """Last initialization error, if any"""
+    return _init_error
+
+
+def get_retriever():
+    """
+    Get the retriever, building it synchronously if it is not ready yet
+    """
+    if _retriever is not None:
+        return _retriever
+    return initialize_retriever()
+
+
+def get_embeddings():
+    """
+    Embeddings client used by the retriever (built together with it)
+    """
+    if _embeddings is None:
+        get_retriever()
+    return _embeddings
+
+
+def reindex() -> dict:
+    """
+    Re-sync the persistent index with the dataset (picks up CSV changes without a rebuild)
+    """
+    global _retriever
+
+    with _init_lock:
+        _retriever = build_retriever()
+    return last_sync_stats
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print("Reindexing car dataset:", reindex())